@@ -0,0 +1,106 @@
+import tarfile
+import zipfile
+from io import BytesIO
+from os import path as o_path
+from os import remove as o_remove
+from os import replace as o_replace
+from time import localtime, time
+from typing import Dict, Optional
+
+from classes.atomic import get_partial_path
+
+# Extension -> archive format, entries are stored uncompressed since audio
+# barely compresses and the point is one cheap sequential write
+ARCHIVE_FORMATS: Dict[str, str] = {".tar": "tar", ".zip": "zip"}
+# Write buffer in front of the archive file, turns many small entries into
+# few large writes
+ARCHIVE_BUFFER_SIZE: int = 8 << 20
+ARCHIVE_FILE_MODE: int = 0o644
+
+
+def get_archive_format(file_path: str) -> str:
+    """
+    Helper function, the archive format for a path from its extension,
+    raises ValueError for anything but ARCHIVE_FORMATS
+    """
+    extension = o_path.splitext(file_path)[1].lower()
+    if extension not in ARCHIVE_FORMATS:
+        raise ValueError(
+            f"{file_path!r} needs one of the extensions "
+            + ", ".join(ARCHIVE_FORMATS)
+        )
+    return ARCHIVE_FORMATS[extension]
+
+
+def get_archive_name(file_path: str, output_dir: str) -> str:
+    """Helper function, an output's name in the archive, / separated"""
+    return o_path.relpath(file_path, output_dir).replace(o_path.sep, "/")
+
+
+class OutputArchive:
+    """
+    Tar or zip file outputs are appended to in the order they are added,
+    no file is created per output. The archive is written beside its path
+    and renamed into place on close, a run that raises leaves nothing
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.format = get_archive_format(file_path)
+        self.entries = 0
+        self._partial_path = get_partial_path(file_path)
+        self._handle = open(  # pylint: disable=consider-using-with
+            self._partial_path, "wb", buffering=ARCHIVE_BUFFER_SIZE
+        )
+        self._tar: Optional[tarfile.TarFile] = None
+        self._zip: Optional[zipfile.ZipFile] = None
+        if self.format == "tar":
+            self._tar = tarfile.open(fileobj=self._handle, mode="w")
+        else:
+            self._zip = zipfile.ZipFile(
+                self._handle, mode="w", compression=zipfile.ZIP_STORED
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *_):
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_data(self, name: str, data: bytes) -> None:
+        """Appends an entry holding data"""
+        if self._tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time())
+            info.mode = ARCHIVE_FILE_MODE
+            self._tar.addfile(info, BytesIO(data))
+        else:
+            info = zipfile.ZipInfo(name, date_time=localtime()[:6])
+            info.external_attr = ARCHIVE_FILE_MODE << 16
+            self._zip.writestr(info, data)
+        self.entries += 1
+
+    def add_file(self, name: str, file_path: str) -> None:
+        """Appends an entry copied from file_path, streamed from disk"""
+        if self._tar:
+            self._tar.add(file_path, arcname=name, recursive=False)
+        else:
+            self._zip.write(file_path, arcname=name)
+        self.entries += 1
+
+    def close(self) -> None:
+        """Finishes the archive and moves it into place"""
+        (self._tar or self._zip).close()
+        self._handle.close()
+        o_replace(self._partial_path, self.file_path)
+
+    def abort(self) -> None:
+        """Discards the archive written so far"""
+        (self._tar or self._zip).close()
+        self._handle.close()
+        if o_path.exists(self._partial_path):
+            o_remove(self._partial_path)
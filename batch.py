@@ -0,0 +1,205 @@
+import atexit
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+from os import cpu_count
+from threading import Lock
+from time import perf_counter
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from helpers import (
+    FILES_IN_FLIGHT_PER_JOB,
+    ConversionOptions,
+    ConversionResult,
+    evict_cached_files,
+    get_file_converter,
+    get_sample_processor,
+)
+from classes.base_types import AudioFile
+
+# Imported by every worker as it starts, so the first file of a batch
+# doesn't pay for them. librosa loads its submodules on first attribute
+# access, these are the ones a conversion reaches
+WARM_MODULES: Tuple[str, ...] = (
+    "soundfile",
+    "soxr",
+    "librosa.core.audio",
+    "librosa.util.utils",
+)
+
+# one pool per jobs value, a batch never stops a pool another may be using
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pool_lock = Lock()
+
+TargetType = Union[str, type]
+
+
+def warm_worker(module_names: Sequence[str]) -> None:
+    """Worker initializer, imports the modules conversions will need"""
+    for module_name in module_names:
+        try:
+            import_module(module_name)
+        except ImportError:
+            # left for the conversion to report against its file
+            pass
+
+
+def get_worker_pool(jobs: int) -> ProcessPoolExecutor:
+    """
+    Provides the process pool shared by every batch of this process with
+    the same jobs, created on first use and again after a worker died
+    """
+    with _pool_lock:
+        pool = _pools.get(jobs)
+        if pool is None:
+            pool = _pools[jobs] = ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=warm_worker,
+                initargs=(WARM_MODULES,),
+            )
+        return pool
+
+
+def shutdown_worker_pool() -> None:
+    """Stops the shared pools, the next batch starts a new one"""
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_worker_pool)
+
+
+def get_target_procs(
+    target_cls: Union[TargetType, Sequence[TargetType]],
+) -> List[AudioFile]:
+    """
+    Helper function, the sample classes for a target given as a class, a
+    sample type name (see SAMPLE_PROCESSORS) or a sequence of either.
+    Raises ValueError for unknown names
+    """
+    targets = (
+        [target_cls]
+        if isinstance(target_cls, (str, type))
+        else list(target_cls)
+    )
+    procs = []
+    for target in targets:
+        proc = (
+            get_sample_processor(target)
+            if isinstance(target, str)
+            else target
+        )
+        if proc is None:
+            raise ValueError(f"{target!r} is not a known sample type")
+        procs.append(proc)
+    if not procs:
+        raise ValueError("no target sample type given")
+    return procs
+
+
+def convert_file(
+    file: str,
+    procs: Sequence[AudioFile],
+    options: ConversionOptions,
+) -> List[ConversionResult]:
+    """
+    Converts one file to every sample type in procs, timed. Runs in the
+    pool workers, failures are kept on the results
+    """
+    started = perf_counter()
+    results = get_file_converter(procs)(file, options=options)
+    seconds = perf_counter() - started
+    for result in results:
+        result.seconds = seconds
+    return results
+
+
+def convert_batch(
+    paths: Iterable[str],
+    target_cls: Union[TargetType, Sequence[TargetType]],
+    options: ConversionOptions,
+    jobs: Optional[int] = None,
+) -> Iterator[ConversionResult]:
+    """
+    Library entry point, converts paths to target_cls (a sample class, a
+    sample type name or a sequence of either) and yields a result per path
+    and sample type as each completes, not in input order. Nothing is
+    printed or prompted for.
+        jobs: worker processes, cpu count by default. The pool is kept
+            between calls, so consecutive batches start on warm workers.
+            1 converts in the calling process
+    Closing the iterator early cancels the paths not yet started
+    """
+    procs = get_target_procs(target_cls)
+    jobs = jobs or cpu_count() or 1
+    try:
+        if jobs <= 1:
+            for file in paths:
+                yield from convert_file(file, procs, options)
+        else:
+            yield from _convert_on_pool(paths, procs, options, jobs)
+    finally:
+        # the batch may be all a library caller or the watch runs, so the
+        # cache is kept to its size here rather than by the caller
+        evict_cached_files(options)
+
+
+def _convert_on_pool(
+    paths: Iterable[str],
+    procs: Sequence[AudioFile],
+    options: ConversionOptions,
+    jobs: int,
+) -> Iterator[ConversionResult]:
+    """Body of convert_batch for jobs > 1, on the shared worker pool"""
+    executor = get_worker_pool(jobs)
+    pending = {}
+    try:
+        for file in paths:
+            pending[executor.submit(convert_file, file, procs, options)] = (
+                file
+            )
+            if len(pending) >= jobs * FILES_IN_FLIGHT_PER_JOB:
+                yield from _collect_completed(pending, executor)
+        while pending:
+            yield from _collect_completed(pending, executor)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _collect_completed(pending, executor) -> Iterator[ConversionResult]:
+    """
+    Waits for at least one pending future and yields its results, failures
+    of the pool itself are reported against the file. A broken pool is
+    dropped so the next batch starts a new one
+    """
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        file = pending.pop(future)
+        try:
+            yield from future.result()
+        except BrokenProcessPool as ex:
+            _drop_worker_pool(executor)
+            yield ConversionResult(file_path=file, exception=ex)
+        except Exception as ex:  # pylint: disable=broad-except
+            yield ConversionResult(file_path=file, exception=ex)
+
+
+def _drop_worker_pool(executor: ProcessPoolExecutor) -> None:
+    """Forgets executor when it is still a shared pool"""
+    with _pool_lock:
+        for jobs, pool in list(_pools.items()):
+            if pool is executor:
+                del _pools[jobs]
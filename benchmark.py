@@ -0,0 +1,511 @@
+#!/usr/bin/python3
+
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from os import makedirs as o_makedirs
+from os import path as o_path
+from shutil import rmtree
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import click
+import numpy as np
+import soundfile as sf
+
+from helpers import (
+    ConversionOptions,
+    ConversionResult,
+    find_all_target_files,
+    get_sample_processor,
+    resolve_target_file,
+)
+from classes.base_types import AudioFile, WaveFile
+from classes.resamplers import resample
+
+BENCHMARK_SEED: int = 20240601
+SAMPLE_TYPES: Tuple[str, ...] = ("octa", "rample", "tracker", "hyperion")
+STAGES: Tuple[str, ...] = ("scan", "probe", "decode", "resample", "write")
+# (sample rate, subtype) pairs cycled through by every corpus, covers
+# 8 to 32 bit integer PCM plus float
+CORPUS_FORMATS: Tuple[Tuple[int, str], ...] = (
+    (44100, "PCM_16"),
+    (48000, "PCM_24"),
+    (96000, "PCM_24"),
+    (44100, "PCM_U8"),
+    (48000, "PCM_32"),
+    (96000, "FLOAT"),
+    (32000, "PCM_16"),
+)
+# Files per sub directory, gives the scan a tree to walk
+FILES_PER_DIRECTORY: int = 25
+# Command timed for start up, the cost every scripted invocation pays
+# before any work happens
+STARTUP_COMMAND: Tuple[str, ...] = ("main.py", "--help")
+# Total import time allowed for STARTUP_COMMAND, in milliseconds
+DEFAULT_STARTUP_BUDGET_MS: float = 300.0
+# Modules that must only be imported once audio is actually read
+HEAVY_MODULES: Tuple[str, ...] = (
+    "librosa",
+    "numba",
+    "scipy",
+    "soundfile",
+    "soxr",
+)
+# Slowest top level imports listed in the report
+STARTUP_SLOWEST_IMPORTS: int = 10
+
+
+@dataclass
+class CorpusSpec:
+    """Dataclass for one synthetic corpus, counts are before scaling"""
+    name: str
+    file_count: int
+    seconds: float
+    channels: Tuple[int, ...]
+    formats: Tuple[Tuple[int, str], ...] = CORPUS_FORMATS
+
+
+CORPORA: Tuple[CorpusSpec, ...] = (
+    CorpusSpec("one_shots", 400, 0.5, (1, 2)),
+    CorpusSpec("stems", 4, 60.0, (2,), ((48000, "PCM_24"),)),
+    CorpusSpec("mixed", 56, 4.0, (1, 2)),
+)
+
+
+@dataclass
+class StageTiming:
+    """Dataclass for the best timing of one stage over the repeats"""
+    corpus: str
+    sample_type: str
+    stage: str
+    files: int
+    seconds: float
+    audio_seconds: float
+
+    def get_summary(self) -> Dict:
+        """Provides the timing with its derived rates"""
+        summary = asdict(self)
+        summary["seconds"] = round(self.seconds, 6)
+        summary["audio_seconds"] = round(self.audio_seconds, 3)
+        summary["files_per_second"] = (
+            round(self.files / self.seconds, 2) if self.seconds else None
+        )
+        summary["realtime_factor"] = (
+            round(self.audio_seconds / self.seconds, 2)
+            if self.seconds
+            else None
+        )
+        return summary
+
+
+def iter_corpus_files(
+    spec: CorpusSpec,
+    scale: float = 1.0,
+) -> Iterator[Tuple[str, int, int, str, int]]:
+    """
+    Yields (relative path, sample rate, channels, subtype, frames) for each
+    file of a corpus, the layout only depends on spec and scale
+    """
+    file_count = max(1, round(spec.file_count * scale))
+    for index in range(file_count):
+        sample_rate, subtype = spec.formats[index % len(spec.formats)]
+        channels = spec.channels[index % len(spec.channels)]
+        relative_path = o_path.join(
+            f"{index // FILES_PER_DIRECTORY:03d}",
+            f"{spec.name}_{index:05d}.wav",
+        )
+        yield (
+            relative_path,
+            sample_rate,
+            channels,
+            subtype,
+            int(spec.seconds * sample_rate),
+        )
+
+
+def generate_corpus(
+    directory: str,
+    spec: CorpusSpec,
+    scale: float = 1.0,
+    seed: int = BENCHMARK_SEED,
+) -> Dict:
+    """
+    Writes a deterministic corpus under directory, files that already
+    exist are kept so a corpus directory can be reused between runs.
+    Returns the corpus description recorded with the results
+    """
+    rng = np.random.default_rng([seed, CORPORA.index(spec)])
+    description = {"files": 0, "bytes": 0, "audio_seconds": 0.0}
+    for relative_path, sample_rate, channels, subtype, frames in (
+        iter_corpus_files(spec, scale)
+    ):
+        # drawn for every file so each one is independent of what exists
+        frequency = rng.uniform(55.0, 2000.0)
+        noise_seed = rng.integers(1 << 31)
+        file_path = o_path.join(directory, relative_path)
+        if not o_path.exists(file_path):
+            o_makedirs(o_path.dirname(file_path), exist_ok=True)
+            time = np.arange(frames) / sample_rate
+            tone = 0.5 * np.sin(2 * np.pi * frequency * time)
+            noise = np.random.default_rng(noise_seed).normal(
+                0.0, 0.05, (frames, channels)
+            )
+            sf.write(
+                file_path,
+                np.clip(tone[:, None] + noise, -1.0, 1.0),
+                sample_rate,
+                subtype=subtype,
+            )
+        description["files"] += 1
+        description["bytes"] += o_path.getsize(file_path)
+        description["audio_seconds"] += frames / sample_rate
+    description["audio_seconds"] = round(description["audio_seconds"], 3)
+    return description
+
+
+def benchmark_sample_type(
+    corpus_dir: str,
+    output_dir: str,
+    spec: CorpusSpec,
+    sample_type: str,
+) -> Dict[str, StageTiming]:
+    """
+    Times every stage of converting a corpus to one sample type, each file
+    is converted even when it already meets the target
+    """
+    proc = get_sample_processor(sample_type)
+    timings = {
+        stage: StageTiming(spec.name, proc.__name__, stage, 0, 0.0, 0.0)
+        for stage in STAGES
+    }
+    started = perf_counter()
+    files = find_all_target_files(corpus_dir, proc.get_base_extensions())
+    timings["scan"].seconds = perf_counter() - started
+    timings["scan"].files = len(files)
+
+    AudioFile.metadata_cache.clear()
+    started = perf_counter()
+    for file in files:
+        proc(file).update_instance_metadata()
+    timings["probe"].seconds = perf_counter() - started
+    timings["probe"].files = len(files)
+
+    options = ConversionOptions(
+        input_dir=corpus_dir, output_dir=output_dir, resample_all=True
+    )
+    for file in files:
+        existing, target = resolve_target_file(
+            file, proc, options, ConversionResult(file_path=file)
+        )
+        metadata = existing.get_resample_metadata(target)
+        o_makedirs(o_path.dirname(target.file_path), exist_ok=True)
+        audio_seconds = sf.info(file).duration
+        stage_started = perf_counter()
+        data, sample_rate = existing.decode_audio_file(metadata)
+        decoded = perf_counter()
+        data = existing.resample_audio_data(data, sample_rate, metadata)
+        resampled = perf_counter()
+        existing.write_audio_data(target, data, metadata)
+        written = perf_counter()
+        for stage, seconds in (
+            ("decode", decoded - stage_started),
+            ("resample", resampled - decoded),
+            ("write", written - resampled),
+        ):
+            timings[stage].files += 1
+            timings[stage].seconds += seconds
+            timings[stage].audio_seconds += audio_seconds
+    for stage in ("scan", "probe"):
+        timings[stage].audio_seconds = timings["decode"].audio_seconds
+    return timings
+
+
+def warm_up(file_path: str) -> None:
+    """
+    Decodes and resamples a file untimed, librosa loads its backends on
+    first use and that would otherwise land on the first timed stage
+    """
+    data, sample_rate = WaveFile(file_path).decode_audio_file()
+    resample(data, sample_rate, sample_rate // 2)
+
+
+def get_git_revision() -> Optional[str]:
+    """Provides the commit being benchmarked, None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=o_path.dirname(o_path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_importtime(text: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Helper function, reads python -X importtime output. Returns the total
+    import time in milliseconds and the cumulative time of every top level
+    import, nested imports are only counted through their parent
+    """
+    imports: Dict[str, float] = {}
+    total = 0.0
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the column header
+        milliseconds = int(cumulative) / 1000
+        if not name[1:].startswith(" "):
+            total += milliseconds
+            imports[name.strip()] = milliseconds
+        else:
+            imports.setdefault(name.strip(), 0.0)
+    return total, imports
+
+
+def measure_startup(repeat: int) -> Dict[str, Any]:
+    """
+    Runs STARTUP_COMMAND under python -X importtime repeat times. Reports
+    the fastest run, its slowest top level imports and any of HEAVY_MODULES
+    it imported
+    """
+    best: Optional[Dict[str, Any]] = None
+    for _ in range(repeat):
+        started = perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", *STARTUP_COMMAND],
+            cwd=o_path.dirname(o_path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        wall_seconds = perf_counter() - started
+        import_ms, imports = parse_importtime(completed.stderr)
+        if best is None or import_ms < best["import_ms"]:
+            best = {
+                "command": " ".join(STARTUP_COMMAND),
+                "wall_seconds": round(wall_seconds, 4),
+                "import_ms": round(import_ms, 1),
+                "slowest_imports": {
+                    name: round(milliseconds, 1)
+                    for name, milliseconds in sorted(
+                        imports.items(), key=lambda item: item[1]
+                    )[::-1][:STARTUP_SLOWEST_IMPORTS]
+                },
+                "heavy_modules": sorted(
+                    module
+                    for module in HEAVY_MODULES
+                    if module in imports
+                ),
+            }
+    return best
+
+
+def check_startup(startup: Dict[str, Any], budget_ms: float) -> List[str]:
+    """Provides a line per way startup breaks its budget, empty when not"""
+    problems = []
+    if startup["import_ms"] > budget_ms:
+        problems.append(
+            f"imports took {startup['import_ms']:.1f}ms, over the "
+            f"{budget_ms:g}ms budget"
+        )
+    if startup["heavy_modules"]:
+        problems.append(
+            f"{', '.join(startup['heavy_modules'])} imported at start up"
+        )
+    return problems
+
+
+def compare_results(results: List[Dict], baseline: Dict) -> List[str]:
+    """
+    Provides a line per stage comparing results with a baseline report,
+    ratios above 1 mean this run is slower
+    """
+    previous = {
+        (entry["corpus"], entry["sample_type"], entry["stage"]): entry
+        for entry in baseline["results"]
+    }
+    lines = []
+    for entry in results:
+        key = (entry["corpus"], entry["sample_type"], entry["stage"])
+        if key in previous and previous[key]["seconds"]:
+            lines.append(
+                f"{'/'.join(key)}: {entry['seconds']:.4f}s vs "
+                f"{previous[key]['seconds']:.4f}s "
+                f"({entry['seconds'] / previous[key]['seconds']:.2f}x)"
+            )
+    return lines
+
+
+def compare_startup(startup: Dict, baseline: Dict) -> List[str]:
+    """Provides a line comparing startup with a baseline report's"""
+    previous = baseline.get("startup")
+    if not previous or not previous["import_ms"]:
+        return []
+    return [
+        f"startup imports: {startup['import_ms']:.1f}ms vs "
+        f"{previous['import_ms']:.1f}ms "
+        f"({startup['import_ms'] / previous['import_ms']:.2f}x)"
+    ]
+
+
+@click.command()
+@click.option(
+    "--sample-type",
+    "-t",
+    type=click.Choice(SAMPLE_TYPES),
+    multiple=True,
+    default=SAMPLE_TYPES,
+    help="Sample types to benchmark, repeat for several (default all)",
+)
+@click.option(
+    "--corpus",
+    "-c",
+    type=click.Choice([spec.name for spec in CORPORA]),
+    multiple=True,
+    default=[spec.name for spec in CORPORA],
+    help="Corpora to benchmark, repeat for several (default all)",
+)
+@click.option(
+    "--scale",
+    "-s",
+    type=click.FloatRange(min=0.0, min_open=True),
+    default=1.0,
+    help="Multiplies the number of files in every corpus",
+)
+@click.option(
+    "--repeat",
+    "-n",
+    type=click.IntRange(min=1),
+    default=3,
+    help="Runs per stage, the fastest run is reported",
+)
+@click.option(
+    "--corpus-dir",
+    type=click.Path(file_okay=False, resolve_path=True),
+    default=None,
+    help="Where corpora are generated and kept, a temporary directory \
+        is used and removed when not given",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="JSON report path, printed to stdout when not given",
+)
+@click.option(
+    "--baseline",
+    type=click.File("r"),
+    default=None,
+    help="Earlier JSON report to compare this run with",
+)
+@click.option(
+    "--startup-budget",
+    type=click.FloatRange(min=0.0),
+    default=DEFAULT_STARTUP_BUDGET_MS,
+    show_default=True,
+    help="Milliseconds of imports allowed for the CLI to start, the \
+        benchmark fails when startup exceeds it or imports librosa, \
+        soundfile, scipy, soxr or numba",
+)
+@click.option(
+    "--startup-only",
+    is_flag=True,
+    default=False,
+    help="Only benchmark startup, no corpora are generated",
+)
+def run_benchmarks(  # pylint: disable=too-many-arguments,too-many-locals
+    sample_type,
+    corpus,
+    scale,
+    repeat,
+    corpus_dir,
+    output,
+    baseline,
+    startup_budget,
+    startup_only,
+):
+    """
+    Benchmark CLI startup, then scan, probe, decode, resample and write for
+    each sample type on deterministic synthetic corpora
+    """
+    keep_corpora = corpus_dir is not None
+    corpus_dir = corpus_dir or tempfile.mkdtemp(prefix="neophyte_corpus_")
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": BENCHMARK_SEED,
+        "scale": scale,
+        "repeat": repeat,
+        "startup": measure_startup(repeat),
+        "startup_budget_ms": startup_budget,
+        "corpora": {},
+        "results": [],
+    }
+    if startup_only:
+        corpus = ()
+    try:
+        for spec in (spec for spec in CORPORA if spec.name in corpus):
+            directory = o_path.join(corpus_dir, f"{spec.name}_{scale:g}")
+            click.echo(
+                f"Generating {spec.name} corpus in {directory}", err=True
+            )
+            report["corpora"][spec.name] = generate_corpus(
+                directory, spec, scale
+            )
+            if len(report["corpora"]) == 1:
+                relative_path = next(iter_corpus_files(spec, scale))[0]
+                warm_up(o_path.join(directory, relative_path))
+            for _t in dict.fromkeys(sample_type):
+                click.echo(f"Benchmarking {spec.name} -> {_t}", err=True)
+                best: Dict[str, StageTiming] = {}
+                for _ in range(repeat):
+                    output_dir = tempfile.mkdtemp(prefix="neophyte_bench_")
+                    try:
+                        timings = benchmark_sample_type(
+                            directory, output_dir, spec, _t
+                        )
+                    finally:
+                        rmtree(output_dir, ignore_errors=True)
+                    for stage, timing in timings.items():
+                        if (
+                            stage not in best
+                            or timing.seconds < best[stage].seconds
+                        ):
+                            best[stage] = timing
+                report["results"].extend(
+                    best[stage].get_summary() for stage in STAGES
+                )
+    finally:
+        if not keep_corpora:
+            rmtree(corpus_dir, ignore_errors=True)
+    if baseline:
+        previous = json.load(baseline)
+        for line in compare_startup(report["startup"], previous) + (
+            compare_results(report["results"], previous)
+        ):
+            click.echo(line, err=True)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    else:
+        click.echo(text)
+    problems = check_startup(report["startup"], startup_budget)
+    if problems:
+        raise click.ClickException("; ".join(problems))
+
+
+if __name__ == "__main__":
+    run_benchmarks()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,210 @@
+import json
+from dataclasses import dataclass
+from hashlib import blake2b
+from os import getpid as o_getpid
+from os import makedirs as o_makedirs
+from os import path as o_path
+from os import remove as o_remove
+from os import replace as o_replace
+from os import scandir as o_scandir
+from os import utime as o_utime
+from threading import get_ident
+from typing import Any, Callable, Dict, List, Optional
+
+from manifest import hash_file
+from passthrough import materialize_file
+from classes.riff import hash_wave_audio
+
+# Bumped when the key or the way outputs are produced changes, so entries
+# written by an older version are never served
+CACHE_VERSION: int = 1
+CACHE_EXTENSION: str = ".wav"
+DEFAULT_CACHE_SIZE: int = 1 << 30
+CACHE_SIZE_UNITS: Dict[str, int] = {
+    "K": 1 << 10,
+    "M": 1 << 20,
+    "G": 1 << 30,
+    "T": 1 << 40,
+}
+
+
+def parse_size(text: str) -> int:
+    """
+    Helper function, reads a size in bytes with an optional K/M/G/T
+    suffix (e.g. 512M, 2G), raises ValueError when malformed
+    """
+    text = text.strip().upper().removesuffix("B")
+    multiplier = CACHE_SIZE_UNITS.get(text[-1:], 1)
+    if text[-1:] in CACHE_SIZE_UNITS:
+        text = text[:-1]
+    try:
+        size = int(float(text) * multiplier)
+    except ValueError as ex:
+        raise ValueError(f"{text!r} is not a size such as 512M or 2G") from ex
+    if size < 0:
+        raise ValueError("sizes can't be negative")
+    return size
+
+
+def hash_audio(file_path: str) -> str:
+    """
+    Helper function, hashes the audio of a source (see hash_wave_audio).
+    Files whose data chunk can't be found are hashed whole
+    """
+    audio_hash = hash_wave_audio(file_path)
+    return audio_hash if audio_hash is not None else hash_file(file_path)
+
+
+def get_cache_key(audio_hash: str, parameters: Dict[str, Any]) -> str:
+    """
+    Helper function, the key of a conversion: the source audio and every
+    parameter that changes the output bytes
+    """
+    return blake2b(
+        json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "audio": audio_hash,
+                "parameters": parameters,
+            },
+            sort_keys=True,
+        ).encode("utf-8"),
+        digest_size=20,
+    ).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    """Dataclass for a cached output as found on disk"""
+    file_path: str
+    size: int
+    last_used_ns: int
+
+
+class ConversionCache:
+    """
+    Content addressed store of converted outputs, one file per key under
+    cache_dir. There is no index, so worker processes and hosts sharing
+    cache_dir need no coordination: entries are published by rename and
+    a hit refreshes the entry's mtime, which orders LRU eviction
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size: int = DEFAULT_CACHE_SIZE,
+        method: str = "auto",
+    ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.method = method
+
+    def get_entry_path(self, key: str) -> str:
+        """Where the output for key is kept, fanned out by key prefix"""
+        return o_path.join(self.cache_dir, key[:2], key + CACHE_EXTENSION)
+
+    def fetch(self, key: str, destination: str) -> bool:
+        """
+        Places the output cached for key at destination, False on a miss.
+        Placed with method (see PASS_THROUGH_METHODS), hardlink makes the
+        destination share the cached entry's inode
+        """
+        entry_path = self.get_entry_path(key)
+        try:
+            o_utime(entry_path)
+        except FileNotFoundError:
+            return False
+        try:
+            materialize_file(entry_path, destination, self.method)
+        except FileNotFoundError:
+            # evicted between the touch and the copy
+            return False
+        return True
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Provides the output cached for key, None on a miss"""
+        entry_path = self.get_entry_path(key)
+        try:
+            o_utime(entry_path)
+            with open(entry_path, "rb") as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, key: str, file_path: str) -> None:
+        """Adds the output at file_path under key"""
+        # never hardlinked, a later write to the output must not reach into
+        # the cache
+        self._publish(
+            key,
+            lambda temporary_path: materialize_file(
+                file_path, temporary_path, "auto"
+            ),
+        )
+
+    def store_data(self, key: str, data: bytes) -> None:
+        """Adds an output held in memory under key"""
+        def write(temporary_path: str) -> None:
+            with open(temporary_path, "wb") as handle:
+                handle.write(data)
+        self._publish(key, write)
+
+    def _publish(self, key: str, write: Callable[[str], Any]) -> None:
+        """
+        Writes an entry beside its path and renames it over it, so readers
+        never see a partial one
+        """
+        entry_path = self.get_entry_path(key)
+        temporary_path = f"{entry_path}.{o_getpid()}.{get_ident()}.tmp"
+        o_makedirs(o_path.dirname(entry_path), exist_ok=True)
+        try:
+            write(temporary_path)
+            o_replace(temporary_path, entry_path)
+        finally:
+            if o_path.exists(temporary_path):
+                o_remove(temporary_path)
+
+    def get_entries(self) -> List[CacheEntry]:
+        """Provides every entry in the cache, least recently used first"""
+        entries = []
+        if not o_path.isdir(self.cache_dir):
+            return entries
+        for prefix in o_scandir(self.cache_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in o_scandir(prefix.path):
+                if not entry.name.endswith(CACHE_EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append(
+                    CacheEntry(entry.path, stat.st_size, stat.st_mtime_ns)
+                )
+        return sorted(entries, key=lambda entry: entry.last_used_ns)
+
+    def evict(self, max_size: Optional[int] = None) -> List[str]:
+        """
+        Removes least recently used entries until the cache fits in
+        max_size bytes (the cache's own limit by default). Returns the
+        paths removed
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.get_entries()
+        total = sum(entry.size for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_size:
+                break
+            try:
+                o_remove(entry.file_path)
+            except FileNotFoundError:
+                pass
+            total -= entry.size
+            removed.append(entry.file_path)
+        return removed
+
+    def get_size(self) -> int:
+        """Provides the bytes held by the cache"""
+        return sum(entry.size for entry in self.get_entries())
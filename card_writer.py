@@ -0,0 +1,231 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+from dataclasses import dataclass
+from os import makedirs as o_makedirs
+from os import path as o_path
+from os import replace as o_replace
+from os import stat as o_stat
+from shutil import copyfileobj
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+from classes.atomic import get_partial_path
+
+# Outputs held in memory before a batch is written out, sorted and synced.
+# Larger batches mean longer sequential runs and fewer syncs on the card
+DEFAULT_CARD_BATCH_SIZE: int = 64 << 20
+# Copies of pass through sources are streamed in chunks this large
+CARD_COPY_CHUNK_SIZE: int = 1 << 20
+CARD_FILE_MODE: int = 0o644
+# Filesystems without fallocate support (FAT on older kernels) refuse it,
+# the file is then written without being preallocated
+_FALLOCATE_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL}
+
+
+@dataclass
+class CardWrite:
+    """
+    Dataclass for an output waiting in a batch, either data held in memory
+    or a source file copied unmodified
+    """
+    file_path: str
+    source: Union[bytes, str]
+    size: int
+    on_written: Optional[Callable[[], None]] = None
+
+
+def preallocate(file_descriptor: int, size: int) -> bool:
+    """
+    Helper function, reserves size bytes for a file about to be written so
+    the filesystem can place it in one extent. False when the filesystem
+    or platform can't
+    """
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(file_descriptor, 0, size)
+    except OSError as ex:
+        if ex.errno in _FALLOCATE_UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def get_syncfs() -> Optional[Callable[[int], int]]:
+    """
+    Helper function, libc's syncfs (Linux only), which flushes just the
+    filesystem holding a descriptor. None where it is missing
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return getattr(libc, "syncfs", None)
+
+
+def sync_paths(file_paths: Iterable[str], syncfs=None) -> None:
+    """
+    Helper function, makes the files and directories at file_paths durable
+    without touching other devices. With syncfs that is one call per
+    filesystem they are on, otherwise one fsync per path
+    """
+    synced_devices: Set[int] = set()
+    for file_path in file_paths:
+        if syncfs is not None:
+            device = o_stat(file_path).st_dev
+            if device in synced_devices:
+                continue
+            synced_devices.add(device)
+        elif os.name == "nt" and o_path.isdir(file_path):
+            # directories can't be opened for fsync on Windows
+            continue
+        file_descriptor = os.open(file_path, os.O_RDONLY)
+        try:
+            if syncfs is None:
+                os.fsync(file_descriptor)
+            elif syncfs(file_descriptor) != 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), file_path)
+        finally:
+            os.close(file_descriptor)
+
+
+class CardWriter:
+    """
+    Writer for slow removable media such as SD cards. Finished outputs are
+    held until batch_size bytes are waiting, then written in directory
+    order, each preallocated to its known size. A batch is written under
+    partial names, synced once and only then renamed into place, so a
+    card pulled mid batch holds no truncated outputs. Syncs only reach the
+    card's filesystem (syncfs, or fsync of the files and their directories
+    where there is none), other devices aren't waited on. on_written callbacks
+    run after the rename, which is when a manifest or journal may record
+    the output as done
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_CARD_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.files = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.preallocated = 0
+        self.seconds = 0.0
+        self._pending: List[CardWrite] = []
+        self._pending_size = 0
+        # directories holding renames not yet synced
+        self._renamed: Set[str] = set()
+        self._syncfs = get_syncfs()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        # what was queued before a failure is finished outputs, so it is
+        # still written
+        self.close()
+
+    def add_data(
+        self,
+        file_path: str,
+        data: bytes,
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Queues data to be written at file_path"""
+        self._add(CardWrite(file_path, data, len(data), on_written))
+
+    def add_file(
+        self,
+        file_path: str,
+        source_path: str,
+        on_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Queues a copy of source_path to be written at file_path"""
+        self._add(CardWrite(
+            file_path, source_path, o_path.getsize(source_path), on_written
+        ))
+
+    def _add(self, write: CardWrite) -> None:
+        self._pending.append(write)
+        self._pending_size += write.size
+        if self._pending_size >= self.batch_size:
+            self.flush()
+
+    def _write(self, write: CardWrite, partial_path: str) -> None:
+        """Writes one output at partial_path, preallocated to its size"""
+        file_descriptor = os.open(
+            partial_path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            CARD_FILE_MODE,
+        )
+        with open(file_descriptor, "wb") as handle:
+            if preallocate(file_descriptor, write.size):
+                self.preallocated += 1
+            if isinstance(write.source, bytes):
+                handle.write(write.source)
+            else:
+                with open(write.source, "rb") as source:
+                    copyfileobj(source, handle, CARD_COPY_CHUNK_SIZE)
+
+    def flush(self) -> None:
+        """Writes, syncs and renames every queued output"""
+        if not self._pending:
+            return
+        started = perf_counter()
+        # every file of a directory together, directories in path order
+        batch = sorted(
+            self._pending,
+            key=lambda write: o_path.split(write.file_path),
+        )
+        self._pending = []
+        self._pending_size = 0
+        directories = set()
+        for write in batch:
+            directory = o_path.dirname(write.file_path)
+            if directory not in directories:
+                o_makedirs(directory, exist_ok=True)
+                directories.add(directory)
+            self._write(write, get_partial_path(write.file_path))
+        # the renames of the previous batch are made durable by this sync
+        sync_paths(
+            [
+                *self._renamed,
+                *directories,
+                *(get_partial_path(write.file_path) for write in batch),
+            ],
+            self._syncfs,
+        )
+        for write in batch:
+            o_replace(get_partial_path(write.file_path), write.file_path)
+            self.files += 1
+            self.bytes_written += write.size
+        self._renamed = directories
+        self.batches += 1
+        self.seconds += perf_counter() - started
+        for write in batch:
+            if write.on_written:
+                write.on_written()
+
+    def close(self) -> None:
+        """Writes what is still queued and syncs the last renames"""
+        self.flush()
+        if self._renamed:
+            started = perf_counter()
+            sync_paths(sorted(self._renamed), self._syncfs)
+            self.seconds += perf_counter() - started
+            self._renamed = set()
+
+    def get_report(self) -> Dict[str, Union[int, float]]:
+        """Provides what was written and how fast, in MB (10^6 bytes)"""
+        megabytes = self.bytes_written / 1e6
+        return {
+            "files": self.files,
+            "batches": self.batches,
+            "preallocated": self.preallocated,
+            "megabytes": round(megabytes, 3),
+            "seconds": round(self.seconds, 3),
+            "mb_per_second": round(megabytes / self.seconds, 3)
+            if self.seconds
+            else 0.0,
+        }
@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from os import path as o_path
+from os import remove as o_remove
+from os import replace as o_replace
+from typing import Iterator
+
+# Outputs are written under this prefix next to where they belong, then
+# renamed into place. The original name is kept after it so the extension
+# (which SoundFile picks the format from) is unchanged
+PARTIAL_PREFIX: str = ".neophyte-partial."
+
+
+def get_partial_path(file_path: str) -> str:
+    """Helper function, where file_path is written before it is complete"""
+    directory, filename = o_path.split(file_path)
+    return o_path.join(directory, PARTIAL_PREFIX + filename)
+
+
+def is_partial_file(filename: str) -> bool:
+    """Helper function, whether a file name is an unfinished output"""
+    return filename.startswith(PARTIAL_PREFIX)
+
+
+@contextmanager
+def atomic_path(file_path: str) -> Iterator[str]:
+    """
+    Provides the path to write file_path at, the finished file is renamed
+    over file_path when the block completes and removed when it raises.
+    A killed run leaves no truncated file_path behind, only a partial file
+    that the next write of the same output replaces
+    """
+    partial_path = get_partial_path(file_path)
+    try:
+        yield partial_path
+        o_replace(partial_path, file_path)
+    except BaseException:
+        if o_path.lexists(partial_path):
+            o_remove(partial_path)
+        raise
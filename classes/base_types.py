@@ -1,17 +1,63 @@
-from typing import Set, Union, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+    Union,
+    Optional,
+)
 from dataclasses import dataclass
 from os import path as o_path
-import soundfile as sf
-import librosa
+from os import stat as o_stat
+from threading import Lock
+import numpy as np
+
+from .atomic import atomic_path
+from .profiling import profile_stage
+from .riff import (
+    HEADER_PROBE_SIZE,
+    WaveHeader,
+    probe_wave_header,
+    probe_wave_headers,
+)
+from .resamplers import (
+    DEFAULT_QUALITY,
+    DEFAULT_RESAMPLER,
+    get_resample_stream,
+    resample,
+)
+from .requantize import get_dither_seed, requantize
+from .pcm import map_pcm_data
+
+# soundfile and librosa (which pulls in numba and scipy on first use) are
+# imported by the methods that read or write audio, listing and probing
+# never need them
+# pylint: disable=import-outside-toplevel
 
 STANDARD_BIT_DEPTHS: Set[int] = {8, 16, 24, 32}
 STANDARD_BIT_RATE_PER_SECOND_RANGE: Set[int] = {16000, 320000}
 STANDARD_SAMPLE_RATES: Set[int] = {8000, 16000, 32000, 44100, 48000, 96000}
 WAVEFILE_EXTENSIONS: Set[str] = {".WAVE", ".wave", ".WAV", ".wav"}
 MP3_EXTENSIONS: Set[str] = {".mp3", ".MP3"}
+# SoundFile format every wave output is encoded as, given explicitly since
+# outputs may go to a buffer or a partial file instead of their own path
+WAVE_OUTPUT_FORMAT: str = "WAV"
+# Frames read per block when streaming a resample, ~0.7s of 96khz audio
+DEFAULT_STREAM_BLOCK_SIZE: int = 65536
+# Max absolute sample difference between streamed and whole file resamples
+STREAM_RESAMPLE_TOLERANCE: float = 1e-4
+# Files whose metadata is kept, conversion rereads the same file a few times
+# in a row so this only needs to cover the files in flight
+DEFAULT_METADATA_CACHE_SIZE: int = 4096
 
 
-@dataclass
+@dataclass(slots=True)
 class AudioData:
     """Dataclass for Audio File Metadata"""
     number_of_channels: int
@@ -20,9 +66,93 @@ class AudioData:
     bit_depth: Optional[int]
 
 
+class MetadataCache:
+    """
+    LRU cache of file metadata keyed by (path, size, mtime_ns), a file that
+    changes on disk gets a new key and is read again. Shared by the
+    pipeline reader threads, so every access holds a lock
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_METADATA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def get_key(file_path: str) -> Optional[Tuple[str, int, int]]:
+        """Provides the cache key for a file, None if it can't be stat'd"""
+        try:
+            stat = o_stat(file_path)
+        except OSError:
+            return None
+        return (file_path, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, key: Optional[Tuple[str, int, int]]) -> Optional[AudioData]:
+        """Provides cached metadata for a key, counting hits and misses"""
+        with self._lock:
+            entry = self._entries.get(key[0]) if key else None
+            if entry is None or entry[0] != key:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key[0])
+            self.hits += 1
+            return entry[1]
+
+    def put(
+        self,
+        key: Optional[Tuple[str, int, int]],
+        metadata: AudioData,
+    ) -> None:
+        """Stores metadata for a key, replacing any stale entry for the path"""
+        if not key:
+            return
+        with self._lock:
+            self._entries[key[0]] = (key, metadata)
+            self._entries.move_to_end(key[0])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def peek(
+        self,
+        file_path: str,
+    ) -> Optional[Tuple[Tuple[str, int, int], AudioData]]:
+        """
+        Provides (key, metadata) cached for a path without counting a hit
+        or a miss, for handing entries to another process's cache
+        """
+        with self._lock:
+            return self._entries.get(file_path)
+
+    def invalidate(self, file_path: str) -> None:
+        """Drops any cached metadata for a path"""
+        with self._lock:
+            self._entries.pop(file_path, None)
+
+    def clear(self) -> None:
+        """Drops all cached metadata and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """Provides hit, miss and size counters"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
 class AudioFileType:
     """Base class for Audio File Types"""
 
+    # per class instance handed out by get_shared
+    _shared: Dict[type, "AudioFileType"] = {}
+
     def __init__(
         self,
         name: str,
@@ -47,6 +177,10 @@ class AudioFileType:
                 else extension
             )
             self._default_extension = min(self.extensions).lower()
+            # the scan matches extensions ignoring case, so do files
+            self._lower_extensions = frozenset(
+                extension.lower() for extension in self.extensions
+            )
         else:
             raise ValueError(
                 f"No extensions were provided for AudioFileType {name}"
@@ -88,10 +222,22 @@ class AudioFileType:
             f"{' '.join(attributes)} {' '.join(private_attributes)} >"
         )
 
+    @classmethod
+    def get_shared(cls) -> "AudioFileType":
+        """
+        Provides the default instance of cls, created once per process and
+        shared by every file of the type, so it must not be modified
+        """
+        instance = AudioFileType._shared.get(cls)
+        if instance is None:
+            instance = AudioFileType._shared[cls] = cls()
+        return instance
+
     def set_default_extension(self, extension: str) -> None:
         """Sets the private default extension value"""
         if extension not in self.extensions:
             self.extensions = self.extensions.union({extension})
+            self._lower_extensions |= {extension.lower()}
         self._default_extension = extension
 
     def get_default_extension(self) -> str:
@@ -102,6 +248,10 @@ class AudioFileType:
         """Provides a set of available extensions"""
         return self.extensions
 
+    def has_extension(self, extension: str) -> bool:
+        """Whether extension is one of this type's, ignoring case"""
+        return extension.lower() in self._lower_extensions
+
     def set_default_sample_rate(self, sample_rate: int) -> None:
         """Sets the private default sample rate value"""
         if sample_rate not in self.sample_rates:
@@ -209,7 +359,24 @@ class MP3FileType(AudioFileType):
 
 
 class AudioFile:
-    """Base Audio File class"""
+    """
+    Base Audio File class. Slotted, and without any syscall until the
+    file is read, since one is made per scanned file and sample type
+    """
+
+    __slots__ = (
+        "file_path",
+        "file_type",
+        "sample_rate",
+        "channel_count",
+        "output_buffer",
+        "_file_exists",
+        "_directory_exists",
+        "_raw_data",
+        "_metadata",
+    )
+    # Shared by every instance and subclass within a process
+    metadata_cache: MetadataCache = MetadataCache()
 
     def __init__(
         self,
@@ -219,24 +386,47 @@ class AudioFile:
         channel_count=2,
     ) -> None:
         self.file_path = file_path
-        self.file_type = file_type()
+        self.file_type = file_type.get_shared()
         self.sample_rate = (
             sample_rate
             if sample_rate
-            else file_type().get_default_sample_rate()
+            else self.file_type.get_default_sample_rate()
         )
         self.channel_count = channel_count
-        self._filename, self._directory = o_path.split(file_path)
-        self._extension = o_path.splitext(file_path)[1]
-        if self._extension not in file_type().extensions:
+        extension = o_path.splitext(file_path)[1]
+        if not self.file_type.has_extension(extension):
             raise ValueError(
-                f'File extension provided "{file_path=},{self._extension=}" \
+                f'File extension provided "{file_path=},{extension=}" \
                     not present in AudioFileType: {file_type=}'
             )
-        self._file_exists = o_path.exists(file_path)
-        self._directory_exists = o_path.isdir(o_path.split(file_path)[0])
+        # checked on first use, see update_existance
+        self._file_exists: Optional[bool] = None
+        self._directory_exists: Optional[bool] = None
         self._raw_data: Optional[bytes] = None
         self._metadata: AudioData = None
+        # set when the output is collected in memory instead of written to
+        # file_path, e.g. for an archive
+        self.output_buffer: Optional[BinaryIO] = None
+
+    @contextmanager
+    def open_output(self) -> Iterator[Union[str, BinaryIO]]:
+        """
+        Provides what an encoder writes this file to, output_buffer when set
+        otherwise a partial file renamed over file_path once complete
+        """
+        if self.output_buffer is not None:
+            self.output_buffer.seek(0)
+            self.output_buffer.truncate()
+            yield self.output_buffer
+            return
+        with atomic_path(self.file_path) as partial_path:
+            yield partial_path
+
+    def get_output_size(self) -> int:
+        """Provides the bytes written by the last encode into this file"""
+        if self.output_buffer is not None:
+            return self.output_buffer.getbuffer().nbytes
+        return o_path.getsize(self.file_path)
 
     def __eq__(self, other):
         if not isinstance(other, AudioFile):
@@ -248,11 +438,19 @@ class AudioFile:
             return NotImplemented
         return self.sample_rate != other.sample_rate
 
+    def get_attributes(self) -> Dict[str, Any]:
+        """Provides the instance attributes by name, from every __slots__"""
+        return {
+            name: getattr(self, name, None)
+            for cls in reversed(type(self).__mro__)
+            for name in getattr(cls, "__slots__", ())
+        }
+
     def __str__(self):
         attributes = [
             f"  {k} = '{v}'\n"
             for k, v
-            in self.__dict__.items() if k[0] != '_'
+            in self.get_attributes().items() if k[0] != '_'
         ]
         return (
             f"{self.__class__.__name__}\n{''.join(attributes)}"
@@ -262,13 +460,13 @@ class AudioFile:
         attributes = [
             f"{k}='{v}'"
             for k, v
-            in self.__dict__.items()
+            in self.get_attributes().items()
             if k[0] != '_'
         ]
         private_attributes = [
             f"{k}='{v}'"
             for k, v
-            in self.__dict__.items()
+            in self.get_attributes().items()
             if k[0] == '_'
         ]
         return (
@@ -284,21 +482,37 @@ class AudioFile:
         """Method to observe the audio file metadata"""
         return True
 
-    def resample_audio_file(self, new) -> bool:
+    def resample_audio_file(
+        self,
+        new,
+        block_size=None,
+        resampler=DEFAULT_RESAMPLER,
+        quality=DEFAULT_QUALITY,
+        dither=True,
+        noise_shaping=False,
+    ) -> bool:
         """Method to resample the audio file metadata"""
-        print(new)
+        print(new, block_size, resampler, quality, dither, noise_shaping)
         return True
 
     def update_existance(self):
-        """Validate whether or not the file exists"""
-        self._file_exists = o_path.exists(self.file_path)
-        self._directory_exists = o_path.isdir(self._directory)
+        """
+        Validate whether or not the file exists, cached metadata for the
+        path is dropped when that changes
+        """
+        file_exists = o_path.exists(self.file_path)
+        if self._file_exists is not None and file_exists != self._file_exists:
+            self.metadata_cache.invalidate(self.file_path)
+        self._file_exists = file_exists
+        self._directory_exists = o_path.isdir(o_path.dirname(self.file_path))
 
     def does_file_exist(self) -> bool:
         """
         Return private value for if file exists.
         uses self.update_existance() and os.path.exists
         """
+        if self._file_exists is None:
+            self.update_existance()
         return self._file_exists
 
     def does_directory_exist(self) -> bool:
@@ -306,6 +520,8 @@ class AudioFile:
         Return private value for if directory exists.
         Uses self.update_existance() and os.path.isdir
         """
+        if self._directory_exists is None:
+            self.update_existance()
         return self._directory_exists
 
     def convert(
@@ -332,6 +548,8 @@ class AudioFile:
 class WaveFile(AudioFile):
     """Wave File class"""
 
+    __slots__ = ("bit_depth",)
+
     def __init__(
         self,
         file_path: str,
@@ -349,7 +567,7 @@ class WaveFile(AudioFile):
         self.bit_depth = (
             bit_depth
             if bit_depth
-            else file_type().get_default_bit_depth()
+            else self.file_type.get_default_bit_depth()
         )
         self._metadata: AudioData = None
 
@@ -374,18 +592,71 @@ class WaveFile(AudioFile):
         )
 
     def read_wave_file_metadata(self) -> None:
-        """Overwrites instance values with current file metadata"""
-        with sf.SoundFile(self.file_path) as wave_file:
-            bit_depth = self.get_bit_depth_from_pcm_wave_type(
-                wave_file.subtype
+        """
+        Overwrites instance values with current file metadata, read from the
+        RIFF header when possible and through SoundFile otherwise
+        """
+        key = self.metadata_cache.get_key(self.file_path)
+        metadata = self.metadata_cache.get(key)
+        if metadata is None:
+            with profile_stage("probe") as stage:
+                header = probe_wave_header(self.file_path)
+                metadata = (
+                    self.get_audio_data_from_wave_header(header)
+                    if header
+                    else self.read_soundfile_metadata(self.file_path)
+                )
+                if stage and key:
+                    stage.add_bytes(read=min(key[1], HEADER_PROBE_SIZE))
+            self.metadata_cache.put(key, metadata)
+        self._metadata = metadata
+
+    @classmethod
+    def read_wave_files_metadata(
+        cls,
+        file_paths: Iterable[str],
+    ) -> Dict[str, AudioData]:
+        """
+        Batch metadata read, one header probe per file with SoundFile as the
+        fallback for files the probe can't parse. Results prime the cache
+        """
+        file_paths = list(file_paths)
+        keys = [cls.metadata_cache.get_key(path) for path in file_paths]
+        batch = {}
+        for file_path, header in probe_wave_headers(file_paths).items():
+            batch[file_path] = (
+                cls.get_audio_data_from_wave_header(header)
+                if header
+                else cls.read_soundfile_metadata(file_path)
             )
-            metadata = AudioData(
+        for key, file_path in zip(keys, file_paths):
+            cls.metadata_cache.put(key, batch[file_path])
+        return batch
+
+    @classmethod
+    def read_soundfile_metadata(cls, file_path: str) -> AudioData:
+        """Provides file metadata by opening the file with SoundFile"""
+        import soundfile as sf
+
+        with sf.SoundFile(file_path) as wave_file:
+            return AudioData(
                 number_of_channels=wave_file.channels,
-                bit_depth=bit_depth,
+                bit_depth=cls.get_bit_depth_from_pcm_wave_type(
+                    wave_file.subtype
+                ),
                 sample_rate=wave_file.samplerate,
                 subtype=wave_file.subtype,
             )
-        self._metadata = metadata
+
+    @classmethod
+    def get_audio_data_from_wave_header(cls, header: WaveHeader) -> AudioData:
+        """Provides file metadata from a probed wave header"""
+        return AudioData(
+            number_of_channels=header.channels,
+            bit_depth=cls.get_bit_depth_from_pcm_wave_type(header.subtype),
+            sample_rate=header.sample_rate,
+            subtype=header.subtype,
+        )
 
     def get_exisiting_wave_file_metadata(self) -> AudioData:
         """Provides private metadata value"""
@@ -403,15 +674,16 @@ class WaveFile(AudioFile):
     def read_audio_file_metadata(self):
         return self.read_wave_file_metadata()
 
-    def resample_audio_file(self, new):
-        # type: (WaveFile)->None
+    def get_resample_metadata(self, new):
+        # type: (WaveFile)->AudioData
+        """Resolves the metadata a resample into new will produce"""
         self.update_instance_metadata()
         new_metadata = new.get_exisiting_wave_file_metadata()
         # We always go with the min number of channels, either we are reducing
         # the total samples (st->mono) or asking for expansion (mono->st)
         # there is no percieved value in channel expansion without some type of
         # st field widening (reverb, 'widener')
-        new_audiofile_metadata = AudioData(
+        return AudioData(
             number_of_channels=min(
                 new_metadata.number_of_channels,
                 self._metadata.number_of_channels
@@ -430,32 +702,333 @@ class WaveFile(AudioFile):
                 new_metadata.bit_depth
             ),
         )
-        resampled_data, resampeld_sample_rate = librosa.load(
-            path=self.file_path,
-            sr=new_audiofile_metadata.sample_rate,
-            mono=True
-            if new_audiofile_metadata.number_of_channels == 1
-            else False,
-        )
-        assert resampeld_sample_rate == new_audiofile_metadata.sample_rate
-        if new_audiofile_metadata.number_of_channels > 1:
-            resampled_data = self.convert_librosa_stereo_output_for_soundfile(
-                resampled_data
+
+    def resample_audio_file(  # pylint: disable=too-many-arguments
+        self,
+        new,
+        block_size=None,
+        resampler=DEFAULT_RESAMPLER,
+        quality=DEFAULT_QUALITY,
+        dither=True,
+        noise_shaping=False,
+    ):
+        # type: (WaveFile, Optional[int], str, str, bool, bool)->None
+        new_audiofile_metadata = self.get_resample_metadata(new)
+        if self.is_requantize_only(new_audiofile_metadata):
+            self.requantize_audio_file(
+                new,
+                new_audiofile_metadata,
+                block_size if block_size else DEFAULT_STREAM_BLOCK_SIZE,
+                dither,
+                noise_shaping,
             )
-        sf.write(
-            new.file_path,
-            data=resampled_data,
-            samplerate=new_audiofile_metadata.sample_rate,
-            subtype=new_audiofile_metadata.subtype,
+            return
+        if block_size:
+            self.stream_resample_audio_file(
+                new, new_audiofile_metadata, block_size, quality
+            )
+            return
+        data, sample_rate = self.decode_audio_file(new_audiofile_metadata)
+        resampled_data = self.resample_audio_data(
+            data, sample_rate, new_audiofile_metadata, resampler, quality
         )
+        self.write_audio_data(new, resampled_data, new_audiofile_metadata)
+
+    def resample_audio_files(  # pylint: disable=too-many-arguments
+        self,
+        news: List["WaveFile"],
+        block_size: Optional[int] = None,
+        resampler: str = DEFAULT_RESAMPLER,
+        quality: str = DEFAULT_QUALITY,
+        dither: bool = True,
+        noise_shaping: bool = False,
+    ) -> List[Optional[Exception]]:
+        """
+        Resamples into several targets at once. The file is decoded a single
+        time and resampled once per distinct (sample rate, mono) pair, only
+        the encode and write happen per target. Targets differing only in
+        bit depth are requantized without decoding. Provides what each of
+        news failed with, None for those written
+        """
+        failures: List[Optional[Exception]] = [None] * len(news)
+        resamples = []
+        for index, new in enumerate(news):
+            try:
+                new_audiofile_metadata = self.get_resample_metadata(new)
+                if block_size or self.is_requantize_only(
+                    new_audiofile_metadata
+                ):
+                    self.resample_audio_file(
+                        new,
+                        block_size,
+                        resampler,
+                        quality,
+                        dither,
+                        noise_shaping,
+                    )
+                else:
+                    resamples.append((index, new, new_audiofile_metadata))
+            except Exception as ex:  # pylint: disable=broad-except
+                failures[index] = ex
+        if not resamples:
+            return failures
+        import librosa
+
+        try:
+            data, sample_rate = self.decode_audio_file()
+        except Exception as ex:  # pylint: disable=broad-except
+            for index, _, _ in resamples:
+                failures[index] = ex
+            return failures
+        layouts: Dict[bool, np.ndarray] = {}
+        resampled: Dict[Tuple[bool, int], np.ndarray] = {}
+        for index, new, new_audiofile_metadata in resamples:
+            try:
+                mono = new_audiofile_metadata.number_of_channels == 1
+                if mono not in layouts:
+                    with profile_stage("downmix"):
+                        layouts[mono] = (
+                            librosa.to_mono(data) if mono else data
+                        )
+                key = (mono, new_audiofile_metadata.sample_rate)
+                if key not in resampled:
+                    resampled[key] = self.resample_audio_data(
+                        layouts[mono],
+                        sample_rate,
+                        new_audiofile_metadata,
+                        resampler,
+                        quality,
+                    )
+                self.write_audio_data(
+                    new, resampled[key], new_audiofile_metadata
+                )
+            except Exception as ex:  # pylint: disable=broad-except
+                failures[index] = ex
+        return failures
+
+    def is_requantize_only(self, new_audiofile_metadata: AudioData) -> bool:
+        """
+        Whether new_audiofile_metadata differs from the existing PCM file in
+        bit depth alone, such files skip decoding and the resampler
+        """
+        existing = self.get_exisiting_wave_file_metadata()
+        return bool(
+            existing.bit_depth
+            and new_audiofile_metadata.bit_depth
+            and existing.bit_depth != new_audiofile_metadata.bit_depth
+            and existing.sample_rate == new_audiofile_metadata.sample_rate
+            and existing.number_of_channels
+            == new_audiofile_metadata.number_of_channels
+        )
+
+    def requantize_audio_file(  # pylint: disable=too-many-arguments
+        self,
+        new,
+        new_audiofile_metadata: AudioData,
+        block_size: int = DEFAULT_STREAM_BLOCK_SIZE,
+        dither: bool = True,
+        noise_shaping: bool = False,
+    ) -> None:
+        """
+        Changes bit depth in the integer domain a block at a time. Reductions
+        get TPDF dither (seeded by the source audio, so identical sources
+        match) and optionally first order noise shaping, increases are exact
+        """
+        import soundfile as sf
+
+        bit_depth = new_audiofile_metadata.bit_depth
+        reduce = bit_depth < self.get_exisiting_wave_file_metadata().bit_depth
+        rng = (
+            np.random.default_rng(get_dither_seed(self.file_path))
+            if dither and reduce
+            else None
+        )
+        with profile_stage("requantize") as stage, self.open_source_blocks(
+            block_size, "int32"
+        ) as (sample_rate, channels, blocks):
+            error = np.zeros(channels) if noise_shaping and reduce else None
+            with new.open_output() as output, sf.SoundFile(
+                output,
+                mode="w",
+                samplerate=sample_rate,
+                channels=channels,
+                subtype=new_audiofile_metadata.subtype,
+                format=WAVE_OUTPUT_FORMAT,
+            ) as destination:
+                for block in blocks:
+                    if reduce:
+                        block, error = requantize(
+                            block, bit_depth, rng, error
+                        )
+                    destination.write(block)
+            if stage:
+                stage.add_bytes(
+                    read=o_path.getsize(self.file_path),
+                    written=new.get_output_size(),
+                )
+
+    def decode_audio_file(self, new_audiofile_metadata=None):
+        # type: (Optional[AudioData])->Tuple[np.ndarray, int]
+        """
+        Decode stage of a resample, loads the file as float32 at its own
+        sample rate, downmixed when the target is mono. Without a target
+        every channel is kept
+        """
+        import librosa
+
+        mono = bool(
+            new_audiofile_metadata
+            and new_audiofile_metadata.number_of_channels == 1
+        )
+        with profile_stage("decode") as stage:
+            if stage:
+                stage.add_bytes(read=o_path.getsize(self.file_path))
+            pcm = map_pcm_data(self.file_path)
+            if pcm is None:
+                return librosa.load(path=self.file_path, sr=None, mono=mono)
+            # laid out exactly like librosa.load's SoundFile read
+            data = pcm.read_float32()
+            data = data.reshape(-1) if pcm.channels == 1 else data.T
+            return (librosa.to_mono(data) if mono else data), pcm.sample_rate
+
+    @contextmanager
+    def open_source_blocks(self, block_size: int, dtype: str = "float32"):
+        # type: (int, str)->Iterator[Tuple[int, int, Iterator[np.ndarray]]]
+        """
+        Provides (sample rate, channels, (frames, channels) blocks) of the
+        file, read from the mapped data chunk when it is uncompressed so
+        only the page cache holds it, through SoundFile otherwise
+        """
+        pcm = map_pcm_data(self.file_path)
+        if pcm is not None:
+            yield (
+                pcm.sample_rate,
+                pcm.channels,
+                pcm.iter_blocks(block_size, dtype),
+            )
+            return
+        import soundfile as sf
+
+        with sf.SoundFile(self.file_path) as source:
+            yield (
+                source.samplerate,
+                source.channels,
+                source.blocks(
+                    blocksize=block_size, dtype=dtype, always_2d=True
+                ),
+            )
+
+    @staticmethod
+    def resample_audio_data(
+        data: np.ndarray,
+        sample_rate: int,
+        new_audiofile_metadata: AudioData,
+        resampler: str = DEFAULT_RESAMPLER,
+        quality: str = DEFAULT_QUALITY,
+    ) -> np.ndarray:
+        """
+        Resample stage of a resample, see resamplers.resample for the
+        backends, the defaults match librosa's soxr_hq
+        """
+        with profile_stage("resample"):
+            return resample(
+                data,
+                sample_rate,
+                new_audiofile_metadata.sample_rate,
+                resampler,
+                quality,
+            )
+
+    @classmethod
+    def write_audio_data(
+        cls,
+        new,
+        data: np.ndarray,
+        new_audiofile_metadata: AudioData,
+    ) -> None:
+        """Write stage of a resample, encodes data into new"""
+        import soundfile as sf
+
+        with profile_stage("reshape"):
+            data = cls.convert_librosa_output_for_soundfile(data)
+        with profile_stage("write") as stage:
+            with new.open_output() as output:
+                sf.write(
+                    output,
+                    data=data,
+                    samplerate=new_audiofile_metadata.sample_rate,
+                    subtype=new_audiofile_metadata.subtype,
+                    format=WAVE_OUTPUT_FORMAT,
+                )
+            if stage:
+                stage.add_bytes(written=new.get_output_size())
+
+    def stream_resample_audio_file(
+        self,
+        new,
+        new_audiofile_metadata: AudioData,
+        block_size: int = DEFAULT_STREAM_BLOCK_SIZE,
+        quality: str = DEFAULT_QUALITY,
+    ) -> None:
+        """
+        Resamples into new one block of frames at a time, memory use is
+        bounded by block_size instead of the file length.
+        Always uses soxr at the given quality, at "hq" the output matches the
+        whole file path to within STREAM_RESAMPLE_TOLERANCE
+        """
+        import soundfile as sf
+
+        mono = new_audiofile_metadata.number_of_channels == 1
+        with profile_stage(
+            "stream_resample"
+        ) as stage, self.open_source_blocks(block_size) as (
+            sample_rate, source_channels, blocks
+        ):
+            channels = 1 if mono else source_channels
+            resampler = (
+                get_resample_stream(
+                    sample_rate,
+                    new_audiofile_metadata.sample_rate,
+                    channels,
+                    quality,
+                )
+                if sample_rate != new_audiofile_metadata.sample_rate
+                else None
+            )
+            with new.open_output() as output, sf.SoundFile(
+                output,
+                mode="w",
+                samplerate=new_audiofile_metadata.sample_rate,
+                channels=channels,
+                subtype=new_audiofile_metadata.subtype,
+                format=WAVE_OUTPUT_FORMAT,
+            ) as destination:
+                for block in blocks:
+                    if mono:
+                        block = block.mean(axis=1, keepdims=True)
+                    if resampler:
+                        block = resampler.resample_chunk(block)
+                    destination.write(block)
+                if resampler:
+                    destination.write(
+                        resampler.resample_chunk(
+                            np.zeros((0, channels), dtype="float32"),
+                            last=True,
+                        )
+                    )
+            if stage:
+                stage.add_bytes(
+                    read=o_path.getsize(self.file_path),
+                    written=new.get_output_size(),
+                )
 
     @staticmethod
-    def convert_librosa_stereo_output_for_soundfile(
+    def convert_librosa_output_for_soundfile(
         data
-    ):
+    ) -> np.ndarray:
         """
         librosa and SoundFile libraries follow different conventions for
-        handling stereo audio data
+        handling multichannel audio data
 
         librosa.load produces data in the following manner
           array([
@@ -476,9 +1049,16 @@ class WaveFile(AudioFile):
                 ],
                 dtype=float32)
 
+        The transposed view is returned for any channel count without
+        copying, SoundFile makes the single contiguous interleaved buffer
+        when writing. Mono (1d) data is returned unchanged.
+
         ref: bit.ly/3C9PkIc
         """
-        return [[data[0][i], data[1][i]] for i in range(len(data[0]))]
+        data = np.asarray(data)
+        if data.ndim < 2:
+            return data
+        return data.T
 
     @staticmethod
     def get_base_extensions() -> Set[str]:
@@ -1,11 +1,4 @@
-from os import path as _o_path
-from sys import path as _s_path
-
-file_dir = _o_path.dirname(__file__)
-_s_path.append(file_dir)
-
-# pylint: disable=wrong-import-position
-from base_types import AudioFileType, WaveFileType, WaveFile  # noqa: E402
+from .base_types import AudioFileType, WaveFileType, WaveFile
 
 
 class HyperionImpulseType(WaveFileType):
@@ -31,6 +24,8 @@ class HyperionImpulse(WaveFile):
     e520 Hyperion Effects Processor
     """
 
+    __slots__ = ()
+
     def __init__(
         self,
         file_path,
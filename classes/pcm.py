@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from os import stat as o_stat
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from .riff import probe_wave_layout
+
+# Sample dtype of each subtype that can be mapped, see map_pcm_data for
+# how PCM_24 gets to be read as int32
+MAPPED_SUBTYPES: Dict[str, str] = {
+    "PCM_U8": "u1",
+    "PCM_16": "<i2",
+    "PCM_24": "<i4",
+    "PCM_32": "<i4",
+    "FLOAT": "<f4",
+    "DOUBLE": "<f8",
+}
+# Frames converted per step when a whole chunk is read, bounds the int32
+# temporaries next to the float output
+PCM_CONVERT_FRAMES: int = 1 << 16
+_INT32_SCALE = np.float32(1.0 / (1 << 31))
+# Clears the byte read ahead of each PCM_24 sample
+_PCM_24_MASK = np.int32(-256)
+
+
+@dataclass
+class PCMData:
+    """
+    Dataclass for the data chunk of a wave file mapped read only. samples
+    is a (frames, channels) view straight onto the file so reading it only
+    touches the page cache. For PCM_24 each element also holds the byte
+    before the sample in its low byte, read_int32 masks it off
+    """
+    subtype: str
+    sample_rate: int
+    channels: int
+    samples: np.ndarray
+
+    @property
+    def frames(self) -> int:
+        """Number of whole frames in the data chunk"""
+        return self.samples.shape[0]
+
+    def read_int32(self, start: int = 0, stop: Optional[int] = None):
+        # type: (int, Optional[int])->np.ndarray
+        """
+        Provides frames [start, stop) of integer PCM as left justified
+        int32, the same values SoundFile reads with dtype="int32"
+        """
+        samples = self.samples[start:stop]
+        match self.subtype:
+            case "PCM_24":
+                return samples & _PCM_24_MASK
+            case "PCM_U8":
+                return (samples.astype(np.int32) - 128) << 24
+            case "PCM_16":
+                return samples.astype(np.int32) << 16
+            case "PCM_32":
+                return np.array(samples, dtype=np.int32)
+        raise ValueError(f"{self.subtype} is not integer PCM")
+
+    def read_float32(self, start: int = 0, stop: Optional[int] = None):
+        # type: (int, Optional[int])->np.ndarray
+        """
+        Provides frames [start, stop) as float32 in [-1, 1), converted the
+        way libsndfile does so results match SoundFile's float reads
+        """
+        stop = self.frames if stop is None else min(stop, self.frames)
+        if self.subtype in ("FLOAT", "DOUBLE"):
+            return np.array(self.samples[start:stop], dtype=np.float32)
+        data = np.empty((max(stop - start, 0), self.channels), np.float32)
+        for offset in range(start, stop, PCM_CONVERT_FRAMES):
+            end = min(offset + PCM_CONVERT_FRAMES, stop)
+            block = data[offset - start:end - start]
+            if self.subtype == "PCM_16":
+                # exact in float32 without going through int32
+                np.multiply(
+                    self.samples[offset:end],
+                    np.float32(1.0 / (1 << 15)),
+                    out=block,
+                )
+            else:
+                np.multiply(
+                    self.read_int32(offset, end).astype(np.float32),
+                    _INT32_SCALE,
+                    out=block,
+                )
+        return data
+
+    def iter_blocks(
+        self, block_size: int, dtype: str = "float32"
+    ) -> Iterator[np.ndarray]:
+        """Yields (frames, channels) blocks, like SoundFile.blocks"""
+        read = self.read_int32 if dtype == "int32" else self.read_float32
+        for start in range(0, self.frames, block_size):
+            yield read(start, start + block_size)
+
+
+def map_pcm_data(file_path: str) -> Optional[PCMData]:
+    """
+    Helper function, maps the data chunk of an uncompressed wave file.
+    Returns None for anything it can't map (compressed, truncated header,
+    empty data), those are left to SoundFile
+    """
+    header = probe_wave_layout(file_path)
+    if (
+        header is None
+        or header.data_offset is None
+        or header.subtype not in MAPPED_SUBTYPES
+    ):
+        return None
+    sample_bytes = header.bits_per_sample // 8
+    if header.block_align < sample_bytes * header.channels:
+        return None
+    # streamed files may leave the size at 0xFFFFFFFF, the file length is
+    # the real bound
+    frames = min(
+        header.data_size, o_stat(file_path).st_size - header.data_offset
+    ) // header.block_align
+    if frames <= 0:
+        return None
+    # PCM_24 is mapped from one byte early and read as overlapping little
+    # endian int32, each sample lands in the top three bytes already left
+    # justified. The data chunk always follows a chunk header so that byte
+    # exists, and the last read ends exactly at the end of the data
+    lead = 1 if header.subtype == "PCM_24" else 0
+    raw = np.memmap(
+        file_path,
+        dtype=np.uint8,
+        mode="r",
+        offset=header.data_offset - lead,
+        shape=(frames * header.block_align + lead,),
+    )
+    samples = np.ndarray(
+        (frames, header.channels),
+        dtype=MAPPED_SUBTYPES[header.subtype],
+        buffer=raw,
+        strides=(header.block_align, sample_bytes),
+    )
+    return PCMData(
+        subtype=header.subtype,
+        sample_rate=header.sample_rate,
+        channels=header.channels,
+        samples=samples,
+    )
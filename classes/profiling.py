@@ -0,0 +1,263 @@
+import json
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from threading import Lock, local
+from time import perf_counter, thread_time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+DEFAULT_PROFILE_SLOWEST: int = 10
+
+_active = local()
+
+
+@dataclass
+class StageRecord:
+    """Dataclass for one stage of work done for one source file"""
+    file_path: str
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float
+    bytes_read: int = 0
+    bytes_written: int = 0
+
+
+class _Stage:
+    """Times one stage, cpu time is that of the calling thread"""
+    __slots__ = (
+        "records", "file_path", "stage", "bytes_read", "bytes_written",
+        "_wall", "_cpu",
+    )
+
+    def __init__(self, records: List[StageRecord], file_path: str, stage):
+        self.records = records
+        self.file_path = file_path
+        self.stage = stage
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._wall = 0.0
+        self._cpu = 0.0
+
+    def __enter__(self):
+        self._wall = perf_counter()
+        self._cpu = thread_time()
+        return self
+
+    def __exit__(self, *_):
+        self.records.append(StageRecord(
+            self.file_path,
+            self.stage,
+            perf_counter() - self._wall,
+            thread_time() - self._cpu,
+            self.bytes_read,
+            self.bytes_written,
+        ))
+
+    def add_bytes(self, read: int = 0, written: int = 0) -> None:
+        """Counts bytes moved by the stage"""
+        self.bytes_read += read
+        self.bytes_written += written
+
+
+class _NullStage:
+    """
+    Stand in used while profiling is off, it is falsy so callers can skip
+    work that only feeds the profile (e.g. stat calls for byte counts)
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return None
+
+    def add_bytes(self, read: int = 0, written: int = 0) -> None:
+        """Does nothing"""
+
+
+_NULL_STAGE = _NullStage()
+
+
+def profile_stage(stage: str):
+    """
+    Provides a context manager timing stage for the file being profiled on
+    this thread, a shared no-op one when none is
+    """
+    records = getattr(_active, "records", None)
+    if records is None:
+        return _NULL_STAGE
+    return _Stage(records, _active.file_path, stage)
+
+
+@contextmanager
+def profile_file(
+    file_path: str,
+    enabled: bool = True,
+) -> Iterator[Optional[List[StageRecord]]]:
+    """
+    Collects the stages run on this thread for file_path, yields the list
+    they are recorded in, None when not enabled
+    """
+    if not enabled:
+        yield None
+        return
+    previous = (
+        getattr(_active, "records", None),
+        getattr(_active, "file_path", None),
+    )
+    records: List[StageRecord] = []
+    _active.records, _active.file_path = records, file_path
+    try:
+        yield records
+    finally:
+        _active.records, _active.file_path = previous
+
+
+class ConversionProfile:
+    """
+    Aggregates stage records from every thread and worker process of a run
+    into a report. A disabled profile records nothing
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.records: List[StageRecord] = []
+        self.wall_seconds = 0.0
+        self._started = perf_counter()
+        self._lock = Lock()
+
+    def add(self, records: Optional[Iterable[StageRecord]]) -> None:
+        """Adds records collected elsewhere, e.g. from a ConversionResult"""
+        if self.enabled and records:
+            with self._lock:
+                self.records.extend(records)
+
+    def stage(self, stage: str, file_path: str = ""):
+        """Provides a context manager timing stage in the calling thread"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(_LockedRecords(self), file_path, stage)
+
+    def timed(self, stage: str, files: Iterable[str]) -> Iterator[str]:
+        """
+        Yields from files, recording the time spent waiting for each one
+        against it, used to time a scan that is consumed lazily
+        """
+        if not self.enabled:
+            yield from files
+            return
+        iterator = iter(files)
+        while True:
+            wall, cpu = perf_counter(), thread_time()
+            try:
+                file = next(iterator)
+            except StopIteration:
+                return
+            self.add([StageRecord(
+                file, stage, perf_counter() - wall, thread_time() - cpu
+            )])
+            yield file
+
+    def stop(self) -> None:
+        """Marks the end of the run"""
+        self.wall_seconds = perf_counter() - self._started
+
+    def get_stage_totals(self) -> Dict[str, Dict[str, Any]]:
+        """Provides totals per stage"""
+        totals: Dict[str, Dict[str, Any]] = {}
+        for record in self.records:
+            total = totals.setdefault(record.stage, {
+                "count": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "max_wall_seconds": 0.0,
+                "bytes_read": 0,
+                "bytes_written": 0,
+            })
+            total["count"] += 1
+            total["wall_seconds"] += record.wall_seconds
+            total["cpu_seconds"] += record.cpu_seconds
+            total["max_wall_seconds"] = max(
+                total["max_wall_seconds"], record.wall_seconds
+            )
+            total["bytes_read"] += record.bytes_read
+            total["bytes_written"] += record.bytes_written
+        for total in totals.values():
+            total["mean_wall_seconds"] = total["wall_seconds"] / total["count"]
+            for key in (
+                "wall_seconds", "cpu_seconds", "max_wall_seconds",
+                "mean_wall_seconds",
+            ):
+                total[key] = round(total[key], 6)
+        return totals
+
+    def get_report(
+        self,
+        slowest: int = DEFAULT_PROFILE_SLOWEST,
+    ) -> Dict[str, Any]:
+        """
+        Provides the aggregate per stage, the slowest files (summed over
+        their stages) and the slowest single stage records
+        """
+        files: Dict[str, Dict[str, Any]] = {}
+        for record in self.records:
+            entry = files.setdefault(record.file_path, {
+                "file_path": record.file_path,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "stages": {},
+            })
+            entry["wall_seconds"] += record.wall_seconds
+            entry["cpu_seconds"] += record.cpu_seconds
+            entry["stages"][record.stage] = round(
+                entry["stages"].get(record.stage, 0.0) + record.wall_seconds,
+                6,
+            )
+        slowest_files = sorted(
+            files.values(), key=lambda entry: entry["wall_seconds"]
+        )[::-1][:slowest]
+        for entry in slowest_files:
+            entry["wall_seconds"] = round(entry["wall_seconds"], 6)
+            entry["cpu_seconds"] = round(entry["cpu_seconds"], 6)
+        return {
+            "wall_seconds": round(self.wall_seconds, 6),
+            "files": len(files),
+            "stages": self.get_stage_totals(),
+            "slowest_files": slowest_files,
+            "slowest_stages": [
+                dict(
+                    asdict(record),
+                    wall_seconds=round(record.wall_seconds, 6),
+                    cpu_seconds=round(record.cpu_seconds, 6),
+                )
+                for record in sorted(
+                    self.records, key=lambda record: record.wall_seconds
+                )[::-1][:slowest]
+            ],
+        }
+
+    def dump(
+        self,
+        file_path: str,
+        slowest: int = DEFAULT_PROFILE_SLOWEST,
+    ) -> None:
+        """Writes the report as JSON"""
+        with open(file_path, "w", encoding="utf-8") as handle:
+            json.dump(self.get_report(slowest), handle, indent=2)
+            handle.write("\n")
+
+
+class _LockedRecords:
+    """List like sink appending into a profile under its lock"""
+    __slots__ = ("profile",)
+
+    def __init__(self, profile: ConversionProfile):
+        self.profile = profile
+
+    def append(self, record: StageRecord) -> None:
+        """Appends a record to the profile"""
+        with self.profile._lock:  # pylint: disable=protected-access
+            self.profile.records.append(record)
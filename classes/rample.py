@@ -1,10 +1,4 @@
-from os import path as _o_path
-from sys import path as _s_path
-file_dir = _o_path.dirname(__file__)
-_s_path.append(file_dir)
-
-# pylint: disable=wrong-import-position
-from base_types import AudioFileType, WaveFileType, WaveFile  # noqa: E402
+from .base_types import AudioFileType, WaveFileType, WaveFile
 
 
 class RampleSampleType(WaveFileType):
@@ -31,6 +25,8 @@ class RampleSampleType(WaveFileType):
 class RampleSample(WaveFile):
     """Sample file that is compliant with Squarp Rample"""
 
+    __slots__ = ()
+
     def __init__(
         self,
         file_path,
@@ -0,0 +1,90 @@
+from functools import lru_cache
+from typing import Optional, Tuple
+from zlib import crc32
+
+import numpy as np
+
+from .riff import hash_wave_audio
+
+# SoundFile hands integer PCM of any width over left justified in int32,
+# this is the depth every requantization step is measured from
+CONTAINER_BIT_DEPTH: int = 32
+
+
+def get_dither_seed(file_path: str) -> int:
+    """
+    Provides a stable dither seed from a file's audio, so identical sources
+    get identical outputs wherever they are, and serial, parallel and
+    cached runs agree. Files without a data chunk are seeded by path
+    """
+    audio_hash = hash_wave_audio(file_path)
+    if audio_hash is None:
+        return crc32(file_path.encode("utf-8"))
+    return int(audio_hash[:16], 16)
+
+
+def requantize(
+    data: np.ndarray,
+    bit_depth: int,
+    rng: Optional[np.random.Generator] = None,
+    error: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Reduces left justified int32 PCM (frames, channels) to bit_depth, the
+    result stays left justified int32 with the low bits cleared so that
+    SoundFile writes it to a bit_depth subtype exactly, including the
+    unsigned offset of PCM_U8.
+        rng: adds TPDF dither of +/-1 LSB at the target depth when given
+        error: per channel error state, first order noise shaping is applied
+            when given, the updated state is returned for the next block
+    """
+    if bit_depth >= CONTAINER_BIT_DEPTH:
+        return data, error
+    step = 1 << (CONTAINER_BIT_DEPTH - bit_depth)
+    scaled = data.astype(np.float64)
+    scaled /= step
+    dither = (
+        rng.random(scaled.shape) - rng.random(scaled.shape)
+        if rng is not None
+        else None
+    )
+    if error is not None:
+        quantized, error = _get_noise_shaper()(
+            scaled,
+            dither if dither is not None else np.zeros_like(scaled),
+            error,
+        )
+    else:
+        if dither is not None:
+            scaled += dither
+        quantized = np.rint(scaled, out=scaled)
+    np.clip(
+        quantized,
+        -(1 << (bit_depth - 1)),
+        (1 << (bit_depth - 1)) - 1,
+        out=quantized,
+    )
+    return (quantized.astype(np.int64) * step).astype(np.int32), error
+
+
+@lru_cache(maxsize=1)
+def _get_noise_shaper():
+    """
+    Builds the error feedback loop on first use, it is inherently
+    sequential so it is compiled with numba (already required by librosa)
+    """
+    from numba import njit  # pylint: disable=import-outside-toplevel
+
+    @njit(cache=True)
+    def shape_noise(scaled, dither, error):
+        quantized = np.empty_like(scaled)
+        error = error.copy()
+        for frame in range(scaled.shape[0]):
+            for channel in range(scaled.shape[1]):
+                wanted = scaled[frame, channel] - error[channel]
+                value = np.rint(wanted + dither[frame, channel])
+                quantized[frame, channel] = value
+                error[channel] = value - wanted
+        return quantized, error
+
+    return shape_noise
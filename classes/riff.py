@@ -0,0 +1,203 @@
+from dataclasses import dataclass
+from hashlib import blake2b
+from struct import Struct
+from typing import BinaryIO, Dict, Iterable, Optional
+
+# Bytes read per file, covers the fmt chunk of nearly every wave file
+HEADER_PROBE_SIZE: int = 4096
+# Bytes read at once while hashing a data chunk
+AUDIO_HASH_BLOCK_SIZE: int = 1 << 20
+WAVE_FORMAT_PCM: int = 0x0001
+WAVE_FORMAT_IEEE_FLOAT: int = 0x0003
+WAVE_FORMAT_ALAW: int = 0x0006
+WAVE_FORMAT_MULAW: int = 0x0007
+WAVE_FORMAT_EXTENSIBLE: int = 0xFFFE
+
+_CHUNK_HEADER = Struct("<4sI")
+_FMT_CHUNK = Struct("<HHIIHH")
+# cbSize, wValidBitsPerSample, dwChannelMask, then the SubFormat GUID whose
+# leading two bytes hold the actual format tag
+_FMT_EXTENSION = Struct("<HHIH")
+
+
+@dataclass
+class WaveHeader:
+    """Dataclass for the fields of a wave file fmt chunk"""
+    format_tag: int
+    channels: int
+    sample_rate: int
+    block_align: int
+    bits_per_sample: int
+    subtype: Optional[str]
+    # where the data chunk body starts and its declared size, only filled
+    # in when the header was read with find_data
+    data_offset: Optional[int] = None
+    data_size: Optional[int] = None
+
+
+def get_subtype_from_format(format_tag: int, bits: int) -> Optional[str]:
+    """
+    Provides the SoundFile subtype name for a wave format tag and sample
+    width, None when the pair is not a plain PCM/float/companded format
+    """
+    match (format_tag, bits):
+        case (0x0001, 8):
+            return "PCM_U8"
+        case (0x0001, 16):
+            return "PCM_16"
+        case (0x0001, 24):
+            return "PCM_24"
+        case (0x0001, 32):
+            return "PCM_32"
+        case (0x0003, 32):
+            return "FLOAT"
+        case (0x0003, 64):
+            return "DOUBLE"
+        case (0x0006, 8):
+            return "ALAW"
+        case (0x0007, 8):
+            return "ULAW"
+    return None
+
+
+def parse_fmt_chunk(body: bytes) -> Optional[WaveHeader]:
+    """
+    Parses the body of a fmt chunk, including WAVE_FORMAT_EXTENSIBLE
+    Returns None for anything SoundFile should be asked about instead
+    """
+    if len(body) < _FMT_CHUNK.size:
+        return None
+    (
+        format_tag, channels, sample_rate, _, block_align, bits
+    ) = _FMT_CHUNK.unpack_from(body)
+    if format_tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(body) < _FMT_CHUNK.size + _FMT_EXTENSION.size:
+            return None
+        format_tag = _FMT_EXTENSION.unpack_from(body, _FMT_CHUNK.size)[3]
+    subtype = get_subtype_from_format(format_tag, bits)
+    if not channels or not sample_rate or not subtype:
+        return None
+    return WaveHeader(
+        format_tag=format_tag,
+        channels=channels,
+        sample_rate=sample_rate,
+        block_align=block_align,
+        bits_per_sample=bits,
+        subtype=subtype,
+    )
+
+
+def read_wave_header(
+    handle: BinaryIO,
+    find_data: bool = False,
+) -> Optional[WaveHeader]:
+    """
+    Walks the RIFF chunks of an open binary file until the fmt chunk.
+    Only the first HEADER_PROBE_SIZE bytes are read unless the fmt chunk
+    sits after a large chunk (e.g. data before fmt), in which case it
+    seeks past that chunk rather than reading it
+        find_data: keep walking until the data chunk is found as well and
+            record where it is, its body is never read
+    """
+    buffer = handle.read(HEADER_PROBE_SIZE)
+    if (
+        len(buffer) < 12
+        or buffer[0:4] != b"RIFF"
+        or buffer[8:12] != b"WAVE"
+    ):
+        return None
+    start, position = 0, 12
+    header, data = None, None
+    while True:
+        if position + _CHUNK_HEADER.size > start + len(buffer):
+            buffer, start = _read_at(handle, position, _CHUNK_HEADER.size)
+            if len(buffer) < _CHUNK_HEADER.size:
+                return header
+        chunk_id, chunk_size = _CHUNK_HEADER.unpack_from(
+            buffer, position - start
+        )
+        body = position + _CHUNK_HEADER.size
+        if chunk_id == b"fmt ":
+            if body + chunk_size > start + len(buffer):
+                buffer, start = _read_at(handle, body, chunk_size)
+            header = parse_fmt_chunk(
+                buffer[body - start:body - start + chunk_size]
+            )
+            if not find_data or header is None:
+                return header
+        elif chunk_id == b"data" and find_data:
+            data = (body, chunk_size)
+        if header and data:
+            header.data_offset, header.data_size = data
+            return header
+        # chunks are word aligned, odd sizes carry a pad byte
+        position = body + chunk_size + (chunk_size & 1)
+
+
+def _read_at(handle: BinaryIO, position: int, size: int):
+    """Reads at least size bytes from position, returns (buffer, start)"""
+    handle.seek(position)
+    return handle.read(max(size, HEADER_PROBE_SIZE)), position
+
+
+def probe_wave_header(file_path: str) -> Optional[WaveHeader]:
+    """
+    Helper function, header only probe of a single wave file
+    Returns None when the file can't be read or parsed
+    """
+    try:
+        with open(file_path, "rb", buffering=0) as handle:
+            return read_wave_header(handle)
+    except OSError:
+        return None
+
+
+def probe_wave_layout(file_path: str) -> Optional[WaveHeader]:
+    """
+    Helper function, probes a wave file for its fmt chunk and where its
+    data chunk is. Returns None when the file can't be read or parsed
+    """
+    try:
+        with open(file_path, "rb", buffering=0) as handle:
+            return read_wave_header(handle, find_data=True)
+    except OSError:
+        return None
+
+
+def hash_wave_audio(file_path: str) -> Optional[str]:
+    """
+    Helper function, hashes the audio of a wave file: its format and the
+    body of its data chunk. Copies that only differ in other chunks (tags,
+    cue points) hash the same. None when the data chunk can't be found
+    """
+    header = probe_wave_layout(file_path)
+    if header is None or header.data_offset is None:
+        return None
+    digest = blake2b(digest_size=20)
+    digest.update(
+        f"{header.format_tag}:{header.channels}:{header.sample_rate}:"
+        f"{header.bits_per_sample}:{header.block_align}".encode("utf-8")
+    )
+    with open(file_path, "rb") as handle:
+        handle.seek(header.data_offset)
+        remaining = header.data_size
+        while remaining > 0:
+            block = handle.read(min(remaining, AUDIO_HASH_BLOCK_SIZE))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def probe_wave_headers(
+    file_paths: Iterable[str],
+) -> Dict[str, Optional[WaveHeader]]:
+    """
+    Helper function, header only probe of many wave files, one unbuffered
+    read of HEADER_PROBE_SIZE per file in the common case
+    """
+    return {
+        file_path: probe_wave_header(file_path)
+        for file_path in file_paths
+    }
@@ -1,12 +1,119 @@
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import asdict, dataclass, replace
+from functools import partial
+from importlib import import_module
+from io import BytesIO
+from os import makedirs as o_makedirs
 from os import path as o_path
-from os import walk as o_walk
-from typing import Optional, Tuple
+from os import scandir as o_scandir
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
+from cache import (
+    DEFAULT_CACHE_SIZE,
+    ConversionCache,
+    get_cache_key,
+    hash_audio,
+)
+from manifest import (
+    ConversionManifest,
+    get_parameters_fingerprint,
+    hash_file,
+)
+from passthrough import materialize_file
+from classes.atomic import is_partial_file
 from classes.base_types import AudioData, AudioFile
-from classes.octatrack import OctatrackSample
-from classes.rample import RampleSample
-from classes.tracker import PolyendTrackerSample
-from classes.hyperion import HyperionImpulse
+from classes.profiling import StageRecord, profile_file, profile_stage
+from classes.resamplers import DEFAULT_QUALITY, DEFAULT_RESAMPLER
+
+# Number of files queued per worker, keeps the pool busy without draining
+# the whole input iterable up front
+FILES_IN_FLIGHT_PER_JOB: int = 2
+# Directories listed concurrently while scanning, listing is IO bound so this
+# mostly helps on network mounts
+DEFAULT_SCAN_THREADS: int = 8
+# sample type -> (module, class) of its processor, imported on first use
+SAMPLE_PROCESSORS: Dict[str, Tuple[str, str]] = {
+    "octa": ("classes.octatrack", "OctatrackSample"),
+    "tracker": ("classes.tracker", "PolyendTrackerSample"),
+    "rample": ("classes.rample", "RampleSample"),
+    "hyperion": ("classes.hyperion", "HyperionImpulse"),
+}
+
+
+@dataclass
+class ConversionOptions:
+    """Dataclass for settings shared by every file in a conversion run"""
+    input_dir: str
+    output_dir: str
+    sample_rate: Optional[int] = None
+    bit_depth: Optional[int] = None
+    force_mono: bool = False
+    resample_all: bool = False
+    append_string: Optional[str] = None
+    replace_files: bool = False
+    block_size: Optional[int] = None
+    hash_sources: bool = False
+    pass_through: Optional[str] = None
+    resampler: str = DEFAULT_RESAMPLER
+    quality: str = DEFAULT_QUALITY
+    dither: bool = True
+    noise_shaping: bool = False
+    profile: bool = False
+    cache_dir: Optional[str] = None
+    cache_method: str = "auto"
+    # bytes cache_dir may hold once a run or batch is done
+    cache_size: int = DEFAULT_CACHE_SIZE
+    # outputs are encoded in memory and handed back on the result for the
+    # caller to write (an archive, the card writer), nothing is written to
+    # output_dir
+    buffer_outputs: bool = False
+
+
+@dataclass
+class ConversionResult:
+    """Dataclass for the outcome of converting a single file"""
+    file_path: str
+    sample_type: Optional[str] = None
+    converted: bool = False
+    exception: Optional[Exception] = None
+    output_path: Optional[str] = None
+    content_hash: Optional[str] = None
+    copied: bool = False
+    bytes_copied: int = 0
+    bytes_transcoded: int = 0
+    profile: Optional[List[StageRecord]] = None
+    cached: bool = False
+    output_data: Optional[bytes] = None
+    # wall time spent on the file, shared by its sample types
+    seconds: float = 0.0
+
+    @property
+    def status(self) -> str:
+        """Outcome in a word: failed, cached, converted, copied or skipped"""
+        if self.exception is not None:
+            return "failed"
+        if self.cached:
+            return "cached"
+        if self.converted:
+            return "converted"
+        return "copied" if self.copied else "skipped"
 
 
 def append_filename_before_extension(
@@ -49,30 +156,79 @@ def find_all_target_files(
         directory: a path to an existing directory
         sample_type: the sample type to look for
     """
-    target_files = []
-    if o_path.isdir(directory):
-        for root, _, files in o_walk(directory):
-            for file in files:
-                full_path = o_path.join(root, file)
-                if o_path.splitext(full_path)[1] in file_extensions:
-                    target_files.append(full_path)
-    return target_files
+    return list(iter_target_files(directory, file_extensions))
+
+
+def iter_target_files(
+    directory: str,
+    file_extensions: set,
+    threads: int = DEFAULT_SCAN_THREADS,
+) -> Iterator[str]:
+    """
+    Helper function, yields the absolute path of each file under directory
+    whose extension is in file_extensions (ignoring case) as soon as its
+    directory has been listed.
+        threads: number of directories listed concurrently
+    Files come out in discovery order rather than os.walk order
+    """
+    if not o_path.isdir(directory):
+        return
+    extensions = {extension.lower() for extension in file_extensions}
+    executor = ThreadPoolExecutor(max_workers=threads)
+    try:
+        pending = {executor.submit(_scan_directory, directory, extensions)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirectories = future.result()
+                pending.update(
+                    executor.submit(_scan_directory, subdirectory, extensions)
+                    for subdirectory in subdirectories
+                )
+                yield from files
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _scan_directory(
+    directory: str,
+    extensions: Set[str],
+) -> Tuple[List[str], List[str]]:
+    """
+    Lists one directory, returning (matching files, subdirectories).
+    Extensions are checked on the entry name so no path is built for files
+    that don't match, unreadable directories are skipped like os.walk does
+    """
+    files, subdirectories = [], []
+    try:
+        with o_scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.path)
+                    continue
+                if is_partial_file(name):
+                    continue
+                dot = name.rfind(".")
+                if dot > 0 and name[dot:].lower() in extensions:
+                    files.append(entry.path)
+    except OSError:
+        pass
+    return files, subdirectories
 
 
 def get_sample_processor(
     sample_type: str,
 ) -> AudioFile:
     """
-    Helper function, to return sample types
+    Helper function, to return sample types. Only the module of the type
+    asked for is imported
     """
-    if sample_type == "octa":
-        return OctatrackSample
-    if sample_type == "tracker":
-        return PolyendTrackerSample
-    if sample_type == "rample":
-        return RampleSample
-    if sample_type == "hyperion":
-        return HyperionImpulse
+    if sample_type not in SAMPLE_PROCESSORS:
+        return None
+    module, name = SAMPLE_PROCESSORS[sample_type]
+    return getattr(import_module(module), name)
 
 
 def generate_input_output_file_metadata(
@@ -89,20 +245,55 @@ def generate_input_output_file_metadata(
     existing_file = proc(file)
     existing_file.update_instance_metadata()
     target_file = proc(file)
+    target_file.file_path = get_target_file_path(
+        file,
+        target_file.file_type.short_name,
+        input_dir,
+        output_dir,
+        append_string,
+        replace_files,
+    )
+    return existing_file, target_file
 
-    if replace_files:
-        return existing_file, target_file
 
-    if input_dir != output_dir:
-        target_file.file_path = o_path.join(
-            output_dir, target_file.file_path.strip(input_dir)
-        )
+def get_output_file_path(
+    file: str,
+    proc: AudioFile,
+    options: ConversionOptions,
+) -> str:
+    """
+    Helper function, provides the output path convert_target_file will use
+    """
+    return get_target_file_path(
+        file,
+        proc(file).file_type.short_name,
+        options.input_dir,
+        options.output_dir,
+        options.append_string,
+        options.replace_files,
+    )
 
-    target_file.file_path = append_filename_before_extension(
-        target_file.file_path,
-        append_string if append_string else target_file.file_type.short_name,
+
+def get_target_file_path(  # pylint: disable=too-many-arguments
+    file: str,
+    short_name: str,
+    input_dir: str,
+    output_dir: str,
+    append_string: Optional[str],
+    replace_files: bool = False,
+) -> str:
+    """
+    Helper function, provides the output path for a file without opening it
+    """
+    if replace_files:
+        return file
+    target_path = file
+    if input_dir != output_dir:
+        target_path = o_path.join(output_dir, o_path.relpath(file, input_dir))
+    return append_filename_before_extension(
+        target_path,
+        append_string if append_string else short_name,
     )
-    return existing_file, target_file
 
 
 def update_target_values(
@@ -120,3 +311,466 @@ def update_target_values(
         sample_rate=sample_rate if sample_rate else target_file.sample_rate,
         subtype="n/a",
     )
+
+
+def convert_target_file(
+    file: str,
+    proc: AudioFile,
+    options: ConversionOptions,
+) -> ConversionResult:
+    """
+    Helper function, runs the conversion decision and resample for a single
+    file. Exceptions are kept on the result rather than raised, so the
+    caller owns the failure tallies whether this runs inline or in a worker
+    """
+    result = ConversionResult(file_path=file, sample_type=proc.__name__)
+    with profile_file(file, options.profile) as records:
+        try:
+            existing, target = resolve_target_file(
+                file, proc, options, result
+            )
+            if needs_conversion(existing, target, options):
+                make_output_directory(target)
+                cache_key = fetch_cached_file(
+                    existing, target, options, result
+                )
+                if not result.cached:
+                    existing.resample_audio_file(
+                        target,
+                        options.block_size,
+                        options.resampler,
+                        options.quality,
+                        options.dither,
+                        options.noise_shaping,
+                    )
+                    record_transcoded_file(result, target)
+                    store_cached_file(cache_key, result, options)
+            elif options.pass_through:
+                pass_through_file(file, target.file_path, options, result)
+        except Exception as ex:  # pylint: disable=broad-except
+            result.exception = ex
+    result.profile = records
+    return result
+
+
+def convert_target_file_to_many(
+    file: str,
+    procs: Sequence[AudioFile],
+    options: ConversionOptions,
+) -> List[ConversionResult]:
+    """
+    Helper function, converts a single file to several sample types with
+    one decode shared between them, returns a result per sample type
+    """
+    with profile_file(file, options.profile) as records:
+        results = _convert_target_file_to_many(file, procs, options)
+    # the stages are shared between sample types, so they are reported once
+    results[0].profile = records
+    return results
+
+
+def _convert_target_file_to_many(
+    file: str,
+    procs: Sequence[AudioFile],
+    options: ConversionOptions,
+) -> List[ConversionResult]:
+    """Body of convert_target_file_to_many"""
+    results = [
+        ConversionResult(file_path=file, sample_type=proc.__name__)
+        for proc in procs
+    ]
+    resolve_options = replace(options, hash_sources=False)
+    conversions = []
+    audio_hash = None
+    for proc, result in zip(procs, results):
+        try:
+            existing, target = resolve_target_file(
+                file, proc, resolve_options, result
+            )
+            if needs_conversion(existing, target, options):
+                make_output_directory(target)
+                if options.cache_dir and audio_hash is None:
+                    audio_hash = hash_source_audio(file)
+                cache_key = fetch_cached_file(
+                    existing, target, options, result, audio_hash
+                )
+                if not result.cached:
+                    conversions.append((existing, target, result, cache_key))
+            elif options.pass_through:
+                pass_through_file(file, target.file_path, options, result)
+        except Exception as ex:  # pylint: disable=broad-except
+            result.exception = ex
+    try:
+        if options.hash_sources:
+            content_hash = hash_source_file(file)
+            for result in results:
+                result.content_hash = content_hash
+    except Exception as ex:  # pylint: disable=broad-except
+        for _, _, result, _ in conversions:
+            result.exception = ex
+        return results
+    if not conversions:
+        return results
+    failures = conversions[0][0].resample_audio_files(
+        [target for _, target, _, _ in conversions],
+        options.block_size,
+        options.resampler,
+        options.quality,
+        options.dither,
+        options.noise_shaping,
+    )
+    # each target succeeds or fails on its own, one failed write doesn't
+    # discount the outputs already written
+    for (_, target, result, cache_key), failure in zip(conversions, failures):
+        if failure is not None:
+            result.exception = failure
+            continue
+        try:
+            record_transcoded_file(result, target)
+            store_cached_file(cache_key, result, options)
+        except Exception as ex:  # pylint: disable=broad-except
+            result.exception = ex
+    return results
+
+
+def resolve_target_file(
+    file: str,
+    proc: AudioFile,
+    options: ConversionOptions,
+    result: ConversionResult,
+) -> Tuple[AudioFile, AudioFile]:
+    """
+    Helper function, reads the existing file and prepares the target it
+    would be converted to
+    """
+    if options.hash_sources:
+        result.content_hash = hash_source_file(file)
+    existing, target = generate_input_output_file_metadata(
+        file,
+        proc,
+        options.input_dir,
+        options.output_dir,
+        options.append_string,
+        options.replace_files,
+    )
+    target_metadata = update_target_values(
+        target,
+        options.sample_rate,
+        options.bit_depth,
+        options.force_mono,
+    )
+    target.insert_instance_metadata(target_metadata)
+    if options.buffer_outputs:
+        target.output_buffer = BytesIO()
+    return existing, target
+
+
+def hash_source_file(file: str) -> str:
+    """Helper function, hashes a source for the manifest"""
+    with profile_stage("hash") as stage:
+        if stage:
+            stage.add_bytes(read=o_path.getsize(file))
+        return hash_file(file)
+
+
+def hash_source_audio(file: str) -> str:
+    """Helper function, hashes the audio of a source for the cache"""
+    with profile_stage("hash_audio") as stage:
+        if stage:
+            stage.add_bytes(read=o_path.getsize(file))
+        return hash_audio(file)
+
+
+def get_manifest_parameters(options: ConversionOptions) -> str:
+    """
+    Helper function, fingerprints the options besides the target format
+    that change what a conversion writes, for the manifest to compare
+    """
+    return get_parameters_fingerprint(
+        {
+            "resampler": options.resampler,
+            "quality": options.quality,
+            "dither": options.dither,
+            "noise_shaping": options.noise_shaping,
+        }
+    )
+
+
+def is_source_current(
+    manifest: ConversionManifest,
+    file: str,
+    procs: Sequence[AudioFile],
+    options: ConversionOptions,
+) -> bool:
+    """
+    Helper function, whether manifest records file as handled with options
+    for every sample type in procs and unchanged since. A source that met
+    the target is only current without an output when the run wouldn't
+    write one either (no --resample-all or --pass-through)
+    """
+    parameters = get_manifest_parameters(options)
+    return all(
+        manifest.is_current(
+            file,
+            proc.__name__,
+            options.bit_depth,
+            options.sample_rate,
+            options.force_mono,
+            get_output_file_path(file, proc, options),
+            require_output=options.resample_all
+            or options.pass_through is not None,
+            parameters=parameters,
+        )
+        for proc in procs
+    )
+
+
+def record_manifest_result(
+    manifest: ConversionManifest,
+    result: ConversionResult,
+    options: ConversionOptions,
+) -> None:
+    """Helper function, records a result whose output is in place"""
+    manifest.record(
+        result.file_path,
+        result.sample_type,
+        options.bit_depth,
+        options.sample_rate,
+        options.force_mono,
+        result.output_path,
+        result.content_hash,
+        get_manifest_parameters(options),
+    )
+
+
+def get_conversion_parameters(
+    existing: AudioFile,
+    target: AudioFile,
+    options: ConversionOptions,
+) -> Dict[str, Any]:
+    """
+    Helper function, everything besides the source audio that decides the
+    bytes written when existing is converted into target
+    """
+    metadata = existing.get_resample_metadata(target)
+    return {
+        "sample_type": type(target).__name__,
+        "target": asdict(metadata),
+        "block_size": options.block_size,
+        "resampler": options.resampler,
+        "quality": options.quality,
+        "dither": options.dither,
+        "noise_shaping": options.noise_shaping,
+    }
+
+
+def fetch_cached_file(
+    existing: AudioFile,
+    target: AudioFile,
+    options: ConversionOptions,
+    result: ConversionResult,
+    audio_hash: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Helper function, places the cached conversion of existing into target
+    when there is one and marks result as cached. Returns the key to store
+    the output under once converted, None when caching is off
+        audio_hash: hash_audio of the source, when already known
+    """
+    if not options.cache_dir:
+        return None
+    if audio_hash is None:
+        audio_hash = hash_source_audio(existing.file_path)
+    cache_key = get_cache_key(
+        audio_hash, get_conversion_parameters(existing, target, options)
+    )
+    cache = ConversionCache(options.cache_dir, method=options.cache_method)
+    with profile_stage("cache_fetch") as stage:
+        if target.output_buffer is not None:
+            data = cache.read(cache_key)
+            if data is not None:
+                target.output_buffer.write(data)
+            hit = data is not None
+        else:
+            hit = cache.fetch(cache_key, target.file_path)
+        if hit:
+            record_transcoded_file(result, target)
+            result.cached = True
+            stage.add_bytes(written=result.bytes_transcoded)
+    return cache_key
+
+
+def store_cached_file(
+    cache_key: Optional[str],
+    result: ConversionResult,
+    options: ConversionOptions,
+) -> None:
+    """Helper function, adds the output of a converted result to the cache"""
+    if cache_key is None:
+        return
+    with profile_stage("cache_store") as stage:
+        cache = ConversionCache(options.cache_dir)
+        if result.output_data is not None:
+            cache.store_data(cache_key, result.output_data)
+        else:
+            cache.store(cache_key, result.output_path)
+        stage.add_bytes(written=result.bytes_transcoded)
+
+
+def evict_cached_files(options: ConversionOptions) -> List[str]:
+    """
+    Helper function, evicts the least recently used outputs until the
+    cache fits in options.cache_size. Returns the paths removed
+    """
+    if not options.cache_dir:
+        return []
+    return ConversionCache(options.cache_dir, options.cache_size).evict()
+
+
+def needs_conversion(
+    existing: AudioFile,
+    target: AudioFile,
+    options: ConversionOptions,
+) -> bool:
+    """Helper function, whether existing has to be resampled into target"""
+    return existing != target or options.resample_all
+
+
+def make_output_directory(target: AudioFile) -> None:
+    """
+    Helper function, creates the directory an output is written into,
+    nothing is created for outputs kept in memory
+    """
+    directory = o_path.dirname(target.file_path)
+    if directory and target.output_buffer is None:
+        o_makedirs(directory, exist_ok=True)
+
+
+def record_transcoded_file(result: ConversionResult, target: AudioFile):
+    """
+    Helper function, marks a result as converted into target, taking the
+    encoded output along when it was kept in memory
+    """
+    result.converted = True
+    result.output_path = target.file_path
+    if target.output_buffer is not None:
+        result.output_data = target.output_buffer.getvalue()
+        target.output_buffer = None
+    result.bytes_transcoded = (
+        len(result.output_data)
+        if result.output_data is not None
+        else o_path.getsize(target.file_path)
+    )
+
+
+def pass_through_file(
+    file: str,
+    file_path: str,
+    options: ConversionOptions,
+    result: ConversionResult,
+) -> None:
+    """
+    Helper function, copies a compliant file to its output unmodified. When
+    outputs are buffered the caller copies the source itself, only the
+    result is set
+    """
+    with profile_stage("copy") as stage:
+        if options.buffer_outputs or materialize_file(
+            file, file_path, options.pass_through
+        ):
+            result.copied = True
+            result.bytes_copied = o_path.getsize(file)
+            stage.add_bytes(
+                read=result.bytes_copied, written=result.bytes_copied
+            )
+        # also when the output already is the source, so the manifest
+        # records it in place
+        result.output_path = file_path
+
+
+def convert_target_files(
+    files: Iterable[str],
+    procs: Sequence[AudioFile],
+    options: ConversionOptions,
+    jobs: int = 1,
+) -> Iterator[ConversionResult]:
+    """
+    Helper function, converts files to every sample type in procs and
+    yields a result per file and sample type in input order, so a parallel
+    run reports exactly like a serial one.
+        jobs: number of worker processes, 1 converts in this process
+    Closing the iterator early cancels any files not yet started
+    """
+    convert = get_file_converter(procs)
+    if jobs <= 1:
+        for file in files:
+            yield from convert(file, options=options)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        try:
+            for file in files:
+                # metadata the parent already holds (a plan's probes) goes
+                # along, the worker's own cache starts out empty
+                pending.append((file, executor.submit(
+                    _convert_with_metadata,
+                    convert,
+                    file,
+                    options,
+                    AudioFile.metadata_cache.peek(file),
+                )))
+                if len(pending) >= jobs * FILES_IN_FLIGHT_PER_JOB:
+                    yield from _collect_pending_results(*pending.popleft())
+            while pending:
+                yield from _collect_pending_results(*pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def get_file_converter(
+    procs: Sequence[AudioFile],
+) -> Callable[..., List[ConversionResult]]:
+    """
+    Helper function, the picklable function converting one file to every
+    sample type in procs, called as convert(file, options=options)
+    """
+    if len(procs) == 1:
+        return partial(_convert_to_single, proc=procs[0])
+    return partial(convert_target_file_to_many, procs=procs)
+
+
+def _convert_to_single(
+    file: str,
+    proc: AudioFile,
+    options: ConversionOptions,
+) -> List[ConversionResult]:
+    """Single sample type counterpart of convert_target_file_to_many"""
+    return [convert_target_file(file, proc, options)]
+
+
+def _convert_with_metadata(
+    convert: Callable[..., List[ConversionResult]],
+    file: str,
+    options: ConversionOptions,
+    cached: Optional[Tuple[Tuple[str, int, int], AudioData]],
+) -> List[ConversionResult]:
+    """
+    Worker side of convert_target_files, primes the worker's metadata cache
+    with the entry the parent sent before converting. The key holds the
+    size and mtime, so a source changed since then is probed again
+    """
+    if cached:
+        AudioFile.metadata_cache.put(*cached)
+    return convert(file, options=options)
+
+
+def _collect_pending_results(file: str, future) -> List[ConversionResult]:
+    """
+    Waits on a worker future, failures of the pool itself (a crashed worker
+    or an unpicklable exception) are reported against the file
+    """
+    try:
+        return future.result()
+    except Exception as ex:  # pylint: disable=broad-except
+        return [ConversionResult(file_path=file, exception=ex)]
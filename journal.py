@@ -0,0 +1,126 @@
+import json
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from os import makedirs as o_makedirs
+from os import path as o_path
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+JOURNAL_VERSION: int = 1
+JOURNAL_FILENAME: str = ".neophyte_journal.ndjson"
+
+
+@dataclass
+class JournalEntry:
+    """Dataclass for one finished source and sample type of a run"""
+    source_path: str
+    sample_type: str
+    status: str  # "done" or "failed"
+    output_path: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ConversionJournal:
+    """
+    Append only NDJSON record of every source and sample type a run has
+    finished, written as results arrive so an interrupted run can be
+    resumed. The first line holds the parameters of the run, a resume
+    with different ones is refused. Lines are flushed one at a time, a
+    line cut short by a crash is ignored when the journal is read back
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        parameters: Dict[str, Any],
+        resume: bool = False,
+        filename: str = JOURNAL_FILENAME,
+    ):
+        o_makedirs(output_dir, exist_ok=True)
+        self.file_path = o_path.join(output_dir, filename)
+        self.parameters = parameters
+        self.done: Set[Tuple[str, str]] = set()
+        if resume and o_path.exists(self.file_path):
+            torn = self._read()
+            self._handle = open(self.file_path, "a", encoding="utf-8")
+            if torn:
+                # the earlier run died mid line, start on a fresh one
+                self._handle.write("\n")
+            return
+        self._handle = open(self.file_path, "w", encoding="utf-8")
+        self._write_line({
+            "version": JOURNAL_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(
+                timespec="seconds"
+            ),
+            "parameters": parameters,
+        })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _read(self) -> bool:
+        """
+        Loads what an earlier run finished, raises ValueError when it had
+        other parameters. Returns whether the last line is unterminated
+        """
+        with open(self.file_path, "r", encoding="utf-8") as handle:
+            try:
+                header = json.loads(handle.readline() or "{}")
+            except json.JSONDecodeError:
+                header = {}
+            if header.get("version") != JOURNAL_VERSION:
+                raise ValueError(
+                    f"{self.file_path} is not a version {JOURNAL_VERSION} "
+                    "journal"
+                )
+            # round trip, so tuples compare equal to the lists read back
+            if header.get("parameters") != json.loads(
+                json.dumps(self.parameters)
+            ):
+                raise ValueError(
+                    f"{self.file_path} was written by a run with different "
+                    "parameters"
+                )
+            line = ""
+            for line in handle:
+                try:
+                    entry = JournalEntry(**json.loads(line))
+                except (json.JSONDecodeError, TypeError):
+                    continue
+                key = (entry.source_path, entry.sample_type)
+                if entry.status == "done":
+                    self.done.add(key)
+                else:
+                    self.done.discard(key)
+        return bool(line) and not line.endswith("\n")
+
+    def _write_line(self, values: Dict[str, Any]) -> None:
+        self._handle.write(json.dumps(values) + "\n")
+        self._handle.flush()
+
+    def is_done(self, source_path: str, sample_types: Iterable[str]) -> bool:
+        """Whether an earlier run finished source_path for every sample type"""
+        return all(
+            (source_path, sample_type) in self.done
+            for sample_type in sample_types
+        )
+
+    def record(  # pylint: disable=too-many-arguments
+        self,
+        source_path: str,
+        sample_type: str,
+        status: str,
+        output_path: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Appends a finished source and sample type"""
+        self._write_line(asdict(JournalEntry(
+            source_path, sample_type, status, output_path, error
+        )))
+
+    def close(self) -> None:
+        """Closes the journal, everything recorded is already written"""
+        self._handle.close()
@@ -1,96 +1,435 @@
 #!/usr/bin/python3
 
+import cProfile
+import json
 import os
+import platform
 import random
+import signal
+from contextlib import nullcontext
+from functools import partial
+from time import perf_counter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
 import click
 
+from archive import OutputArchive, get_archive_format, get_archive_name
+from batch import convert_batch, shutdown_worker_pool
+from cache import DEFAULT_CACHE_SIZE, parse_size
+from card_writer import DEFAULT_CARD_BATCH_SIZE, CardWriter
 from helpers import (
-    find_all_target_files,
+    SAMPLE_PROCESSORS,
+    ConversionOptions,
+    ConversionResult,
+    convert_target_files,
+    evict_cached_files,
     get_sample_processor,
-    generate_input_output_file_metadata,
-    update_target_values,
+    is_source_current,
+    iter_target_files,
+    record_manifest_result,
 )
-
-
-@click.command()
-@click.option(
-    "--sample-type",
-    "-t",
-    type=click.Choice(["octa", "tracker", "rample", "hyperion"]),
-    help="Target Sample type to use",
+from journal import JOURNAL_FILENAME, ConversionJournal
+from manifest import MANIFEST_FILENAME, ConversionManifest
+from passthrough import PASS_THROUGH_METHODS
+from pipeline import DEFAULT_IO_THREADS, ConversionPipeline
+from plan import (
+    PlanEntry,
+    get_source_frames,
+    plan_target_file,
+    prime_metadata_cache,
+    read_plan,
+    write_plan,
 )
-@click.option(
-    "--bit-depth",
-    "-b",
-    type=click.Choice(["8", "16", "24", "32"]),
-    default=None,
-    help="Force bit depth to a specific value",
+from sharding import (
+    SHARD_MODES,
+    Shard,
+    merge_shard_summaries,
+    read_shard_summaries,
+    select_by_cost,
+    select_by_hash,
+    write_shard_summary,
 )
-@click.option(
-    "--sample_rate",
-    "-r",
-    type=click.Choice([
-        "44", "44.1", "48", "88", "88.2", "96", "176", "176.4", "192",
-        "44100", "48000", "88200", "96000", "176400", "192000"
-    ]),
-    default=None,
-    help="Force sample rate to specific value, \
-        44.1 and 44100 are similarly mapped"
-)
-@click.option(
-    "--force_mono",
-    "-m",
-    is_flag=True,
-    default=False,
-    help="Ensure all files are set to mono"
-)
-@click.option(
-    "--output-dir",
-    "-o",
-    type=click.Path(file_okay=False, resolve_path=True),
-    default=None,
-    help="Destination target for output"
-)
-@click.option(
-    "--input-dir",
-    "-i",
-    type=click.Path(exists=True, file_okay=False, resolve_path=True),
-    default=os.getcwd(),
-    help="Input target"
-)
-@click.option(
-    "--append-string",
-    "-a",
-    default=None,
-    help="Modify string pattern appended to filenames, default is shortname",
-)
-@click.option(
-    "--replace-files",
-    "-rf",
-    is_flag=True,
-    default=False,
-    help="Ignore output_dir and extension, replace all found files",
-)
-@click.option(
-    "--resample-all",
-    "-ra",
-    is_flag=True,
-    default=False,
-    help="Resample all files found, regardless if a difference is observed",
-)
-@click.option(
-    "--failure-rate",
-    "-f",
-    default=0.10,
-    type=float,
-    help="Percentage of files to fail before stopping",
-)
-@click.option(
-    "--test",
-    is_flag=True,
-    default=False,
-    help="Test pattern",
+from watch import DEFAULT_SETTLE_SECONDS, DirectoryWatcher, SettleTracker
+from classes.base_types import AudioFile
+from classes.profiling import DEFAULT_PROFILE_SLOWEST, ConversionProfile
+from classes.resamplers import (
+    DEFAULT_QUALITY,
+    DEFAULT_RESAMPLER,
+    QUALITIES,
+    RESAMPLERS,
 )
+
+
+TARGET_OPTIONS = [
+    click.option(
+        "--sample-type",
+        "-t",
+        type=click.Choice(list(SAMPLE_PROCESSORS)),
+        multiple=True,
+        required=True,
+        help="Target Sample type to use, repeat to convert each file to \
+            several targets from a single decode",
+    ),
+    click.option(
+        "--bit-depth",
+        "-b",
+        type=click.Choice(["8", "16", "24", "32"]),
+        default=None,
+        help="Force bit depth to a specific value",
+    ),
+    click.option(
+        "--sample_rate",
+        "-r",
+        type=click.Choice([
+            "44", "44.1", "48", "88", "88.2", "96", "176", "176.4", "192",
+            "44100", "48000", "88200", "96000", "176400", "192000"
+        ]),
+        default=None,
+        help="Force sample rate to specific value, \
+            44.1 and 44100 are similarly mapped"
+    ),
+    click.option(
+        "--force_mono",
+        "-m",
+        is_flag=True,
+        default=False,
+        help="Ensure all files are set to mono"
+    ),
+    click.option(
+        "--output-dir",
+        "-o",
+        type=click.Path(file_okay=False, resolve_path=True),
+        default=None,
+        help="Destination target for output"
+    ),
+    click.option(
+        "--input-dir",
+        "-i",
+        type=click.Path(exists=True, file_okay=False, resolve_path=True),
+        default=os.getcwd(),
+        help="Input target"
+    ),
+    click.option(
+        "--append-string",
+        "-a",
+        default=None,
+        help="Modify string pattern appended to filenames, \
+            default is shortname",
+    ),
+    click.option(
+        "--replace-files",
+        "-rf",
+        is_flag=True,
+        default=False,
+        help="Ignore output_dir and extension, replace all found files",
+    ),
+    click.option(
+        "--resample-all",
+        "-ra",
+        is_flag=True,
+        default=False,
+        help="Resample all files found, \
+            regardless if a difference is observed",
+    ),
+    click.option(
+        "--test",
+        is_flag=True,
+        default=False,
+        help="Test pattern",
+    ),
+    click.option(
+        "--incremental",
+        "-inc",
+        is_flag=True,
+        default=False,
+        help="Skip sources unchanged since the last run with the same \
+            target and resampler settings, tracked in a manifest kept in \
+            the output dir",
+    ),
+    click.option(
+        "--pass-through",
+        "-pt",
+        type=click.Choice(PASS_THROUGH_METHODS),
+        default=None,
+        help="Copy files already meeting the target into the output dir \
+            without decoding, auto picks reflink/copy_file_range/copy per \
+            filesystem",
+    ),
+]
+
+
+def parse_shard(_ctx, _param, value) -> Optional[Shard]:
+    """click callback for --shard"""
+    try:
+        return Shard.parse(value) if value else None
+    except ValueError as ex:
+        raise click.BadParameter(str(ex))
+
+
+def parse_byte_size(_ctx, _param, value) -> int:
+    """click callback for --cache-size and --card-batch-size"""
+    try:
+        return parse_size(value)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex))
+
+
+def parse_output_archive(_ctx, _param, value) -> Optional[str]:
+    """click callback for --output-archive"""
+    if value:
+        try:
+            get_archive_format(value)
+        except ValueError as ex:
+            raise click.BadParameter(str(ex))
+    return value
+
+
+RESAMPLE_OPTIONS = [
+    click.option(
+        "--resampler",
+        type=click.Choice(RESAMPLERS),
+        default=DEFAULT_RESAMPLER,
+        help="Resampler backend, soxr is the faster one at hq and vhq, \
+            polyphase is scipy's resample_poly for rational ratios",
+    ),
+    click.option(
+        "--quality",
+        "-q",
+        type=click.Choice(QUALITIES),
+        default=DEFAULT_QUALITY,
+        help="Resampler quality, draft trades accuracy for speed. Each \
+            level gives about the same SNR on either backend",
+    ),
+    click.option(
+        "--dither/--no-dither",
+        default=True,
+        help="TPDF dither when only the bit depth is reduced",
+    ),
+    click.option(
+        "--noise-shaping",
+        is_flag=True,
+        default=False,
+        help="First order noise shaping when only the bit depth is reduced",
+    ),
+]
+
+
+RUN_OPTIONS = [
+    click.option(
+        "--failure-rate",
+        "-f",
+        default=0.10,
+        type=float,
+        help="Percentage of files to fail before stopping",
+    ),
+    click.option(
+        "--jobs",
+        "-j",
+        type=click.IntRange(min=1),
+        default=1,
+        help="Number of worker processes used for conversion",
+    ),
+    click.option(
+        "--block-size",
+        "-bs",
+        type=click.IntRange(min=1),
+        default=None,
+        help="Stream files through the resampler this many frames at a time, \
+            keeps memory flat for long files (soxr only)",
+    ),
+    click.option(
+        "--collect-garbage",
+        "-gc",
+        is_flag=True,
+        default=False,
+        help="Remove outputs recorded in the manifest whose source \
+            was deleted",
+    ),
+    click.option(
+        "--pipeline",
+        "-p",
+        is_flag=True,
+        default=False,
+        help="Overlap reading, resampling (--jobs threads) and writing in \
+            stages joined by bounded queues, reports per stage utilisation",
+    ),
+    click.option(
+        "--io-threads",
+        type=click.IntRange(min=1),
+        default=DEFAULT_IO_THREADS,
+        help="Reader and writer threads each used by --pipeline",
+    ),
+    *RESAMPLE_OPTIONS,
+    click.option(
+        "--profile",
+        type=click.Path(dir_okay=False, writable=True),
+        default=None,
+        help="Time every stage of every file (wall, cpu, bytes) and write the \
+            totals and slowest files to this JSON file",
+    ),
+    click.option(
+        "--profile-slowest",
+        type=click.IntRange(min=1),
+        default=DEFAULT_PROFILE_SLOWEST,
+        help="Number of slowest files and stages kept by --profile",
+    ),
+    click.option(
+        "--cprofile",
+        type=click.Path(dir_okay=False, writable=True),
+        default=None,
+        help="Run the conversion under cProfile and dump pstats to this file, \
+            covers this process and thread only",
+    ),
+    click.option(
+        "--shard",
+        default=None,
+        callback=parse_shard,
+        help="Only convert shard i of N (e.g. 2/8), hosts sharing the input \
+            and output dirs split the work without talking to each other",
+    ),
+    click.option(
+        "--shard-by",
+        type=click.Choice(SHARD_MODES),
+        default="hash",
+        help="Split shards by a hash of the input relative path, or by \
+            probed frames so shards get similar work (lists all input first)",
+    ),
+    click.option(
+        "--cache-dir",
+        type=click.Path(file_okay=False, resolve_path=True),
+        default=None,
+        help="Keep converted outputs here keyed by source audio and target \
+            parameters, duplicate sources in this and later runs are \
+            placed from it instead of converted again",
+    ),
+    click.option(
+        "--cache-size",
+        type=str,
+        default=str(DEFAULT_CACHE_SIZE),
+        callback=parse_byte_size,
+        help="Bytes the cache may hold after a run or batch (e.g. 512M, \
+            2G), least recently used outputs are evicted past it",
+    ),
+    click.option(
+        "--cache-method",
+        type=click.Choice(PASS_THROUGH_METHODS),
+        default="auto",
+        help="How cached outputs are placed, hardlink shares the cached \
+            inode so outputs must not be edited in place",
+    ),
+    click.option(
+        "--resume",
+        is_flag=True,
+        default=False,
+        help="Continue an interrupted run, sources the journal in the output \
+            dir records as done are skipped without being probed",
+    ),
+    click.option(
+        "--output-archive",
+        type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+        default=None,
+        callback=parse_output_archive,
+        help="Stream every output into this .tar or .zip, laid out as in \
+            the output dir, instead of writing files there",
+    ),
+    click.option(
+        "--card-writer",
+        is_flag=True,
+        default=False,
+        help="Write outputs for slow removable media (SD cards): held in \
+            batches, written in directory order preallocated to size and \
+            synced once per batch",
+    ),
+    click.option(
+        "--card-batch-size",
+        type=str,
+        default=str(DEFAULT_CARD_BATCH_SIZE),
+        callback=parse_byte_size,
+        help="Bytes of outputs the card writer holds before writing a \
+            batch (e.g. 64M, 256M)",
+    ),
+]
+
+
+def add_options(options):
+    """Applies a list of click options to a command, in listed order"""
+    def decorator(function):
+        for option in reversed(options):
+            function = option(function)
+        return function
+    return decorator
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    Group running default_command when no sub command is named, so
+    `main.py -t octa ...` keeps working next to `main.py plan ...`
+    """
+
+    def __init__(self, *args, default_command: str = "convert", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in (
+            "--help",
+        ):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+def parse_sample_rate(sample_rate: Optional[str]) -> Optional[int]:
+    """Maps the --sample_rate choices onto a rate in Hz"""
+    if not sample_rate:
+        return None
+    if sample_rate in ["44", "44.1", "44100"]:
+        return 44100
+    if sample_rate in ["88", "88.2", "88200"]:
+        return 88200
+    if sample_rate in ["176", "176.4", "176400"]:
+        return 176400
+    return (
+        int(sample_rate) * 1000
+        if int(sample_rate) < 1000
+        else int(sample_rate)
+    )
+
+
+def check_sample_types(sample_type, append_string, replace_files) -> None:
+    """Rejects options that only make sense for a single sample type"""
+    if len(sample_type) > 1 and (append_string or replace_files):
+        raise click.UsageError(
+            "--append-string and --replace-files need a single --sample-type"
+        )
+
+
+def get_target_files(input_dir, file_extensions, test) -> Iterable[str]:
+    """Provides the sources under input_dir, 5 random ones for --test"""
+    target_files = iter_target_files(input_dir, file_extensions)
+    if test:
+        target_files = random.sample(list(target_files), 5)
+    return target_files
+
+
+@click.group(cls=DefaultCommandGroup)
+def cli():
+    """
+    Convert samples for hardware samplers, runs convert when no command
+    is given
+    """
+
+
+@cli.command("convert")
+@add_options(TARGET_OPTIONS)
+@add_options(RUN_OPTIONS)
 def convert_files(  # pylint: disable=too-many-arguments,too-many-locals
     sample_type,
     input_dir,
@@ -103,80 +442,680 @@ def convert_files(  # pylint: disable=too-many-arguments,too-many-locals
     replace_files,
     failure_rate,
     test,
+    jobs,
+    block_size,
+    incremental,
+    collect_garbage,
+    pass_through,
+    pipeline,
+    io_threads,
+    resampler,
+    quality,
+    dither,
+    noise_shaping,
+    profile,
+    profile_slowest,
+    cprofile,
+    shard,
+    shard_by,
+    cache_dir,
+    cache_size,
+    cache_method,
+    resume,
+    output_archive,
+    card_writer,
+    card_batch_size,
+    planned: Optional[List[PlanEntry]] = None,
 ):
     """
     Find all the files in a given location and convert to new sample types
+        planned: entries of a plan to run instead of scanning input_dir
     """
-    sample_proc = get_sample_processor(sample_type)
-    file_extensions = sample_proc.get_base_extensions()
+    if pipeline and block_size:
+        raise click.UsageError(
+            "--pipeline can't be combined with --block-size"
+        )
+    check_sample_types(sample_type, append_string, replace_files)
+    if len(sample_type) > 1 and pipeline:
+        raise click.UsageError("--pipeline needs a single --sample-type")
+    if output_archive and (
+        incremental or resume or replace_files or collect_garbage
+    ):
+        raise click.UsageError(
+            "--output-archive writes a new archive every run, it can't be "
+            "combined with --incremental, --resume, --replace-files or "
+            "--collect-garbage"
+        )
+    if output_archive and block_size:
+        # every archive member is encoded in memory, which would undo the
+        # flat memory --block-size streams for
+        raise click.UsageError(
+            "--output-archive holds each output in memory, it can't be "
+            "combined with --block-size"
+        )
+    if block_size and resampler != "soxr":
+        # the streaming path resamples through soxr's ResampleStream
+        raise click.UsageError(
+            "--block-size streams through soxr, it can't be combined with "
+            f"--resampler {resampler}"
+        )
+    if card_writer and block_size:
+        raise click.UsageError(
+            "--card-writer holds each output in memory, it can't be "
+            "combined with --block-size"
+        )
+    if output_archive and card_writer:
+        raise click.UsageError(
+            "--card-writer can't be combined with --output-archive"
+        )
+    sample_procs = [
+        get_sample_processor(_t) for _t in dict.fromkeys(sample_type)
+    ]
+    sample_names = ", ".join(proc.__name__ for proc in sample_procs)
+    file_extensions = set().union(
+        *(proc.get_base_extensions() for proc in sample_procs)
+    )
     bit_depth = int(bit_depth) if bit_depth else None
-    if sample_rate:
-        if sample_rate in ["44", "44.1", "44100"]:
-            sample_rate = 44100
-        elif sample_rate in ["88", "88.2", "88200"]:
-            sample_rate = 88200
-        elif sample_rate in ["176", "176.4", "176400"]:
-            sample_rate = 176400
-        else:
-            sample_rate = (
-                int(sample_rate) * 1000
-                if int(sample_rate) < 1000
-                else int(sample_rate)
-            )
-    click.echo(
-        f"Collecting all {file_extensions=} "
-        f"for {sample_proc.__name__} conversion under {input_dir}"
+    sample_rate = parse_sample_rate(sample_rate)
+    if planned is None:
+        click.echo(
+            f"Collecting all {file_extensions=} "
+            f"for {sample_names} conversion under {input_dir}"
+        )
+        target_files = get_target_files(input_dir, file_extensions, test)
+    else:
+        target_files, skipped_files = get_planned_files(planned, sample_procs)
+    if shard and shard_by == "cost":
+        frames = (
+            get_source_frames
+            if planned is None
+            else get_planned_frames(planned)
+        )
+        target_files, shard_cost = select_by_cost(
+            target_files,
+            input_dir,
+            shard,
+            lambda _f: frames(_f, sample_procs[0]),
+        )
+    elif shard:
+        target_files = select_by_hash(target_files, input_dir, shard)
+    output_dir = output_dir if output_dir else input_dir
+    options = ConversionOptions(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        sample_rate=sample_rate,
+        bit_depth=bit_depth,
+        force_mono=force_mono,
+        resample_all=resample_all,
+        append_string=append_string,
+        replace_files=replace_files,
+        block_size=block_size,
+        hash_sources=incremental,
+        pass_through=pass_through,
+        resampler=resampler,
+        quality=quality,
+        dither=dither,
+        noise_shaping=noise_shaping,
+        profile=bool(profile),
+        cache_dir=cache_dir,
+        cache_method=cache_method,
+        cache_size=cache_size,
+        buffer_outputs=bool(output_archive or card_writer),
     )
-    target_files = find_all_target_files(input_dir, file_extensions)
-    if test:
-        target_files = random.sample(target_files, 5)
+    if output_archive and shard:
+        # hosts given the same path each write their own archive
+        stem, extension = os.path.splitext(output_archive)
+        output_archive = f"{stem}_shard_{shard.get_label()}{extension}"
+    manifest = (
+        ConversionManifest(
+            output_dir,
+            f".neophyte_manifest_shard_{shard.get_label()}.sqlite"
+            if shard
+            else MANIFEST_FILENAME,
+        )
+        if incremental or collect_garbage
+        else None
+    )
+    if collect_garbage:
+        removed = manifest.collect_garbage()
+        click.echo(f"Removed {len(removed)} outputs of deleted sources")
+    sample_type_names = [proc.__name__ for proc in sample_procs]
+    try:
+        # an archive run writes nothing into the output dir
+        journal = None if output_archive else ConversionJournal(
+            output_dir,
+            {
+                "sample_type": sample_type_names,
+                **{
+                    key: getattr(options, key)
+                    for key in (
+                        "input_dir", "output_dir", "sample_rate", "bit_depth",
+                        "force_mono", "resample_all", "append_string",
+                        "replace_files", "pass_through", "block_size",
+                        "resampler", "quality", "dither", "noise_shaping",
+                    )
+                },
+            },
+            resume,
+            f".neophyte_journal_shard_{shard.get_label()}.ndjson"
+            if shard
+            else JOURNAL_FILENAME,
+        )
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint="--resume")
     # initialize counts
-    total_files = len(target_files)
+    total_files = 0
+    skipped = 0 if planned is None else skipped_files
+    resumed = 0
     converts = []
+    copies = []
+    cached = 0
     heretics = []
     exceptions = []
-    output_dir = output_dir if output_dir else input_dir
+    bytes_copied = 0
+    bytes_transcoded = 0
+
+    def discover_files():
+        """
+        Feeds files to conversion as the scan finds them, the progress bar
+        total is filled in once the scan is done
+        """
+        nonlocal total_files, skipped, resumed
+        for _f in stage_profile.timed("scan", target_files):
+            if resume and journal.is_done(_f, sample_type_names):
+                resumed += 1
+                continue
+            if incremental and planned is None:
+                with stage_profile.stage("manifest", _f):
+                    current = is_source_current(
+                        manifest, _f, sample_procs, options
+                    )
+                if current:
+                    skipped += 1
+                    continue
+            total_files += 1
+            yield _f
+        # one result per file and sample type
+        progressbar_files.length = total_files * len(sample_procs)
+
+    def record_done(result: ConversionResult) -> None:
+        """Records a result whose output is in place as done"""
+        if manifest:
+            record_manifest_result(manifest, result, options)
+        if journal:
+            journal.record(
+                result.file_path,
+                result.sample_type,
+                "done",
+                result.output_path,
+            )
+
     click.echo(
-        f"Ready to convert {total_files} "
-        f"{'file' if total_files == 1 else 'files'} "
-        f"to {sample_proc.__name__} conversion in "
-        f"{output_dir}"
+        f"Ready to convert files to {sample_names} conversion in "
+        f"{output_dir}, conversion starts as files are found"
     )
-    click.pause()
+    if planned is None:
+        click.pause()
+    stage_profile = ConversionProfile(enabled=bool(profile))
+    started = perf_counter()
+    profiler = cProfile.Profile() if cprofile else None
+    if profiler:
+        profiler.enable()
+    discovered_files = discover_files()
+    # The bar is advanced per result, it is only handed the discovered files
+    # to report the total once the scan completes
     with click.progressbar(
-        target_files, label="Attempting conversion"
-    ) as progressbar_files:
-        for _f in progressbar_files:
-            try:
-                existing, target = generate_input_output_file_metadata(
-                    _f,
-                    sample_proc,
-                    input_dir,
-                    output_dir,
-                    append_string,
-                    replace_files
-                )
-                target_metadata = update_target_values(
-                    target,
-                    sample_rate,
-                    bit_depth,
-                    force_mono
+        discovered_files, label="Attempting conversion", show_pos=True
+    ) as progressbar_files, (
+        OutputArchive(output_archive) if output_archive else nullcontext()
+    ) as archive, (
+        CardWriter(card_batch_size) if card_writer else nullcontext()
+    ) as writer:
+        if pipeline:
+            pipeline = ConversionPipeline(
+                sample_procs[0],
+                options,
+                readers=io_threads,
+                resamplers=jobs,
+                writers=io_threads,
+            )
+            results = pipeline.run(discovered_files)
+        else:
+            results = convert_target_files(
+                discovered_files, sample_procs, options, jobs
+            )
+        for result in results:
+            progressbar_files.update(1)
+            stage_profile.add(result.profile)
+            if result.exception is None:
+                if result.converted:
+                    converts.append(result.file_path)
+                if result.copied:
+                    copies.append(result.file_path)
+                cached += result.cached
+                bytes_copied += result.bytes_copied
+                bytes_transcoded += result.bytes_transcoded
+                if archive and result.output_path:
+                    add_to_archive(archive, result, output_dir)
+                if writer and result.output_path:
+                    # recorded once the card writer has the output in place
+                    add_to_card_writer(
+                        writer, result, partial(record_done, result)
+                    )
+                else:
+                    record_done(result)
+                continue
+            if journal:
+                journal.record(
+                    result.file_path,
+                    result.sample_type,
+                    "failed",
+                    error=repr(result.exception),
                 )
-                target.insert_instance_metadata(target_metadata)
-                if existing != target or resample_all:
-                    existing.resample_audio_file(target)
-                    converts.append(_f)
-            except Exception as ex:  # pylint: disable=broad-except
-                heretics.append(_f)
-                exceptions += [ex]
-                if (len(exceptions) / len(converts)) > failure_rate:
-                    break
+            heretics.append(result.file_path)
+            exceptions += [result.exception]
+            if (len(exceptions) / max(len(converts), 1)) > failure_rate:
+                results.close()
+                break
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(cprofile)
+    stage_profile.stop()
+    if journal:
+        journal.close()
+    if manifest:
+        manifest.close()
+    if archive:
+        click.echo(f"Archived {archive.entries} outputs to {output_archive}")
+    if writer:
+        click.echo(
+            "Card writer "
+            + " ".join(f"{k}={v}" for k, v in writer.get_report().items())
+        )
+    if resume:
+        click.echo(f"Resumed, skipped {resumed} files done by earlier runs")
+    if incremental:
+        click.echo(f"Skipped {skipped} unchanged files")
+    if pipeline:
+        for stage in pipeline.get_stats():
+            click.echo(" ".join(f"{k}={v}" for k, v in stage.items()))
     click.echo(f"Completed {total_files=} {len(converts)=} {len(heretics)=}")
+    if profile:
+        stage_profile.dump(profile, profile_slowest)
+        for stage, totals in stage_profile.get_stage_totals().items():
+            click.echo(
+                f"{stage=} " + " ".join(f"{k}={v}" for k, v in totals.items())
+            )
+    if pass_through:
+        click.echo(f"{len(copies)=} {bytes_copied=} {bytes_transcoded=}")
+    if cache_dir:
+        evicted = evict_cached_files(options)
+        click.echo(
+            f"{cached=} conversions placed from the cache, "
+            f"{len(evicted)} cached outputs evicted"
+        )
+    if shard:
+        # an archive run keeps its summary beside the archive
+        summary_dir = (
+            os.path.dirname(output_archive) if output_archive else output_dir
+        )
+        summary_path = write_shard_summary(summary_dir, shard, {
+            "files": total_files,
+            "skipped": skipped,
+            "converted": len(converts),
+            "copied": len(copies),
+            "cached": cached,
+            "failed": len(heretics),
+            "bytes_copied": bytes_copied,
+            "bytes_transcoded": bytes_transcoded,
+            "cost": shard_cost if shard_by == "cost" else 0,
+            "wall_seconds": round(perf_counter() - started, 3),
+            "host": platform.node(),
+            "failures": [
+                {"file_path": heretic, "exception": repr(exception)}
+                for heretic, exception in zip(heretics, exceptions)
+            ],
+        })
+        click.echo(f"Shard {shard} summary written to {summary_path}")
     if exceptions:
         click.echo(f"Exceptions occurred {len(exceptions)}, {heretics=}")
         if test:
             click.echo(f"Exceptions: \n {exceptions}")
 
 
+def add_to_archive(
+    archive: OutputArchive,
+    result: ConversionResult,
+    output_dir: str,
+) -> None:
+    """
+    Adds the output of a result to the archive under its path relative to
+    output_dir, copies are streamed from their source
+    """
+    name = get_archive_name(result.output_path, output_dir)
+    if result.output_data is not None:
+        archive.add_data(name, result.output_data)
+        result.output_data = None
+    elif result.copied:
+        archive.add_file(name, result.file_path)
+
+
+def add_to_card_writer(
+    writer: CardWriter,
+    result: ConversionResult,
+    on_written: Callable[[], None],
+) -> None:
+    """
+    Queues the output of a result on the card writer, copies are read from
+    their source when the batch is written
+    """
+    if result.output_data is not None:
+        writer.add_data(result.output_path, result.output_data, on_written)
+        result.output_data = None
+    elif result.copied:
+        writer.add_file(result.output_path, result.file_path, on_written)
+    else:
+        on_written()
+
+
+def get_planned_files(
+    planned: List[PlanEntry],
+    sample_procs,
+) -> Tuple[Iterator[str], int]:
+    """
+    Provides (sources to convert, sources skipped as unchanged) for a plan,
+    a source is converted when any sample type has work planned for it.
+    Probed metadata is handed to the cache just before each source is used
+    """
+    procs = {proc.__name__: proc for proc in sample_procs}
+    by_source: Dict[str, List[PlanEntry]] = {}
+    for entry in planned:
+        by_source.setdefault(entry.source_path, []).append(entry)
+    skipped_files = sum(
+        all(entry.skip_reason == "unchanged" for entry in entries)
+        for entries in by_source.values()
+    )
+
+    def iter_planned_files():
+        for source_path, entries in by_source.items():
+            if all(entry.action == "skip" for entry in entries):
+                continue
+            for entry in entries:
+                prime_metadata_cache(entry, procs[entry.sample_type])
+            yield source_path
+
+    return iter_planned_files(), skipped_files
+
+
+@cli.command("plan")
+@click.argument("plan_file", type=click.Path(dir_okay=False, writable=True))
+@add_options(TARGET_OPTIONS)
+def plan_files(  # pylint: disable=too-many-arguments,too-many-locals
+    plan_file,
+    sample_type,
+    input_dir,
+    output_dir,
+    bit_depth,
+    sample_rate,
+    force_mono,
+    resample_all,
+    append_string,
+    replace_files,
+    test,
+    incremental,
+    pass_through,
+):
+    """
+    Scan and probe headers only, write what convert would do as an NDJSON
+    plan for execute. Nothing is decoded or written besides the plan
+    """
+    check_sample_types(sample_type, append_string, replace_files)
+    parameters = click.get_current_context().params.copy()
+    del parameters["plan_file"]
+    sample_procs = [
+        get_sample_processor(_t) for _t in dict.fromkeys(sample_type)
+    ]
+    file_extensions = set().union(
+        *(proc.get_base_extensions() for proc in sample_procs)
+    )
+    output_dir = output_dir if output_dir else input_dir
+    options = ConversionOptions(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        sample_rate=parse_sample_rate(sample_rate),
+        bit_depth=int(bit_depth) if bit_depth else None,
+        force_mono=force_mono,
+        resample_all=resample_all,
+        append_string=append_string,
+        replace_files=replace_files,
+        pass_through=pass_through,
+    )
+    manifest = ConversionManifest(output_dir) if incremental else None
+    entries = (
+        plan_target_file(_f, proc, options, manifest)
+        for _f in get_target_files(input_dir, file_extensions, test)
+        for proc in sample_procs
+    )
+    try:
+        counts = write_plan(plan_file, parameters, entries)
+    finally:
+        if manifest:
+            manifest.close()
+    click.echo(
+        f"Planned {sum(counts.values())} entries to {plan_file}: "
+        + " ".join(f"{k}={v}" for k, v in counts.items())
+    )
+
+
+@cli.command("execute")
+@click.argument("plan_file", type=click.Path(exists=True, dir_okay=False))
+@add_options(RUN_OPTIONS)
+def execute_plan(plan_file, **run_options):
+    """
+    Run a plan written by plan, with the target options it was made with
+    """
+    try:
+        parameters, planned = read_plan(plan_file)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint="PLAN_FILE")
+    click.get_current_context().invoke(
+        convert_files, **parameters, **run_options, planned=planned
+    )
+
+
+@cli.command("watch")
+@add_options(TARGET_OPTIONS)
+@add_options(RESAMPLE_OPTIONS)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes, kept warm between conversions",
+)
+@click.option(
+    "--settle",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_SETTLE_SECONDS,
+    help="Seconds a new or changed file must go unwritten before it is \
+        converted",
+)
+def watch_files(  # pylint: disable=too-many-arguments,too-many-locals
+    sample_type,
+    input_dir,
+    output_dir,
+    bit_depth,
+    sample_rate,
+    force_mono,
+    resample_all,
+    append_string,
+    replace_files,
+    test,
+    incremental,
+    pass_through,
+    resampler,
+    quality,
+    dither,
+    noise_shaping,
+    jobs,
+    settle,
+):
+    """
+    Watch input_dir and convert files as they are added or changed, until
+    interrupted. Nothing is converted at start, run convert for that
+    """
+    check_sample_types(sample_type, append_string, replace_files)
+    sample_procs = [
+        get_sample_processor(_t) for _t in dict.fromkeys(sample_type)
+    ]
+    sample_names = ", ".join(proc.__name__ for proc in sample_procs)
+    file_extensions = set().union(
+        *(proc.get_base_extensions() for proc in sample_procs)
+    )
+    output_dir = output_dir if output_dir else input_dir
+    options = ConversionOptions(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        sample_rate=parse_sample_rate(sample_rate),
+        bit_depth=int(bit_depth) if bit_depth else None,
+        force_mono=force_mono,
+        resample_all=resample_all,
+        append_string=append_string,
+        replace_files=replace_files,
+        hash_sources=incremental,
+        pass_through=pass_through,
+        resampler=resampler,
+        quality=quality,
+        dither=dither,
+        noise_shaping=noise_shaping,
+    )
+    try:
+        watcher = DirectoryWatcher(input_dir, file_extensions)
+    except OSError as ex:
+        raise click.ClickException(str(ex))
+    manifest = ConversionManifest(output_dir) if incremental else None
+    tracker = SettleTracker(settle)
+    counts: Dict[str, int] = {}
+    click.echo(
+        f"Watching {input_dir} for {sample_names} conversion in "
+        f"{output_dir}, Ctrl+C stops"
+    )
+    # a service manager stops the watch with SIGTERM, end it like Ctrl+C
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    try:
+        with watcher:
+            while True:
+                for _f in watcher.read(tracker.get_timeout()):
+                    tracker.touch(_f)
+                if watcher.overflowed:
+                    # events were dropped, anything may have changed
+                    watcher.overflowed = False
+                    for _f in iter_target_files(input_dir, file_extensions):
+                        tracker.touch(_f)
+                settled = tracker.pop_settled()
+                if settled:
+                    convert_settled_files(
+                        settled,
+                        sample_procs,
+                        options,
+                        jobs,
+                        manifest,
+                        tracker,
+                        counts,
+                        test,
+                    )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if manifest:
+            manifest.close()
+        shutdown_worker_pool()
+    click.echo(
+        "Stopped watching " + " ".join(f"{k}={v}" for k, v in counts.items())
+    )
+
+
+def raise_keyboard_interrupt(_signum, _frame) -> None:
+    """Signal handler, stops a watch the way Ctrl+C does"""
+    raise KeyboardInterrupt
+
+
+def convert_settled_files(  # pylint: disable=too-many-arguments
+    files: List[str],
+    sample_procs: List[AudioFile],
+    options: ConversionOptions,
+    jobs: int,
+    manifest: Optional[ConversionManifest],
+    tracker: SettleTracker,
+    counts: Dict[str, int],
+    test: bool,
+) -> None:
+    """
+    Converts the files watch found settled on its warm workers, counting
+    results by status into counts. The outputs written are ignored by
+    tracker so they aren't taken for new sources
+    """
+    if manifest:
+        changed = [
+            _f for _f in files
+            if not is_source_current(manifest, _f, sample_procs, options)
+        ]
+        unchanged = len(files) - len(changed)
+        counts["unchanged"] = counts.get("unchanged", 0) + unchanged
+        files = changed
+    output_paths = []
+    for result in convert_batch(files, sample_procs, options, jobs):
+        counts[result.status] = counts.get(result.status, 0) + 1
+        click.echo(
+            f"{result.status} {result.file_path} -> "
+            f"{result.output_path or result.sample_type} "
+            f"{result.seconds:.3f}s"
+        )
+        if result.exception is not None:
+            if test:
+                click.echo(f"Exception: {result.exception!r}")
+            continue
+        if result.output_path:
+            output_paths.append(result.output_path)
+        if manifest:
+            record_manifest_result(manifest, result, options)
+    # their events are already queued or about to be, settle covers both
+    tracker.ignore(output_paths, max(tracker.settle, 1.0))
+
+
+def get_planned_frames(planned: List[PlanEntry]):
+    """Provides a frames lookup for the sources of a plan"""
+    frames = {entry.source_path: entry.frames or 0 for entry in planned}
+    return lambda _f, _proc: frames.get(_f, 0)
+
+
+@cli.command("merge-shards")
+@click.argument(
+    "output_dir", type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Write the merged summary to this JSON file",
+)
+def merge_shards(output_dir, report):
+    """
+    Merge the summaries --shard runs wrote into output_dir into one report
+    """
+    merged = merge_shard_summaries(read_shard_summaries(output_dir))
+    if report:
+        with open(report, "w", encoding="utf-8") as handle:
+            json.dump(merged, handle, indent=2)
+            handle.write("\n")
+    click.echo(
+        " ".join(
+            f"{k}={v}" for k, v in merged.items() if k != "failures"
+        )
+    )
+    if merged["missing_shards"]:
+        click.echo(f"Shards without a summary: {merged['missing_shards']}")
+
+
 if __name__ == "__main__":
-    convert_files()  # pylint: disable=no-value-for-parameter
+    cli()  # pylint: disable=no-value-for-parameter
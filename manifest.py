@@ -0,0 +1,254 @@
+import json
+import sqlite3
+from dataclasses import dataclass
+from hashlib import blake2b
+from os import makedirs as o_makedirs
+from os import path as o_path
+from os import remove as o_remove
+from os import stat as o_stat
+from threading import RLock
+from typing import Any, Dict, List, Optional
+
+MANIFEST_FILENAME: str = ".neophyte_manifest.sqlite"
+# Rows written between commits, one commit per file is far too slow on
+# large libraries
+MANIFEST_COMMIT_INTERVAL: int = 256
+HASH_BLOCK_SIZE: int = 1 << 20
+
+
+@dataclass
+class ManifestEntry:
+    """Dataclass for a source file as recorded by the last conversion"""
+    source_path: str
+    sample_type: str
+    size: int
+    mtime_ns: int
+    content_hash: Optional[str]
+    bit_depth: Optional[int]
+    sample_rate: Optional[int]
+    force_mono: bool
+    output_path: Optional[str]
+    parameters: Optional[str] = None
+
+
+def get_parameters_fingerprint(parameters: Dict[str, Any]) -> str:
+    """
+    Helper function, a short stable digest of the conversion parameters
+    that change output bytes without changing the target format
+    """
+    return blake2b(
+        json.dumps(parameters, sort_keys=True).encode("utf-8"),
+        digest_size=8,
+    ).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """Helper function, provides the content hash used by the manifest"""
+    digest = blake2b(digest_size=20)
+    with open(file_path, "rb") as handle:
+        for block in iter(lambda: handle.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """
+    On disk record of converted sources, kept as SQLite in the output
+    directory, lets a rerun skip sources that haven't changed since.
+    Safe to share between threads, e.g. a pipeline feeder and the caller
+    """
+
+    def __init__(self, output_dir: str, filename: str = MANIFEST_FILENAME):
+        o_makedirs(output_dir, exist_ok=True)
+        self.file_path = o_path.join(output_dir, filename)
+        self._connection = sqlite3.connect(
+            self.file_path, check_same_thread=False
+        )
+        self._lock = RLock()
+        self._pending = 0
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " source_path TEXT NOT NULL,"
+            " sample_type TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " content_hash TEXT,"
+            " bit_depth INTEGER,"
+            " sample_rate INTEGER,"
+            " force_mono INTEGER NOT NULL,"
+            " output_path TEXT,"
+            " parameters TEXT,"
+            " PRIMARY KEY (source_path, sample_type))"
+        )
+        columns = {
+            row[1]
+            for row in self._connection.execute("PRAGMA table_info(entries)")
+        }
+        if "parameters" not in columns:
+            # manifests from before the fingerprint, their entries are
+            # stale until converted again
+            self._connection.execute(
+                "ALTER TABLE entries ADD COLUMN parameters TEXT"
+            )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get_entry(
+        self, source_path: str, sample_type: str
+    ) -> Optional[ManifestEntry]:
+        """Provides the recorded entry for a source and sample type"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT source_path, sample_type, size, mtime_ns,"
+                " content_hash, bit_depth, sample_rate, force_mono,"
+                " output_path, parameters"
+                " FROM entries WHERE source_path = ? AND sample_type = ?",
+                (source_path, sample_type),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = ManifestEntry(*row)
+        entry.force_mono = bool(entry.force_mono)
+        return entry
+
+    def is_current(  # pylint: disable=too-many-arguments
+        self,
+        source_path: str,
+        sample_type: str,
+        bit_depth: Optional[int],
+        sample_rate: Optional[int],
+        force_mono: bool,
+        output_path: Optional[str],
+        require_output: bool = False,
+        parameters: Optional[str] = None,
+    ) -> bool:
+        """
+        True when the source and target parameters match the last recorded
+        conversion and its output is still in place. require_output makes
+        a source recorded without an output (it met the target) stale, for
+        runs that write one even then. Size and mtime decide without
+        opening the source, the content hash is only checked when the
+        mtime moved but the size didn't (a touch or a copy back)
+        """
+        entry = self.get_entry(source_path, sample_type)
+        if entry is None or (
+            entry.bit_depth,
+            entry.sample_rate,
+            entry.force_mono,
+            entry.parameters,
+        ) != (bit_depth, sample_rate, force_mono, parameters):
+            return False
+        if entry.output_path:
+            if (
+                entry.output_path != output_path
+                or not o_path.exists(entry.output_path)
+            ):
+                return False
+        elif require_output:
+            return False
+        try:
+            stat = o_stat(source_path)
+        except OSError:
+            return False
+        if stat.st_size != entry.size:
+            return False
+        if stat.st_mtime_ns == entry.mtime_ns:
+            return True
+        if entry.content_hash and hash_file(source_path) == entry.content_hash:
+            with self._lock:
+                self._connection.execute(
+                    "UPDATE entries SET mtime_ns = ?"
+                    " WHERE source_path = ? AND sample_type = ?",
+                    (stat.st_mtime_ns, source_path, sample_type),
+                )
+                self._commit_if_due()
+            return True
+        return False
+
+    def record(  # pylint: disable=too-many-arguments
+        self,
+        source_path: str,
+        sample_type: str,
+        bit_depth: Optional[int],
+        sample_rate: Optional[int],
+        force_mono: bool,
+        output_path: Optional[str],
+        content_hash: Optional[str] = None,
+        parameters: Optional[str] = None,
+    ) -> None:
+        """
+        Records a source as handled, output_path is None when the source
+        already met the target and nothing was written, an output recorded
+        earlier is kept so garbage collection can still find it
+        """
+        stat = o_stat(source_path)
+        with self._lock:
+            self._record(
+                source_path,
+                sample_type,
+                stat.st_size,
+                stat.st_mtime_ns,
+                content_hash,
+                bit_depth,
+                sample_rate,
+                int(force_mono),
+                output_path,
+                parameters,
+            )
+            self._commit_if_due()
+
+    def _record(self, *row) -> None:
+        self._connection.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (source_path, sample_type) DO UPDATE SET"
+            " size = excluded.size,"
+            " mtime_ns = excluded.mtime_ns,"
+            " content_hash = excluded.content_hash,"
+            " bit_depth = excluded.bit_depth,"
+            " sample_rate = excluded.sample_rate,"
+            " force_mono = excluded.force_mono,"
+            " parameters = excluded.parameters,"
+            " output_path = COALESCE(excluded.output_path, output_path)",
+            row,
+        )
+
+    def collect_garbage(self) -> List[str]:
+        """
+        Removes outputs, and their entries, whose source no longer exists
+        Returns the output paths that were deleted
+        """
+        removed = []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT source_path, sample_type, output_path FROM entries"
+            ).fetchall()
+            for source_path, sample_type, output_path in rows:
+                if o_path.exists(source_path):
+                    continue
+                if output_path and o_path.exists(output_path):
+                    o_remove(output_path)
+                    removed.append(output_path)
+                self._connection.execute(
+                    "DELETE FROM entries"
+                    " WHERE source_path = ? AND sample_type = ?",
+                    (source_path, sample_type),
+                )
+            self._connection.commit()
+        return removed
+
+    def close(self) -> None:
+        """Commits outstanding rows and closes the database"""
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def _commit_if_due(self) -> None:
+        self._pending += 1
+        if self._pending >= MANIFEST_COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending = 0
@@ -0,0 +1,120 @@
+import os
+from errno import EINVAL, ENOSYS, ENOTSUP, ENOTTY, EOPNOTSUPP, EXDEV
+from os import link as o_link
+from os import makedirs as o_makedirs
+from os import path as o_path
+from os import remove as o_remove
+from os import stat as o_stat
+from shutil import copyfile
+from typing import Optional, Set, Tuple
+
+from classes.atomic import atomic_path
+
+try:
+    import fcntl
+except ImportError:  # not available off posix, reflink is skipped
+    fcntl = None
+# Linux only, copy_file_range is skipped where it is missing
+o_copy_file_range = getattr(os, "copy_file_range", None)
+
+# ioctl request for cloning a whole file on btrfs/xfs/bcachefs
+FICLONE: int = 0x40049409
+PASS_THROUGH_METHODS: Tuple[str, ...] = (
+    "auto", "reflink", "copy_file_range", "hardlink", "copy"
+)
+# Tried in order by "auto", hardlink is only used when asked for since the
+# output then shares its inode with the source
+AUTO_PASS_THROUGH_METHODS: Tuple[str, ...] = tuple(
+    method
+    for method in ("reflink", "copy_file_range", "copy")
+    if method != "copy_file_range" or o_copy_file_range is not None
+)
+# errnos meaning "this filesystem pair can't do that", not a real failure
+_UNSUPPORTED_ERRNOS: Set[int] = {
+    EINVAL, ENOSYS, ENOTSUP, ENOTTY, EOPNOTSUPP, EXDEV
+}
+# (source device, destination device, method) combinations known to fail,
+# so each filesystem pair only pays for a failed attempt once per process
+_unsupported_methods: Set[Tuple[int, int, str]] = set()
+
+
+def reflink_file(source: str, destination: str) -> None:
+    """Clones source into destination sharing extents, no data is copied"""
+    if fcntl is None:
+        raise OSError(ENOSYS, "reflink is not available on this platform")
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def copy_range_file(source: str, destination: str) -> None:
+    """
+    Copies source into destination in kernel space, filesystems that
+    support it (NFS 4.2, btrfs, xfs) may do a server side copy or reflink
+    """
+    if o_copy_file_range is None:
+        raise OSError(
+            ENOSYS, "copy_file_range is not available on this platform"
+        )
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        remaining = o_stat(src.fileno()).st_size
+        while remaining > 0:
+            copied = o_copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def hardlink_file(source: str, destination: str) -> None:
+    """Links destination to the source inode"""
+    if o_path.lexists(destination):
+        o_remove(destination)
+    o_link(source, destination)
+
+
+_COPIERS = {
+    "reflink": reflink_file,
+    "copy_file_range": copy_range_file,
+    "hardlink": hardlink_file,
+    "copy": copyfile,
+}
+
+
+def materialize_file(
+    source: str,
+    destination: str,
+    method: str = "auto",
+) -> Optional[str]:
+    """
+    Helper function, places an unmodified copy of source at destination.
+        method: one of PASS_THROUGH_METHODS, "auto" picks the cheapest one
+            the source and destination filesystems support
+    The copy is made beside destination and renamed over it, so a copy
+    cut short never leaves a truncated destination.
+    Returns the method used, None when destination already is source
+    """
+    destination_dir = o_path.dirname(destination)
+    if destination_dir:
+        o_makedirs(destination_dir, exist_ok=True)
+    if o_path.exists(destination) and o_path.samefile(source, destination):
+        return None
+    devices = (
+        o_stat(source).st_dev,
+        o_stat(destination_dir if destination_dir else ".").st_dev,
+    )
+    candidates = (
+        AUTO_PASS_THROUGH_METHODS if method == "auto" else (method,)
+    )
+    for candidate in candidates:
+        if (*devices, candidate) in _unsupported_methods:
+            continue
+        try:
+            with atomic_path(destination) as partial_path:
+                _COPIERS[candidate](source, partial_path)
+            return candidate
+        except OSError as ex:
+            if method != "auto" or ex.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            _unsupported_methods.add((*devices, candidate))
+    raise OSError(
+        ENOTSUP, f"No pass through method could copy {source=} {destination=}"
+    )
@@ -0,0 +1,289 @@
+from dataclasses import dataclass, field
+from os import cpu_count
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from helpers import (
+    ConversionOptions,
+    ConversionResult,
+    fetch_cached_file,
+    make_output_directory,
+    needs_conversion,
+    pass_through_file,
+    record_transcoded_file,
+    resolve_target_file,
+    store_cached_file,
+)
+from classes.profiling import profile_file
+
+# Items waiting between two stages, each holds a decoded file so this bounds
+# the memory held by the pipeline
+DEFAULT_PIPELINE_QUEUE_SIZE: int = 4
+DEFAULT_IO_THREADS: int = 2
+# Seconds a blocked stage waits before checking if the run was stopped
+_POLL_INTERVAL: float = 0.1
+_END = object()
+
+
+@dataclass
+class StageStats:
+    """Dataclass for the counters of a single pipeline stage"""
+    name: str
+    workers: int
+    items: int = 0
+    busy_seconds: float = 0.0
+    queue_depth_samples: int = 0
+    queue_depth_total: int = 0
+    max_queue_depth: int = 0
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    def record(self, busy_seconds: float, queue_depth: int) -> None:
+        """Adds one processed item and the input queue depth it saw"""
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += busy_seconds
+            self.queue_depth_samples += 1
+            self.queue_depth_total += queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def get_summary(self, wall_seconds: float) -> Dict[str, Any]:
+        """Provides the stage counters, utilisation is busy / capacity"""
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "utilisation": round(
+                self.busy_seconds / (wall_seconds * self.workers), 3
+            ) if wall_seconds else 0.0,
+            "mean_queue_depth": round(
+                self.queue_depth_total / self.queue_depth_samples, 2
+            ) if self.queue_depth_samples else 0.0,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+@dataclass
+class PipelineItem:
+    """Dataclass for a file travelling between pipeline stages"""
+    result: ConversionResult
+    existing: Any = None
+    target: Any = None
+    metadata: Any = None
+    data: Any = None
+    sample_rate: Optional[int] = None
+    cache_key: Optional[str] = None
+
+
+class ConversionPipeline:
+    """
+    Runs conversions as read -> resample -> write stages on their own
+    threads, linked by bounded queues, so disk and CPU work overlap.
+        readers: threads probing, deciding and decoding files
+        resamplers: threads resampling decoded audio (numpy/soxr release
+            the GIL for the heavy lifting)
+        writers: threads encoding and writing outputs
+    Results are yielded in completion order
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        proc,
+        options: ConversionOptions,
+        readers: int = DEFAULT_IO_THREADS,
+        resamplers: Optional[int] = None,
+        writers: int = DEFAULT_IO_THREADS,
+        queue_size: int = DEFAULT_PIPELINE_QUEUE_SIZE,
+    ):
+        self.proc = proc
+        self.options = options
+        self.queue_size = queue_size
+        self.stats = [
+            StageStats("read", readers),
+            StageStats("resample", resamplers or cpu_count() or 1),
+            StageStats("write", writers),
+        ]
+        self.wall_seconds = 0.0
+        self._stop = Event()
+
+    def run(self, files: Iterable[str]) -> Iterator[ConversionResult]:
+        """
+        Converts files through the pipeline, closing the iterator early
+        stops every stage once its current item is done
+        """
+        self._stop.clear()
+        queues = [Queue(self.queue_size) for _ in range(3)]
+        results: Queue = Queue()
+        stages = [
+            (self._read, queues[0], queues[1]),
+            (self._resample, queues[1], queues[2]),
+            (self._write, queues[2], results),
+        ]
+        supervisor = Thread(
+            target=self._supervise,
+            args=(files, queues[0], stages, results),
+            daemon=True,
+        )
+        started = perf_counter()
+        supervisor.start()
+        try:
+            while True:
+                result = results.get()
+                if result is _END:
+                    break
+                yield result
+        finally:
+            self._stop.set()
+            supervisor.join()
+            self.wall_seconds = perf_counter() - started
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Provides the per stage summaries of the last run"""
+        return [
+            stage.get_summary(self.wall_seconds) for stage in self.stats
+        ]
+
+    def _supervise(self, files, first_queue, stages, results) -> None:
+        """
+        Feeds files in and shuts stages down in order, each stage gets one
+        end marker per worker once everything upstream of it has finished
+        """
+        workers = [
+            [
+                Thread(
+                    target=self._work,
+                    args=(work, inbound, outbound, stats, results),
+                    daemon=True,
+                )
+                for _ in range(stats.workers)
+            ]
+            for (work, inbound, outbound), stats in zip(stages, self.stats)
+        ]
+        for thread in (thread for stage in workers for thread in stage):
+            thread.start()
+        try:
+            for file in files:
+                if not self._put(first_queue, PipelineItem(
+                    ConversionResult(
+                        file_path=file, sample_type=self.proc.__name__
+                    )
+                )):
+                    break
+        except Exception as ex:  # pylint: disable=broad-except
+            results.put(ConversionResult(file_path="", exception=ex))
+        for (_, inbound, _), stage in zip(stages, workers):
+            for _ in stage:
+                self._put(inbound, _END)
+            for thread in stage:
+                thread.join()
+        results.put(_END)
+
+    def _work(  # pylint: disable=too-many-arguments
+        self,
+        work: Callable[[PipelineItem], Optional[PipelineItem]],
+        inbound: Queue,
+        outbound: Queue,
+        stats: StageStats,
+        results: Queue,
+    ) -> None:
+        """Worker loop shared by every stage"""
+        while True:
+            depth = inbound.qsize()
+            item = self._get(inbound)
+            if item is _END:
+                return
+            started = perf_counter()
+            result = item.result
+            with profile_file(result.file_path, self.options.profile) as (
+                records
+            ):
+                try:
+                    item = work(item)
+                except Exception as ex:  # pylint: disable=broad-except
+                    result.exception = ex
+                    item = result
+            if records:
+                # stages of one item run one after another, never at once
+                result.profile = (result.profile or []) + records
+            stats.record(perf_counter() - started, depth)
+            if isinstance(item, ConversionResult):
+                results.put(item)
+            elif not self._put(outbound, item):
+                return
+
+    def _read(self, item: PipelineItem):
+        """Read stage, decides on the conversion and decodes the source"""
+        result = item.result
+        item.existing, item.target = resolve_target_file(
+            result.file_path, self.proc, self.options, result
+        )
+        if not needs_conversion(item.existing, item.target, self.options):
+            if self.options.pass_through:
+                pass_through_file(
+                    result.file_path,
+                    item.target.file_path,
+                    self.options,
+                    result,
+                )
+            return result
+        item.metadata = item.existing.get_resample_metadata(item.target)
+        make_output_directory(item.target)
+        item.cache_key = fetch_cached_file(
+            item.existing, item.target, self.options, result
+        )
+        if result.cached:
+            return result
+        if item.existing.is_requantize_only(item.metadata):
+            # integer requantization is IO bound, done here in one pass
+            item.existing.requantize_audio_file(
+                item.target,
+                item.metadata,
+                dither=self.options.dither,
+                noise_shaping=self.options.noise_shaping,
+            )
+            record_transcoded_file(result, item.target)
+            store_cached_file(item.cache_key, result, self.options)
+            return result
+        item.data, item.sample_rate = item.existing.decode_audio_file(
+            item.metadata
+        )
+        return item
+
+    def _resample(self, item: PipelineItem) -> PipelineItem:
+        """Resample stage"""
+        item.data = item.existing.resample_audio_data(
+            item.data,
+            item.sample_rate,
+            item.metadata,
+            self.options.resampler,
+            self.options.quality,
+        )
+        return item
+
+    def _write(self, item: PipelineItem) -> ConversionResult:
+        """Write stage, encodes and writes the output"""
+        item.existing.write_audio_data(item.target, item.data, item.metadata)
+        record_transcoded_file(item.result, item.target)
+        store_cached_file(item.cache_key, item.result, self.options)
+        return item.result
+
+    def _put(self, queue: Queue, item) -> bool:
+        """Blocking put that gives up once the run is stopped"""
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get(self, queue: Queue):
+        """Blocking get, returns _END once the run is stopped"""
+        while not self._stop.is_set():
+            try:
+                return queue.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                continue
+        return _END
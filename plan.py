@@ -0,0 +1,198 @@
+import json
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, timezone
+from os import stat as o_stat
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from helpers import (
+    ConversionOptions,
+    ConversionResult,
+    get_output_file_path,
+    is_source_current,
+    needs_conversion,
+    resolve_target_file,
+)
+from manifest import ConversionManifest
+from classes.base_types import AudioData, AudioFile
+
+PLAN_VERSION: int = 1
+PLAN_ACTIONS: Tuple[str, ...] = ("convert", "requantize", "copy", "skip")
+# Bytes per sample of each subtype, frames are estimated from the file size
+# so planning never has to find the data chunk
+SUBTYPE_SAMPLE_BYTES: Dict[str, int] = {
+    "PCM_U8": 1,
+    "PCM_16": 2,
+    "PCM_24": 3,
+    "PCM_32": 4,
+    "FLOAT": 4,
+    "DOUBLE": 8,
+    "ALAW": 1,
+    "ULAW": 1,
+}
+# Canonical RIFF/fmt/data header, taken off the size before estimating
+WAVE_HEADER_BYTES: int = 44
+
+
+@dataclass
+class PlanEntry:  # pylint: disable=too-many-instance-attributes
+    """
+    Dataclass for what execution will do with one source and sample type.
+        action: one of PLAN_ACTIONS
+        size, mtime_ns: the source as probed, a source that changed since
+            is probed again when the plan is executed
+        estimated_cost: frames produced by the resampler (frames x rate
+            ratio), 0 for anything that isn't resampled or requantized
+        skip_reason: "unchanged", "compliant" or "error: ..." for skips
+    """
+    source_path: str
+    sample_type: str
+    action: str = "skip"
+    output_path: Optional[str] = None
+    size: int = 0
+    mtime_ns: int = 0
+    source: Optional[AudioData] = None
+    target: Optional[AudioData] = None
+    frames: Optional[int] = None
+    estimated_cost: float = 0.0
+    skip_reason: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]):
+        """Builds an entry back from its JSON form"""
+        values = dict(values)
+        for key in ("source", "target"):
+            if values.get(key):
+                values[key] = AudioData(**values[key])
+        return cls(**values)
+
+
+def estimate_frames(file: str, size: int, metadata: AudioData) -> int:
+    """
+    Helper function, estimates the frames in a source from its size, asks
+    SoundFile for the header when the subtype has no fixed sample width
+    """
+    sample_bytes = SUBTYPE_SAMPLE_BYTES.get(metadata.subtype)
+    if sample_bytes and metadata.number_of_channels:
+        return max(size - WAVE_HEADER_BYTES, 0) // (
+            sample_bytes * metadata.number_of_channels
+        )
+    import soundfile as sf  # pylint: disable=import-outside-toplevel
+
+    return sf.info(file).frames
+
+
+def get_source_frames(file: str, proc: AudioFile) -> int:
+    """
+    Helper function, estimated frames of a source from a header probe, 0
+    when it can't be probed
+    """
+    try:
+        return estimate_frames(
+            file,
+            o_stat(file).st_size,
+            proc(file).get_exisiting_wave_file_metadata(),
+        )
+    except Exception:  # pylint: disable=broad-except
+        return 0
+
+
+def plan_target_file(
+    file: str,
+    proc: AudioFile,
+    options: ConversionOptions,
+    manifest: Optional[ConversionManifest] = None,
+) -> PlanEntry:
+    """
+    Helper function, makes the conversion decision for a file from its
+    header alone. Nothing is decoded, hashed or written
+    """
+    entry = PlanEntry(source_path=file, sample_type=proc.__name__)
+    try:
+        stat = o_stat(file)
+        entry.size, entry.mtime_ns = stat.st_size, stat.st_mtime_ns
+        entry.output_path = get_output_file_path(file, proc, options)
+        if manifest and is_source_current(manifest, file, [proc], options):
+            entry.skip_reason = "unchanged"
+            return entry
+        existing, target = resolve_target_file(
+            file,
+            proc,
+            replace(options, hash_sources=False),
+            ConversionResult(file_path=file),
+        )
+        entry.source = existing.get_exisiting_wave_file_metadata()
+        entry.frames = estimate_frames(file, entry.size, entry.source)
+        if not needs_conversion(existing, target, options):
+            if options.pass_through:
+                entry.action = "copy"
+            else:
+                entry.skip_reason = "compliant"
+            return entry
+        entry.target = existing.get_resample_metadata(target)
+        entry.action = (
+            "requantize"
+            if existing.is_requantize_only(entry.target)
+            else "convert"
+        )
+        entry.estimated_cost = round(
+            entry.frames
+            * entry.target.sample_rate
+            / entry.source.sample_rate,
+            1,
+        )
+    except Exception as ex:  # pylint: disable=broad-except
+        entry.action = "skip"
+        entry.skip_reason = f"error: {ex}"
+    return entry
+
+
+def write_plan(
+    file_path: str,
+    parameters: Dict[str, Any],
+    entries: Iterable[PlanEntry],
+) -> Dict[str, int]:
+    """
+    Writes a plan as NDJSON, a header line holding the parameters it was
+    made with followed by one line per entry, written as they are produced
+    Returns the number of entries per action
+    """
+    counts = {action: 0 for action in PLAN_ACTIONS}
+    with open(file_path, "w", encoding="utf-8") as handle:
+        handle.write(json.dumps({
+            "version": PLAN_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(
+                timespec="seconds"
+            ),
+            "parameters": parameters,
+        }) + "\n")
+        for entry in entries:
+            counts[entry.action] += 1
+            handle.write(json.dumps(asdict(entry)) + "\n")
+    return counts
+
+
+def read_plan(file_path: str) -> Tuple[Dict[str, Any], List[PlanEntry]]:
+    """Reads a plan written by write_plan, returns (parameters, entries)"""
+    with open(file_path, "r", encoding="utf-8") as handle:
+        header = json.loads(handle.readline() or "{}")
+        if header.get("version") != PLAN_VERSION:
+            raise ValueError(
+                f"{file_path} is not a version {PLAN_VERSION} plan"
+            )
+        return header["parameters"], [
+            PlanEntry.from_dict(json.loads(line))
+            for line in handle
+            if line.strip()
+        ]
+
+
+def prime_metadata_cache(entry: PlanEntry, proc: AudioFile) -> None:
+    """
+    Helper function, hands the metadata probed at planning to proc's cache
+    so execution doesn't probe the source again. The key holds the size
+    and mtime seen at planning, a source changed since then misses
+    """
+    if entry.source:
+        proc.metadata_cache.put(
+            (entry.source_path, entry.size, entry.mtime_ns), entry.source
+        )
@@ -0,0 +1,184 @@
+import json
+from dataclasses import dataclass
+from glob import glob
+from hashlib import blake2b
+from heapq import heappop, heappush
+from os import path as o_path
+from os import replace as o_replace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+SHARD_MODES: Tuple[str, ...] = ("hash", "cost")
+SHARD_SUMMARY_PATTERN: str = ".neophyte_shard_*.json"
+# Summary fields added up when shards are merged, lists are concatenated
+SUMMED_SUMMARY_FIELDS: Tuple[str, ...] = (
+    "files",
+    "skipped",
+    "converted",
+    "copied",
+    "cached",
+    "failed",
+    "bytes_copied",
+    "bytes_transcoded",
+    "cost",
+)
+
+
+@dataclass(frozen=True)
+class Shard:
+    """Dataclass for one of count disjoint slices of a run, index is 1 based"""
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, text: str):
+        """Builds a shard from "i/N", raises ValueError when malformed"""
+        try:
+            index, count = (int(part) for part in text.split("/"))
+        except ValueError as ex:
+            raise ValueError(f"{text!r} is not in the form i/N") from ex
+        if not 1 <= index <= count:
+            raise ValueError(f"{text!r} needs 1 <= i <= N")
+        return cls(index, count)
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def get_label(self) -> str:
+        """Provides the shard as used in file names"""
+        return f"{self.index}_of_{self.count}"
+
+
+def get_shard_key(file: str, input_dir: str) -> str:
+    """
+    Helper function, the input relative path with / separators, the same
+    on every host whatever path the shared input is mounted at
+    """
+    return o_path.relpath(file, input_dir).replace(o_path.sep, "/")
+
+
+def get_stable_hash(key: str) -> int:
+    """Helper function, a hash that doesn't change between processes"""
+    return int.from_bytes(
+        blake2b(key.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def select_by_hash(
+    files: Iterable[str],
+    input_dir: str,
+    shard: Shard,
+) -> Iterator[str]:
+    """Yields the files of shard as they arrive, balanced by file count"""
+    for file in files:
+        if get_stable_hash(get_shard_key(file, input_dir)) % shard.count == (
+            shard.index - 1
+        ):
+            yield file
+
+
+def select_by_cost(
+    files: Iterable[str],
+    input_dir: str,
+    shard: Shard,
+    get_cost: Callable[[str], float],
+) -> Tuple[List[str], float]:
+    """
+    Provides the files of shard balanced by cost (e.g. frames) and their
+    total cost. Files go, most expensive first, to the least loaded shard,
+    ties broken by path and shard index so every host computes the same
+    split. Needs the cost of every file, so the whole input is listed
+    before anything is yielded
+    """
+    costed = sorted(
+        (-get_cost(file), get_shard_key(file, input_dir), file)
+        for file in files
+    )
+    # (load, shard index) of every shard, the least loaded pops first
+    loads = [(0.0, index) for index in range(shard.count)]
+    selected = []
+    selected_cost: float = 0
+    for negative_cost, _, file in costed:
+        load, index = heappop(loads)
+        heappush(loads, (load - negative_cost, index))
+        if index == shard.index - 1:
+            selected.append(file)
+            selected_cost -= negative_cost
+    return selected, selected_cost
+
+
+def get_shard_summary_path(output_dir: str, shard: Shard) -> str:
+    """Helper function, where a shard writes its summary"""
+    return o_path.join(
+        output_dir, SHARD_SUMMARY_PATTERN.replace("*", shard.get_label())
+    )
+
+
+def write_shard_summary(
+    output_dir: str,
+    shard: Shard,
+    summary: Dict[str, Any],
+) -> str:
+    """
+    Writes a shard's summary into the shared output dir, replaced in one
+    rename so a merge never reads half a file. Returns its path
+    """
+    file_path = get_shard_summary_path(output_dir, shard)
+    temporary_path = f"{file_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as handle:
+        json.dump(
+            dict(summary, shard=shard.index, shard_count=shard.count),
+            handle,
+            indent=2,
+        )
+        handle.write("\n")
+    o_replace(temporary_path, file_path)
+    return file_path
+
+
+def read_shard_summaries(output_dir: str) -> List[Dict[str, Any]]:
+    """Reads every shard summary in output_dir, ordered by shard"""
+    summaries = []
+    for file_path in glob(o_path.join(output_dir, SHARD_SUMMARY_PATTERN)):
+        with open(file_path, "r", encoding="utf-8") as handle:
+            summaries.append(json.load(handle))
+    return sorted(
+        summaries,
+        key=lambda summary: (summary["shard_count"], summary["shard"]),
+    )
+
+
+def merge_shard_summaries(
+    summaries: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Merges shard summaries into one report, shards missing from the
+    largest shard count found are listed so an incomplete run shows
+    """
+    shard_count = max(
+        (summary["shard_count"] for summary in summaries), default=0
+    )
+    merged: Dict[str, Any] = {
+        "shard_count": shard_count,
+        "shards": [summary["shard"] for summary in summaries],
+        "missing_shards": sorted(
+            set(range(1, shard_count + 1))
+            - {
+                summary["shard"]
+                for summary in summaries
+                if summary["shard_count"] == shard_count
+            }
+        ),
+        "mixed_shard_counts": len(
+            {summary["shard_count"] for summary in summaries}
+        ) > 1,
+        "wall_seconds": max(
+            (summary.get("wall_seconds", 0.0) for summary in summaries),
+            default=0.0,
+        ),
+        "failures": [],
+    }
+    for field in SUMMED_SUMMARY_FIELDS:
+        merged[field] = sum(summary.get(field, 0) for summary in summaries)
+    for summary in summaries:
+        merged["failures"].extend(summary.get("failures", []))
+    return merged
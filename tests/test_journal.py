@@ -0,0 +1,88 @@
+import json
+from os import path as o_path
+
+import pytest
+
+from journal import JOURNAL_FILENAME, ConversionJournal
+from classes.atomic import atomic_path, get_partial_path, is_partial_file
+
+PARAMETERS = {"sample_types": ["OctatrackSample"], "bit_depth": None}
+
+
+def write_journal(output_dir, *records):
+    """Helper function, a journal holding records, closed"""
+    with ConversionJournal(str(output_dir), PARAMETERS) as journal:
+        for record in records:
+            journal.record(*record)
+
+
+def test_resume_reads_done_sources(tmp_path):
+    write_journal(
+        tmp_path,
+        ("a.wav", "OctatrackSample", "done", "a_octa.wav"),
+        ("b.wav", "OctatrackSample", "failed", None, "boom"),
+        ("c.wav", "OctatrackSample", "done"),
+        ("c.wav", "OctatrackSample", "failed"),
+    )
+    with ConversionJournal(str(tmp_path), PARAMETERS, resume=True) as journal:
+        assert journal.is_done("a.wav", ["OctatrackSample"])
+        assert not journal.is_done("a.wav", ["OctatrackSample", "Other"])
+        assert not journal.is_done("b.wav", ["OctatrackSample"])
+        # the last record of a source wins
+        assert not journal.is_done("c.wav", ["OctatrackSample"])
+
+
+def test_resume_ignores_a_torn_trailing_line(tmp_path):
+    write_journal(tmp_path, ("a.wav", "OctatrackSample", "done"))
+    journal_path = tmp_path / JOURNAL_FILENAME
+    with open(journal_path, "a", encoding="utf-8") as handle:
+        handle.write('{"source_path": "b.wav", "sample_typ')
+    with ConversionJournal(str(tmp_path), PARAMETERS, resume=True) as journal:
+        assert journal.is_done("a.wav", ["OctatrackSample"])
+        assert not journal.is_done("b.wav", ["OctatrackSample"])
+        journal.record("b.wav", "OctatrackSample", "done")
+    # the torn line is closed off, so the new record is a line of its own
+    lines = journal_path.read_text(encoding="utf-8").splitlines()
+    assert lines[-2] == '{"source_path": "b.wav", "sample_typ'
+    assert json.loads(lines[-1])["source_path"] == "b.wav"
+    with ConversionJournal(str(tmp_path), PARAMETERS, resume=True) as journal:
+        assert journal.is_done("b.wav", ["OctatrackSample"])
+
+
+def test_resume_refuses_other_parameters(tmp_path):
+    write_journal(tmp_path, ("a.wav", "OctatrackSample", "done"))
+    with pytest.raises(ValueError, match="different parameters"):
+        ConversionJournal(
+            str(tmp_path), {**PARAMETERS, "bit_depth": 16}, resume=True
+        )
+
+
+def test_without_resume_the_journal_starts_over(tmp_path):
+    write_journal(tmp_path, ("a.wav", "OctatrackSample", "done"))
+    with ConversionJournal(str(tmp_path), PARAMETERS) as journal:
+        assert not journal.done
+    with ConversionJournal(str(tmp_path), PARAMETERS, resume=True) as journal:
+        assert not journal.is_done("a.wav", ["OctatrackSample"])
+
+
+def test_atomic_path_renames_into_place(tmp_path):
+    file_path = str(tmp_path / "out.wav")
+    with atomic_path(file_path) as partial_path:
+        assert partial_path == get_partial_path(file_path)
+        assert is_partial_file(o_path.basename(partial_path))
+        with open(partial_path, "wb") as handle:
+            handle.write(b"done")
+    assert (tmp_path / "out.wav").read_bytes() == b"done"
+    assert [path.name for path in tmp_path.iterdir()] == ["out.wav"]
+
+
+def test_atomic_path_leaves_nothing_when_interrupted(tmp_path):
+    file_path = tmp_path / "out.wav"
+    file_path.write_bytes(b"earlier")
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_path(str(file_path)) as partial_path:
+            with open(partial_path, "wb") as handle:
+                handle.write(b"trunc")
+            raise KeyboardInterrupt
+    assert file_path.read_bytes() == b"earlier"
+    assert [path.name for path in tmp_path.iterdir()] == ["out.wav"]
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from classes.pcm import map_pcm_data
+from classes.riff import WAVE_FORMAT_PCM
+from wave_files import make_chunk, make_extensible_fmt, make_fmt, write_wave
+
+
+def get_test_signal(frames: int = 1000, channels: int = 2) -> np.ndarray:
+    """Helper function, a deterministic full scale signal"""
+    rng = np.random.default_rng(1234)
+    return rng.uniform(-1.0, 1.0, (frames, channels))
+
+
+@pytest.mark.parametrize(
+    "subtype", ["PCM_U8", "PCM_16", "PCM_24", "PCM_32", "FLOAT"]
+)
+def test_map_pcm_data_reads_like_soundfile(tmp_path, subtype):
+    file_path = str(tmp_path / f"{subtype}.wav")
+    sf.write(file_path, get_test_signal(), 44100, subtype=subtype)
+    mapped = map_pcm_data(file_path)
+    assert (mapped.subtype, mapped.channels, mapped.frames) == (
+        subtype, 2, 1000
+    )
+    expected = sf.read(file_path, dtype="float32")[0]
+    np.testing.assert_array_equal(mapped.read_float32(), expected)
+    if subtype != "FLOAT":
+        expected = sf.read(file_path, dtype="int32")[0]
+        np.testing.assert_array_equal(mapped.read_int32(), expected)
+
+
+def test_map_pcm_data_blocks_cover_every_frame(tmp_path):
+    file_path = str(tmp_path / "blocks.wav")
+    sf.write(file_path, get_test_signal(), 48000, subtype="PCM_24")
+    mapped = map_pcm_data(file_path)
+    blocks = list(mapped.iter_blocks(300, "int32"))
+    assert [len(block) for block in blocks] == [300, 300, 300, 100]
+    np.testing.assert_array_equal(
+        np.concatenate(blocks), mapped.read_int32()
+    )
+
+
+def test_map_pcm_data_with_data_before_fmt(tmp_path):
+    samples = np.arange(-8, 8, dtype="<i2").reshape(-1, 2)
+    file_path = write_wave(
+        tmp_path,
+        make_chunk(b"data", samples.tobytes()),
+        make_extensible_fmt(WAVE_FORMAT_PCM, 2, 44100, 16),
+    )
+    mapped = map_pcm_data(file_path)
+    np.testing.assert_array_equal(
+        mapped.read_int32(), samples.astype(np.int32) << 16
+    )
+
+
+def test_map_pcm_data_bounds_data_by_the_file(tmp_path):
+    # streamed writers leave the data size at its maximum
+    body = b"\0\1" * 10
+    file_path = write_wave(
+        tmp_path,
+        make_fmt(channels=1),
+        b"data" + (0xFFFFFFFF).to_bytes(4, "little") + body,
+    )
+    assert map_pcm_data(file_path).frames == 10
+
+
+def test_map_pcm_data_leaves_the_rest_to_soundfile(tmp_path):
+    empty = write_wave(tmp_path, make_fmt(), make_chunk(b"data", b""))
+    no_data = write_wave(tmp_path, make_fmt(), name="no_data.wav")
+    alaw = write_wave(
+        tmp_path,
+        make_fmt(format_tag=0x0006, bits=8),
+        make_chunk(b"data", b"\0" * 4),
+        name="alaw.wav",
+    )
+    assert map_pcm_data(empty) is None
+    assert map_pcm_data(no_data) is None
+    assert map_pcm_data(alaw) is None
@@ -0,0 +1,140 @@
+from classes.riff import (
+    HEADER_PROBE_SIZE,
+    WAVE_FORMAT_IEEE_FLOAT,
+    WAVE_FORMAT_PCM,
+    probe_wave_header,
+    probe_wave_headers,
+    probe_wave_layout,
+)
+from wave_files import make_chunk, make_extensible_fmt, make_fmt, write_wave
+
+
+def test_probe_wave_header_reads_pcm(tmp_path):
+    file_path = write_wave(
+        tmp_path, make_fmt(bits=24), make_chunk(b"data", b"\0" * 12)
+    )
+    header = probe_wave_header(file_path)
+    assert header.format_tag == WAVE_FORMAT_PCM
+    assert (header.channels, header.sample_rate) == (2, 44100)
+    assert (header.bits_per_sample, header.block_align) == (24, 6)
+    assert header.subtype == "PCM_24"
+    # the data chunk is only located by probe_wave_layout
+    assert header.data_offset is None
+
+
+def test_probe_wave_header_skips_odd_sized_chunks(tmp_path):
+    file_path = write_wave(
+        tmp_path,
+        make_chunk(b"junk", b"x" * 7),
+        make_chunk(b"LIST", b"y" * 3),
+        make_fmt(channels=1, sample_rate=48000),
+    )
+    header = probe_wave_header(file_path)
+    assert (header.channels, header.sample_rate) == (1, 48000)
+    assert header.subtype == "PCM_16"
+
+
+def test_probe_wave_header_seeks_past_oversized_chunks(tmp_path):
+    file_path = write_wave(
+        tmp_path,
+        make_chunk(b"bext", b"b" * (HEADER_PROBE_SIZE * 3 + 1)),
+        make_fmt(format_tag=WAVE_FORMAT_IEEE_FLOAT, bits=32),
+    )
+    header = probe_wave_header(file_path)
+    assert header.subtype == "FLOAT"
+
+
+def test_probe_wave_header_reads_extensible(tmp_path):
+    file_path = write_wave(
+        tmp_path, make_extensible_fmt(WAVE_FORMAT_PCM, 2, 96000, 24)
+    )
+    header = probe_wave_header(file_path)
+    assert header.format_tag == WAVE_FORMAT_PCM
+    assert header.sample_rate == 96000
+    assert header.subtype == "PCM_24"
+
+
+def test_probe_wave_header_refuses_what_soundfile_should_read(tmp_path):
+    not_wave = tmp_path / "not.wav"
+    not_wave.write_bytes(b"ID3" + b"\0" * 64)
+    # IMA ADPCM has no subtype the probe knows
+    adpcm = write_wave(tmp_path, make_fmt(format_tag=0x11, bits=4))
+    no_fmt = write_wave(
+        tmp_path, make_chunk(b"data", b"\0" * 4), name="no_fmt.wav"
+    )
+    assert probe_wave_header(str(not_wave)) is None
+    assert probe_wave_header(adpcm) is None
+    assert probe_wave_header(no_fmt) is None
+    assert probe_wave_header(str(tmp_path / "missing.wav")) is None
+
+
+def test_probe_wave_headers_matches_single_probes(tmp_path):
+    file_paths = [
+        write_wave(tmp_path, make_fmt(bits=bits), name=f"{bits}.wav")
+        for bits in (8, 16, 32)
+    ]
+    headers = probe_wave_headers(file_paths)
+    assert list(headers) == file_paths
+    assert [header.subtype for header in headers.values()] == [
+        "PCM_U8", "PCM_16", "PCM_32",
+    ]
+
+
+def test_probe_wave_layout_finds_data_after_odd_chunks(tmp_path):
+    data = b"\1\2" * 9
+    file_path = write_wave(
+        tmp_path,
+        make_chunk(b"junk", b"x" * 5),
+        make_fmt(channels=1),
+        make_chunk(b"cue ", b"c" * 3),
+        make_chunk(b"data", data),
+    )
+    header = probe_wave_layout(file_path)
+    # RIFF header, junk (8 + 5 + pad), fmt (8 + 16), cue (8 + 3 + pad)
+    assert header.data_offset == 12 + 14 + 24 + 12 + 8
+    assert header.data_size == len(data)
+    with open(file_path, "rb") as handle:
+        handle.seek(header.data_offset)
+        assert handle.read(header.data_size) == data
+
+
+def test_probe_wave_layout_finds_data_before_fmt(tmp_path):
+    data = b"\0\1" * (HEADER_PROBE_SIZE * 2)
+    file_path = write_wave(
+        tmp_path, make_chunk(b"data", data), make_fmt(bits=16)
+    )
+    header = probe_wave_layout(file_path)
+    assert header.subtype == "PCM_16"
+    assert (header.data_offset, header.data_size) == (20, len(data))
+    # the header probe alone still finds the fmt chunk past the data
+    assert probe_wave_header(file_path).subtype == "PCM_16"
+
+
+def test_probe_wave_layout_seeks_past_oversized_chunks(tmp_path):
+    file_path = write_wave(
+        tmp_path,
+        make_fmt(),
+        make_chunk(b"LIST", b"l" * (HEADER_PROBE_SIZE + 3)),
+        make_chunk(b"data", b"\0" * 8),
+    )
+    header = probe_wave_layout(file_path)
+    assert header.data_offset == 12 + 24 + 8 + HEADER_PROBE_SIZE + 4 + 8
+    assert header.data_size == 8
+
+
+def test_probe_wave_layout_reads_extensible(tmp_path):
+    file_path = write_wave(
+        tmp_path,
+        make_extensible_fmt(WAVE_FORMAT_IEEE_FLOAT, 2, 48000, 32),
+        make_chunk(b"data", b"\0" * 16),
+    )
+    header = probe_wave_layout(file_path)
+    assert header.subtype == "FLOAT"
+    assert header.data_offset == 12 + 8 + 40 + 8
+
+
+def test_probe_wave_layout_without_data(tmp_path):
+    file_path = write_wave(tmp_path, make_fmt())
+    header = probe_wave_layout(file_path)
+    assert header.subtype == "PCM_16"
+    assert header.data_offset is None
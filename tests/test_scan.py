@@ -0,0 +1,26 @@
+from os import path as o_path
+
+import pytest
+
+from helpers import get_sample_processor, iter_target_files
+
+
+@pytest.mark.parametrize("sample_type", ["octa", "rample", "tracker"])
+def test_scanned_files_of_any_case_are_accepted(tmp_path, sample_type):
+    for name in ("a.wav", "b.WAV", "c.Wav", "d.wAvE", "e.mp3", "f.txt"):
+        (tmp_path / name).write_bytes(b"")
+    proc = get_sample_processor(sample_type)
+    files = sorted(
+        iter_target_files(str(tmp_path), proc.get_base_extensions())
+    )
+    assert [o_path.basename(file) for file in files] == [
+        "a.wav", "b.WAV", "c.Wav", "d.wAvE",
+    ]
+    for file in files:
+        assert proc(file).file_path == file
+
+
+def test_other_extensions_are_refused(tmp_path):
+    proc = get_sample_processor("octa")
+    with pytest.raises(ValueError):
+        proc(str(tmp_path / "a.mp3"))
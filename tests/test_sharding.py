@@ -0,0 +1,106 @@
+from os import path as o_path
+
+import pytest
+
+from sharding import (
+    Shard,
+    get_stable_hash,
+    merge_shard_summaries,
+    read_shard_summaries,
+    select_by_cost,
+    select_by_hash,
+    write_shard_summary,
+)
+
+FILE_NAMES = [
+    f"pack{pack}/hit{hit:02}.wav" for pack in range(4) for hit in range(25)
+]
+
+
+def get_files(input_dir: str):
+    """Helper function, the test input as found under input_dir"""
+    return [o_path.join(input_dir, file_name) for file_name in FILE_NAMES]
+
+
+def get_cost(file: str) -> int:
+    """Helper function, an uneven but deterministic cost per file"""
+    return 1000 + get_stable_hash(o_path.basename(file)) % 50000
+
+
+def test_shard_parse():
+    assert Shard.parse("2/3") == Shard(2, 3)
+    assert Shard(2, 3).get_label() == "2_of_3"
+    for text in ("0/3", "4/3", "1", "a/b"):
+        with pytest.raises(ValueError):
+            Shard.parse(text)
+
+
+def test_stable_hash_is_pinned():
+    # any change here reshuffles every host of a running sharded job
+    assert get_stable_hash("kits/kick.wav") == 12234531282144678285
+
+
+@pytest.mark.parametrize("select", ["hash", "cost"])
+def test_shards_split_the_input(select):
+    count = 3
+    selected = []
+    for index in range(1, count + 1):
+        shard = Shard(index, count)
+        if select == "hash":
+            selected.append(list(select_by_hash(
+                get_files("/mnt/a"), "/mnt/a", shard
+            )))
+        else:
+            selected.append(select_by_cost(
+                get_files("/mnt/a"), "/mnt/a", shard, get_cost
+            )[0])
+    files = [file for shard_files in selected for file in shard_files]
+    assert sorted(files) == sorted(get_files("/mnt/a"))
+    assert all(shard_files for shard_files in selected)
+
+
+@pytest.mark.parametrize("select", ["hash", "cost"])
+def test_shard_assignment_is_stable(select):
+    """Hosts see the input in any order and mounted anywhere"""
+    shard = Shard(2, 4)
+    assignments = []
+    for input_dir, files in (
+        ("/mnt/a", get_files("/mnt/a")),
+        ("/srv/b/", list(reversed(get_files("/srv/b")))),
+    ):
+        if select == "hash":
+            selected = select_by_hash(files, input_dir, shard)
+        else:
+            selected = select_by_cost(files, input_dir, shard, get_cost)[0]
+        assignments.append(
+            sorted(o_path.relpath(file, input_dir) for file in selected)
+        )
+    assert assignments[0] == assignments[1]
+
+
+def test_select_by_cost_balances_and_totals():
+    count = 4
+    totals = []
+    for index in range(1, count + 1):
+        files, cost = select_by_cost(
+            get_files("/mnt/a"), "/mnt/a", Shard(index, count), get_cost
+        )
+        assert cost == sum(get_cost(file) for file in files)
+        totals.append(cost)
+    # greedy largest first stays within one file of even
+    assert max(totals) - min(totals) <= max(map(get_cost, FILE_NAMES))
+
+
+def test_merge_lists_missing_shards(tmp_path):
+    for index in (1, 3):
+        write_shard_summary(
+            str(tmp_path),
+            Shard(index, 3),
+            {"files": 10, "failed": 1, "failures": [f"f{index}"]},
+        )
+    merged = merge_shard_summaries(read_shard_summaries(str(tmp_path)))
+    assert merged["shards"] == [1, 3]
+    assert merged["missing_shards"] == [2]
+    assert (merged["files"], merged["failed"]) == (20, 2)
+    assert merged["failures"] == ["f1", "f3"]
+    assert not merged["mixed_shard_counts"]
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from helpers import (
+    ConversionOptions,
+    convert_target_file,
+    get_sample_processor,
+)
+from classes.base_types import STREAM_RESAMPLE_TOLERANCE
+
+
+def write_tones(file_path: str, sample_rate: int, seconds: float = 2.0):
+    """Helper function, a stereo fixture of a few tones below 15khz"""
+    times = np.arange(int(sample_rate * seconds)) / sample_rate
+    left = sum(
+        0.2 * np.sin(2 * np.pi * frequency * times)
+        for frequency in (100, 1000, 5000, 14000)
+    )
+    right = 0.5 * np.sin(2 * np.pi * 440 * times)
+    sf.write(
+        file_path, np.stack([left, right], axis=1), sample_rate, "FLOAT"
+    )
+
+
+@pytest.mark.parametrize("sample_type", ["octa", "rample"])
+@pytest.mark.parametrize("block_size", [1000, 65536])
+def test_stream_matches_whole_file_resample(
+    tmp_path, sample_type, block_size
+):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    source = str(input_dir / "tones.wav")
+    write_tones(source, 48000)
+    proc = get_sample_processor(sample_type)
+    outputs = []
+    for name, streamed in (("whole", None), ("stream", block_size)):
+        result = convert_target_file(source, proc, ConversionOptions(
+            input_dir=str(input_dir),
+            output_dir=str(tmp_path / name),
+            sample_rate=44100,
+            block_size=streamed,
+        ))
+        assert result.exception is None and result.converted
+        outputs.append(sf.read(result.output_path)[0])
+    whole, stream = outputs
+    assert whole.shape == stream.shape
+    assert np.max(np.abs(whole - stream)) <= STREAM_RESAMPLE_TOLERANCE
@@ -0,0 +1,58 @@
+from struct import pack
+
+from classes.riff import WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_PCM
+
+# the SubFormat GUID of WAVE_FORMAT_EXTENSIBLE minus its leading format tag
+KSDATAFORMAT_SUFFIX = bytes.fromhex("000000001000800000aa00389b71")
+
+
+def make_chunk(chunk_id: bytes, body: bytes) -> bytes:
+    """Helper function, a RIFF chunk with its pad byte when odd sized"""
+    return chunk_id + pack("<I", len(body)) + body + b"\0" * (len(body) & 1)
+
+
+def make_fmt(
+    format_tag: int = WAVE_FORMAT_PCM,
+    channels: int = 2,
+    sample_rate: int = 44100,
+    bits: int = 16,
+) -> bytes:
+    """Helper function, a fmt chunk"""
+    block_align = channels * bits // 8
+    return make_chunk(b"fmt ", pack(
+        "<HHIIHH",
+        format_tag,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        bits,
+    ))
+
+
+def make_extensible_fmt(
+    format_tag: int, channels: int, sample_rate: int, bits: int
+) -> bytes:
+    """Helper function, a WAVE_FORMAT_EXTENSIBLE fmt chunk"""
+    block_align = channels * bits // 8
+    return make_chunk(b"fmt ", pack(
+        "<HHIIHHHHIH",
+        WAVE_FORMAT_EXTENSIBLE,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        bits,
+        22,
+        bits,
+        0x3,
+        format_tag,
+    ) + KSDATAFORMAT_SUFFIX)
+
+
+def write_wave(tmp_path, *chunks: bytes, name: str = "test.wav") -> str:
+    """Helper function, writes a RIFF WAVE file holding chunks"""
+    body = b"WAVE" + b"".join(chunks)
+    file_path = tmp_path / name
+    file_path.write_bytes(b"RIFF" + pack("<I", len(body)) + body)
+    return str(file_path)
@@ -0,0 +1,221 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from os import path as o_path
+from os import scandir as o_scandir
+from os import stat as o_stat
+from select import select
+from time import monotonic
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from classes.atomic import is_partial_file
+
+# Seconds a file must go without events, and keep its size, before it is
+# treated as completely written
+DEFAULT_SETTLE_SECONDS: float = 2.0
+# Bytes read from the inotify descriptor at once, fits hundreds of events
+WATCH_READ_SIZE: int = 64 << 10
+
+# from <sys/inotify.h>
+IN_MODIFY: int = 0x00000002
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_ONLYDIR: int = 0x01000000
+IN_ISDIR: int = 0x40000000
+IN_NONBLOCK: int = 0o4000
+IN_CLOEXEC: int = 0o2000000
+WATCH_MASK: int = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class DirectoryWatcher:
+    """
+    inotify watch on every directory under directory, reporting files with
+    one of file_extensions (ignoring case) as they are created, written or
+    moved in. Directories created later are watched as they appear and the
+    files already in them reported. Only directories hold a watch, so the
+    kernel side stays the size of the tree's directory count. Linux only,
+    raises OSError elsewhere
+    """
+
+    def __init__(self, directory: str, file_extensions: Iterable[str]):
+        self.directory = directory
+        self.extensions = {extension.lower() for extension in file_extensions}
+        self.overflowed = False
+        if not sys.platform.startswith("linux"):
+            raise OSError("watching needs inotify, which is Linux only")
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c"), use_errno=True
+        )
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._directories: Dict[int, str] = {}
+        # the tree's files are only walked for directories that appear
+        # after the watch started
+        for _ in self.add_tree(directory):
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def is_target_file(self, file_path: str) -> bool:
+        """Whether a path is a file this watch reports"""
+        name = o_path.basename(file_path)
+        return (
+            not is_partial_file(name)
+            and o_path.splitext(name)[1].lower() in self.extensions
+        )
+
+    def add_tree(self, directory: str) -> Iterator[str]:
+        """
+        Watches directory and every directory below it, yielding the
+        target files found along the way
+        """
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            watch = self._libc.inotify_add_watch(
+                self._fd,
+                os.fsencode(current),
+                WATCH_MASK | IN_ONLYDIR,
+            )
+            if watch < 0:
+                # removed or unreadable since it was seen, like os.walk
+                continue
+            self._directories[watch] = current
+            try:
+                with o_scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif self.is_target_file(entry.path):
+                            yield entry.path
+            except OSError:
+                continue
+
+    def read(self, timeout: Optional[float]) -> List[str]:
+        """
+        Waits up to timeout seconds (None blocks) for events, provides the
+        target files they name. Sets overflowed when the kernel dropped
+        events, the caller should then rescan
+        """
+        readable, _, _ = select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, WATCH_READ_SIZE)
+        except BlockingIOError:
+            return []
+        files = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            watch, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                # the directory is gone, so is its watch
+                self._directories.pop(watch, None)
+                continue
+            directory = self._directories.get(watch)
+            if directory is None or not name:
+                continue
+            file_path = o_path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    files.extend(self.add_tree(file_path))
+            elif self.is_target_file(file_path):
+                files.append(file_path)
+        return files
+
+    def close(self) -> None:
+        """Drops every watch"""
+        os.close(self._fd)
+        self._directories.clear()
+
+
+class SettleTracker:
+    """
+    Debounces files still being written: each event pushes a file's due
+    time settle seconds out, and a due file whose size moved since its
+    last event is pushed out again. Outputs the watcher itself wrote are
+    ignored for a while so they aren't picked up as new sources. Both maps
+    are emptied as files are handed out, memory follows the files in
+    flight rather than the uptime
+    """
+
+    def __init__(self, settle: float = DEFAULT_SETTLE_SECONDS):
+        self.settle = settle
+        self._pending: Dict[str, Tuple[float, int]] = {}
+        self._ignored: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, file_path: str, now: Optional[float] = None) -> None:
+        """Records an event for file_path"""
+        now = monotonic() if now is None else now
+        if self._ignored.get(file_path, 0.0) > now:
+            return
+        self._pending[file_path] = (
+            now + self.settle,
+            get_file_size(file_path),
+        )
+
+    def ignore(self, file_paths: Iterable[str], seconds: float) -> None:
+        """Drops events for file_paths during the next seconds"""
+        until = monotonic() + seconds
+        for file_path in file_paths:
+            self._ignored[file_path] = until
+            self._pending.pop(file_path, None)
+
+    def get_timeout(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next file is due, None when none is pending"""
+        if not self._pending:
+            return None
+        now = monotonic() if now is None else now
+        return max(min(due for due, _ in self._pending.values()) - now, 0.0)
+
+    def pop_settled(self, now: Optional[float] = None) -> List[str]:
+        """Provides and forgets the files that have settled, sorted"""
+        now = monotonic() if now is None else now
+        settled = []
+        for file_path, (due, size) in list(self._pending.items()):
+            if due > now:
+                continue
+            current_size = get_file_size(file_path)
+            if current_size < 0:
+                # deleted or moved away before it settled
+                del self._pending[file_path]
+            elif current_size != size:
+                self._pending[file_path] = (now + self.settle, current_size)
+            else:
+                del self._pending[file_path]
+                settled.append(file_path)
+        self._ignored = {
+            file_path: until
+            for file_path, until in self._ignored.items()
+            if until > now
+        }
+        return sorted(settled)
+
+
+def get_file_size(file_path: str) -> int:
+    """Helper function, a file's size or -1 when it is gone"""
+    try:
+        return o_stat(file_path).st_size
+    except OSError:
+        return -1